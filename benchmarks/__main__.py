@@ -0,0 +1,65 @@
+"""
+Runs the benchmarks:
+
+    python -m benchmarks [-k NAME ...] [--output results.json] [--compare old.json]
+
+Pass `--json-codec orjson` to measure with orjson (the speedups extra).
+"""
+
+import argparse
+import json
+import sys
+
+from oauth_helper.codec import set_json_codec
+
+from .runner import format_results, load, run_suite
+from .suite import BENCHMARKS
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "-k",
+        dest="filters",
+        action="append",
+        help="only run benchmarks whose name contains this (repeatable)",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--min-time", type=float, default=0.2, help="minimum seconds per run"
+    )
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks")
+    parser.add_argument("--json-codec", choices=["json", "orjson"], default="json")
+    args = parser.parse_args()
+    if args.json_codec == "orjson":
+        from oauth_helper.codec import orjson_codec
+
+        set_json_codec(orjson_codec)
+
+    names = list(BENCHMARKS)
+    if args.filters:
+        names = [n for n in names if any(f in n for f in args.filters)]
+    if args.list:
+        print("\n".join(names))
+        return
+    baseline = load(args.compare) if args.compare else None
+    report = run_suite(
+        names,
+        repeat=args.repeat,
+        min_time=args.min_time,
+        progress=lambda name: print(f"Running {name}", file=sys.stderr),
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_results(report, baseline))
+
+
+if __name__ == "__main__":
+    main()
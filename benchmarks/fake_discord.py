@@ -0,0 +1,173 @@
+"""
+A local stand-in for the parts of the Discord API the library uses, for
+load testing without hitting Discord.
+
+Point an application at it with the `api_base` config option of
+`oauth2_wrapper`.
+"""
+
+import asyncio
+import random
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from oauth_helper.codec import get_json_codec
+
+
+class FakeDiscord:
+    """
+    Serves the token endpoint, /users/@me and /users/@me/guilds.
+
+    Refresh tokens are rotated on every exchange, as Discord does, so a
+    refresh token can only be used once. Every response is delayed by
+    `latency` plus up to `jitter` seconds. A fraction `unauthorized_rate`
+    of API requests revoke the access token they were sent with and get a
+    401, as if it had expired, and a fraction `ratelimit_rate` get a 429
+    asking the client to retry after `retry_after` seconds.
+    """
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0.02,
+        jitter: float = 0.0,
+        unauthorized_rate: float = 0.0,
+        ratelimit_rate: float = 0.0,
+        retry_after: float = 0.05,
+        guild_count: int = 100,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.unauthorized_rate = unauthorized_rate
+        self.ratelimit_rate = ratelimit_rate
+        self.retry_after = retry_after
+        self.guilds: List[Dict[str, Any]] = [
+            {
+                "id": str(100000000000000000 + i),
+                "name": f"Guild {i}",
+                "icon": None,
+                "owner": False,
+                "permissions": str(0x20 if i % 4 == 0 else 0),
+                "features": [],
+            }
+            for i in range(guild_count)
+        ]
+        # Token -> user ID
+        self.refresh_tokens: Dict[str, int] = {}
+        self.access_tokens: Dict[str, int] = {}
+        self.stats: Counter[str] = Counter()
+        self._rng = random.Random(seed)
+        self._issued = 0
+
+    def bot(self) -> Any:
+        """A stand-in for a bot which is in every other guild."""
+        guilds = {
+            int(g["id"]): SimpleNamespace(id=int(g["id"])) for g in self.guilds[::2]
+        }
+        return SimpleNamespace(guilds=list(guilds.values()), get_guild=guilds.get)
+
+    def login(self, user_id: int) -> str:
+        """Returns a new refresh token for a user, as if they had logged in."""
+        return self._issue(user_id)["refresh_token"]
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/oauth2/token", self.token)
+        app.router.add_get("/users/@me", self.me)
+        app.router.add_get("/users/@me/guilds", self.guilds_page)
+        return app
+
+    def _issue(self, user_id: int) -> Dict[str, Any]:
+        self._issued += 1
+        access_token = f"access-{user_id}-{self._issued}"
+        refresh_token = f"refresh-{user_id}-{self._issued}"
+        self.access_tokens[access_token] = user_id
+        self.refresh_tokens[refresh_token] = user_id
+        return {
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "expires_in": 604800,
+            "scope": "identify guilds",
+            "token_type": "Bearer",
+        }
+
+    def reply(self, data: Any, status: int = 200, **headers: str) -> web.Response:
+        # discord.py only decodes bodies sent without a charset
+        return web.Response(
+            body=get_json_codec().dumps(data),
+            status=status,
+            content_type="application/json",
+            headers=headers,
+        )
+
+    async def delay(self) -> None:
+        await asyncio.sleep(self.latency + self._rng.random() * self.jitter)
+
+    async def token(self, request: web.Request) -> web.Response:
+        await self.delay()
+        data = await request.post()
+        user_id: Optional[int] = None
+        if data.get("grant_type") == "refresh_token":
+            user_id = self.refresh_tokens.pop(str(data.get("refresh_token")), None)
+        elif data.get("grant_type") == "authorization_code":
+            code = str(data.get("code", ""))
+            if code.startswith("code-"):
+                user_id = int(code[5:])
+        if user_id is None:
+            self.stats["invalid_grant"] += 1
+            return self.reply({"error": "invalid_grant"}, status=400)
+        self.stats["token_exchange"] += 1
+        return self.reply(self._issue(user_id))
+
+    def authenticate(self, request: web.Request) -> Optional[web.Response]:
+        token = request.headers.get("Authorization", "")[len("Bearer ") :]
+        if token not in self.access_tokens:
+            self.stats["401"] += 1
+            return self.reply({"message": "401: Unauthorized", "code": 0}, status=401)
+        if self._rng.random() < self.unauthorized_rate:
+            del self.access_tokens[token]
+            self.stats["401"] += 1
+            return self.reply({"message": "401: Unauthorized", "code": 0}, status=401)
+        if self._rng.random() < self.ratelimit_rate:
+            self.stats["429"] += 1
+            return self.reply(
+                {
+                    "message": "You are being rate limited.",
+                    "retry_after": self.retry_after,
+                    "global": False,
+                },
+                status=429,
+                Via="1.1 google",
+            )
+        return None
+
+    async def me(self, request: web.Request) -> web.Response:
+        await self.delay()
+        self.stats["/users/@me"] += 1
+        error = self.authenticate(request)
+        if error is not None:
+            return error
+        user_id = self.access_tokens[request.headers["Authorization"][7:]]
+        return self.reply(
+            {
+                "id": str(user_id),
+                "username": f"user{user_id}",
+                "discriminator": "0",
+                "avatar": None,
+            }
+        )
+
+    async def guilds_page(self, request: web.Request) -> web.Response:
+        await self.delay()
+        self.stats["/users/@me/guilds"] += 1
+        error = self.authenticate(request)
+        if error is not None:
+            return error
+        after = int(request.query.get("after", 0))
+        limit = int(request.query.get("limit", 200))
+        page = [g for g in self.guilds if int(g["id"]) > after]
+        return self.reply(page[:limit])
@@ -0,0 +1,242 @@
+"""
+Load tests a sample application against a local fake Discord API:
+
+    python -m benchmarks.load [--concurrency 1,8,32,128] [--duration 5] [--json]
+
+Both servers and the load generator run on the same event loop, so the
+numbers are for comparing runs on one machine rather than absolute
+capacity.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from oauth_helper import (
+    GuildIndex,
+    Response,
+    attach_user,
+    convert_response,
+    get_params,
+    oauth2_handler,
+    oauth2_wrapper,
+    oauth_middleware,
+    require_logged_in,
+)
+
+from .fake_discord import FakeDiscord
+from .runner import format_time
+
+# Path, method and share of the requests made
+ENDPOINTS = [("/me", "GET", 0.5), ("/guilds", "GET", 0.3), ("/sum", "POST", 0.2)]
+
+
+@require_logged_in
+async def me(request: web.Request) -> Response:
+    user = await request["user"].user_info()
+    return Response(id=str(user.id), name=user.name)
+
+
+@require_logged_in
+async def guilds(request: web.Request) -> Response:
+    return Response(guilds=len(await request["user"].manageable_guilds()))
+
+
+async def total(request: web.Request) -> Response:
+    params: Any = await get_params(request, {"values": List[int]})
+    return Response(total=sum(params.values))
+
+
+def sample_app(
+    api_base: str, bot: Any, *, stacked: bool = False, lazy: bool = False
+) -> web.Application:
+    config = {
+        "client_id": "1",
+        "client_secret": "secret",
+        "refresh_uri": "http://localhost/login",
+        "api_base": api_base,
+    }
+    wrapper = oauth2_wrapper(config, bot, guild_index=GuildIndex(bot))
+    middlewares: List[Any]
+    if stacked:
+        middlewares = [
+            convert_response([]),
+            oauth2_handler(config, bot, wrapper=wrapper, lazy=lazy),
+            attach_user,
+        ]
+    else:
+        middlewares = [oauth_middleware(config, bot, wrapper=wrapper, lazy=lazy)]
+    app = web.Application(middlewares=middlewares)
+    app.router.add_get("/me", me)  # type: ignore[arg-type]
+    app.router.add_get("/guilds", guilds)  # type: ignore[arg-type]
+    app.router.add_post("/sum", total)  # type: ignore[arg-type]
+    wrapper.setup(app)
+    return app
+
+
+def percentile(quantiles: List[float], p: int) -> float:
+    return quantiles[p - 1] if quantiles else 0.0
+
+
+async def run_level(
+    session: aiohttp.ClientSession,
+    url: str,
+    discord: FakeDiscord,
+    tokens: List[str],
+    concurrency: int,
+    duration: float,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """
+    Runs `concurrency` clients for `duration` seconds. Each client owns a
+    share of the users so no refresh token is used by two clients at once,
+    and keeps the rotated refresh tokens the application sends back.
+    """
+    latencies: List[float] = []
+    statuses: Counter[int] = Counter()
+    before = discord.stats.copy()
+    paths = [(path, method) for path, method, _ in ENDPOINTS]
+    weights = [weight for _, _, weight in ENDPOINTS]
+    end = time.perf_counter() + duration
+
+    async def client(index: int) -> None:
+        rng = random.Random(seed + index)
+        users = list(range(index, len(tokens), concurrency)) or [index % len(tokens)]
+        while time.perf_counter() < end:
+            user = rng.choice(users)
+            path, method = rng.choices(paths, weights)[0]
+            body = {"values": list(range(100))} if method == "POST" else None
+            start = time.perf_counter()
+            async with session.request(
+                method, url + path, json=body, headers={"Authorization": tokens[user]}
+            ) as res:
+                data = await res.json()
+            latencies.append(time.perf_counter() - start)
+            statuses[res.status] += 1
+            if "authorization" in data:
+                tokens[user] = data["authorization"]
+            elif res.status == 403:
+                # Logged out, so log in again
+                tokens[user] = discord.login(user)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else []
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50": percentile(quantiles, 50),
+        "p90": percentile(quantiles, 90),
+        "p99": percentile(quantiles, 99),
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "discord": dict(discord.stats - before),
+    }
+
+
+async def run(
+    concurrency: Sequence[int],
+    duration: float,
+    *,
+    users: int = 1000,
+    warmup: float = 1.0,
+    discord: Optional[FakeDiscord] = None,
+    stacked: bool = False,
+    lazy: bool = False,
+) -> List[Dict[str, Any]]:
+    if discord is None:
+        discord = FakeDiscord()
+    tokens = [discord.login(user) for user in range(users)]
+    async with TestServer(discord.app()) as discord_server:
+        api_base = str(discord_server.make_url("")).rstrip("/")
+        app = sample_app(api_base, discord.bot(), stacked=stacked, lazy=lazy)
+        async with TestServer(app) as app_server:
+            url = str(app_server.make_url("")).rstrip("/")
+            connector = aiohttp.TCPConnector(limit=0)
+            async with aiohttp.ClientSession(connector=connector) as session:
+                if warmup:
+                    await run_level(
+                        session, url, discord, tokens, concurrency[0], warmup
+                    )
+                return [
+                    await run_level(session, url, discord, tokens, level, duration)
+                    for level in concurrency
+                ]
+
+
+def format_levels(levels: List[Dict[str, Any]]) -> str:
+    lines = [
+        f"{'concurrency':>11} {'requests':>9} {'req/s':>9} "
+        f"{'p50':>10} {'p90':>10} {'p99':>10}  statuses (discord)"
+    ]
+    for level in levels:
+        statuses = " ".join(f"{k}:{v}" for k, v in level["statuses"].items())
+        discord = " ".join(
+            f"{k}:{v}" for k, v in sorted(level["discord"].items()) if k[0] != "/"
+        )
+        lines.append(
+            f"{level['concurrency']:>11} {level['requests']:>9} "
+            f"{level['throughput']:>9.1f} {format_time(level['p50']):>10} "
+            f"{format_time(level['p90']):>10} {format_time(level['p99']):>10}  "
+            f"{statuses} ({discord})"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load")
+    parser.add_argument(
+        "--concurrency",
+        default="1,8,32,128",
+        type=lambda s: [int(c) for c in s.split(",")],
+        help="comma separated concurrency levels",
+    )
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--unauthorized-rate", type=float, default=0.0)
+    parser.add_argument("--ratelimit-rate", type=float, default=0.0)
+    parser.add_argument("--stacked", action="store_true", help="unfused middlewares")
+    parser.add_argument("--lazy", action="store_true")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    discord = FakeDiscord(
+        latency=args.latency,
+        jitter=args.jitter,
+        unauthorized_rate=args.unauthorized_rate,
+        ratelimit_rate=args.ratelimit_rate,
+    )
+    levels = asyncio.run(
+        run(
+            args.concurrency,
+            args.duration,
+            users=args.users,
+            warmup=args.warmup,
+            discord=discord,
+            stacked=args.stacked,
+            lazy=args.lazy,
+        )
+    )
+    if args.json:
+        json.dump(levels, sys.stdout, indent=2)
+        print()
+    else:
+        print(format_levels(levels))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+import json
+import platform
+import statistics
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from oauth_helper.codec import get_json_codec
+
+from .suite import BENCHMARKS
+
+# Bump when the layout of the results changes
+FORMAT_VERSION = 1
+
+
+async def _run_async(func: Callable[[], Awaitable[Any]], loops: int) -> float:
+    start = time.perf_counter()
+    for _ in range(loops):
+        await func()
+    return time.perf_counter() - start
+
+
+def _run_sync(func: Callable[[], Any], loops: int) -> float:
+    start = time.perf_counter()
+    for _ in range(loops):
+        func()
+    return time.perf_counter() - start
+
+
+def measure(
+    func: Callable[[], Any],
+    loop: asyncio.AbstractEventLoop,
+    *,
+    repeat: int = 5,
+    min_time: float = 0.2,
+) -> Dict[str, Any]:
+    """
+    Times `func`, returning seconds per call. The number of calls per run is
+    picked like timeit.autorange, so each run takes at least `min_time`.
+    """
+    is_async = inspect.isawaitable(first := func())
+    if is_async:
+        loop.run_until_complete(first)
+
+    def run(loops: int) -> float:
+        if is_async:
+            return loop.run_until_complete(_run_async(func, loops))
+        return _run_sync(func, loops)
+
+    loops = 1
+    while True:
+        for multiple in (1, 2, 5):
+            elapsed = run(loops * multiple)
+            if elapsed >= min_time:
+                loops *= multiple
+                break
+        else:
+            loops *= 10
+            continue
+        break
+    timings = [elapsed / loops] + [run(loops) / loops for _ in range(repeat - 1)]
+    return {
+        "loops": loops,
+        "repeat": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+    }
+
+
+def run_suite(
+    names: Optional[List[str]] = None,
+    *,
+    repeat: int = 5,
+    min_time: float = 0.2,
+    progress: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results: Dict[str, Any] = {}
+    try:
+        for name, setup in BENCHMARKS.items():
+            if names is not None and name not in names:
+                continue
+            if progress is not None:
+                progress(name)
+            results[name] = measure(setup(), loop, repeat=repeat, min_time=min_time)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    return {
+        "format": FORMAT_VERSION,
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "json_codec": get_json_codec().name,
+        "time": time.time(),
+        "results": results,
+    }
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def format_results(
+    report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None
+) -> str:
+    lines = []
+    width = max((len(name) for name in report["results"]), default=0)
+    for name, result in report["results"].items():
+        line = f"{name:<{width}}  {format_time(result['median']):>10}"
+        line += f"  +-{result['stdev'] / result['median'] * 100:5.1f}%"
+        if baseline is not None and name in baseline["results"]:
+            ratio = result["median"] / baseline["results"][name]["median"]
+            line += f"  {ratio:5.2f}x"
+            if ratio > 1.1:
+                line += " slower"
+            elif ratio < 1 / 1.1:
+                line += " faster"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        report: Dict[str, Any] = json.load(f)
+    if report.get("format") != FORMAT_VERSION:
+        raise ValueError(f"{path} has an unsupported results format")
+    return report
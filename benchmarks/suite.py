@@ -0,0 +1,308 @@
+"""
+Microbenchmarks of the library's hot paths.
+
+Each benchmark is a function which sets up its inputs and returns the
+callable to time. Async callables are run on an event loop owned by the
+runner. Payloads are generated from a fixed seed so runs are comparable.
+"""
+
+import asyncio
+import random
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Union,
+)
+
+from aiohttp.test_utils import make_mocked_request
+from aiohttp.web import Application, Request
+
+from oauth_helper import (
+    Compression,
+    Response,
+    attach_user,
+    convert_response,
+    get_params,
+    oauth2_handler,
+    oauth_middleware,
+    require_logged_in,
+)
+from oauth_helper.cache import TokenCache
+from oauth_helper.codec import get_json_codec
+from oauth_helper.get_params import typecheck_single
+from oauth_helper.guilds import MANAGE_GUILD, GuildIndex, GuildList
+
+Benchmark = Callable[[], Union[Callable[[], Any], Callable[[], Awaitable[Any]]]]
+
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+def benchmark(name: str) -> Callable[[Benchmark], Benchmark]:
+    def register(func: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = func
+        return func
+
+    return register
+
+
+def guild_payloads(count: int, seed: int = 0) -> List[Any]:
+    rng = random.Random(seed)
+    return [
+        {
+            "id": str(100000000000000000 + i),
+            "name": f"Guild {i}",
+            "icon": "a" * 32 if rng.random() < 0.8 else None,
+            "owner": rng.random() < 0.02,
+            "permissions": str(rng.choice([0, 0x20, 0x8, 0x6546CE41, 0x400])),
+            "features": ["COMMUNITY", "NEWS"] if rng.random() < 0.3 else [],
+        }
+        for i in range(count)
+    ]
+
+
+def mocked_request(
+    method: str,
+    path: str,
+    body: Optional[bytes] = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> Request:
+    request = make_mocked_request(method, path, headers=headers)
+    if body is not None:
+        # get_params reads the body through Request.read(), which caches it here
+        request._read_bytes = body
+    return request
+
+
+# typecheck_single
+
+
+class Point(NamedTuple):
+    x: int
+    y: int
+
+
+class Shape(NamedTuple):
+    name: str
+    points: List[int]
+    colour: Optional[str]
+
+
+@benchmark("typecheck_single/int")
+def bench_typecheck_int() -> Callable[[], Any]:
+    return lambda: typecheck_single(5, int)
+
+
+@benchmark("typecheck_single/list_int_10k")
+def bench_typecheck_list() -> Callable[[], Any]:
+    values = list(range(10000))
+    return lambda: typecheck_single(values, List[int])
+
+
+@benchmark("typecheck_single/dict_str_int_10k")
+def bench_typecheck_dict() -> Callable[[], Any]:
+    values = {str(i): i for i in range(10000)}
+    return lambda: typecheck_single(values, Dict[str, int])
+
+
+@benchmark("typecheck_single/union_cast")
+def bench_typecheck_union() -> Callable[[], Any]:
+    return lambda: typecheck_single("12", Union[int, str], cast=True)  # type: ignore
+
+
+@benchmark("typecheck_single/nested_namedtuple")
+def bench_typecheck_namedtuple() -> Callable[[], Any]:
+    value = {"name": "square", "points": list(range(100)), "colour": None}
+    return lambda: typecheck_single(value, Shape)
+
+
+# get_params
+
+
+@benchmark("get_params/query_string")
+def bench_get_params_query() -> Callable[[], Awaitable[Any]]:
+    request = mocked_request("GET", "/search?guild_id=1234&query=abc&page=2")
+    annotations: Dict[str, Any] = {"guild_id": int, "query": str, "page": int}
+    return lambda: get_params(request, annotations)
+
+
+@benchmark("get_params/json_list_10k")
+def bench_get_params_list() -> Callable[[], Awaitable[Any]]:
+    body = get_json_codec().dumps({"ids": list(range(10000)), "name": "bulk"})
+    request = mocked_request("POST", "/bulk", body)
+    annotations: Dict[str, Any] = {"ids": List[int], "name": str}
+    return lambda: get_params(request, annotations)
+
+
+@benchmark("get_params/nested_namedtuples")
+def bench_get_params_nested() -> Callable[[], Awaitable[Any]]:
+    shapes = [
+        {"name": f"shape {i}", "points": list(range(20)), "colour": "red"}
+        for i in range(100)
+    ]
+    body = get_json_codec().dumps({"shapes": shapes, "origin": {"x": 1, "y": 2}})
+    request = mocked_request("POST", "/shapes", body)
+    annotations: Dict[str, Any] = {"shapes": List[Shape], "origin": Point}
+    return lambda: get_params(request, annotations)
+
+
+# TokenCache
+
+
+@benchmark("token_cache/get_hit")
+def bench_token_cache_hit() -> Callable[[], Awaitable[Any]]:
+    cache = TokenCache()
+    tokens = [f"refresh-{i}" for i in range(1000)]
+
+    async def fill() -> None:
+        for token in tokens:
+            await cache.add_access_token(token, f"access-{token}", 604800, "identify")
+
+    asyncio.get_event_loop().run_until_complete(fill())
+    return lambda: cache.get_token("refresh-500")
+
+
+@benchmark("token_cache/add")
+def bench_token_cache_add() -> Callable[[], Awaitable[Any]]:
+    cache = TokenCache(maxsize=1000)
+    counter = iter(range(10**9))
+    return lambda: cache.add_access_token(
+        f"refresh-{next(counter)}", "access", 604800, "identify guilds"
+    )
+
+
+# Response serialisation
+
+
+@benchmark("response/small")
+def bench_response_small() -> Callable[[], Any]:
+    return lambda: Response(ok=True, id=1234, name="name").to_response()
+
+
+@benchmark("response/guilds_1000")
+def bench_response_guilds() -> Callable[[], Any]:
+    guilds = guild_payloads(1000)
+    return lambda: Response(guilds=guilds).to_response()
+
+
+@benchmark("response/guilds_1000_cached")
+def bench_response_guilds_cached() -> Callable[[], Any]:
+    response = Response(guilds=guild_payloads(1000))
+    return response.to_response
+
+
+# Compression
+
+
+@benchmark("compression/guilds_1000_gzip")
+def bench_compression() -> Callable[[], Awaitable[Any]]:
+    compression = Compression()
+    request = mocked_request("GET", "/", headers={"Accept-Encoding": "gzip, deflate"})
+    response = Response(guilds=guild_payloads(1000))
+
+    async def run() -> Any:
+        # Compressed bytes are kept with the body, so discard them
+        response._compressed = None
+        await compression.apply(response, request, response.to_response())
+
+    return run
+
+
+@benchmark("compression/guilds_1000_reused")
+def bench_compression_reused() -> Callable[[], Awaitable[Any]]:
+    compression = Compression()
+    request = mocked_request("GET", "/", headers={"Accept-Encoding": "gzip, deflate"})
+    response = Response(guilds=guild_payloads(1000))
+    return lambda: compression.apply(response, request, response.to_response())
+
+
+# Guild lists
+
+
+@benchmark("guilds/manageable_1000")
+def bench_manageable_guilds() -> Callable[[], Any]:
+    guilds = guild_payloads(1000)
+    index = GuildIndex(None)
+    index._ids = {int(g["id"]) for g in guilds[::3]}
+
+    def run() -> Any:
+        # A new list each time so the memoised views aren't reused
+        return GuildList(guilds).mutual(index, MANAGE_GUILD)
+
+    return run
+
+
+@benchmark("guilds/manageable_1000_memoised")
+def bench_manageable_guilds_memoised() -> Callable[[], Any]:
+    guilds = guild_payloads(1000)
+    index = GuildIndex(None)
+    index._ids = {int(g["id"]) for g in guilds[::3]}
+    guild_list = GuildList(guilds)
+    return lambda: guild_list.mutual(index, MANAGE_GUILD)
+
+
+# Middleware chain
+
+
+class CachedOauth2:
+    """A wrapper whose tokens are always in the cache."""
+
+    def __init__(self, refresh_token: str):
+        self.refresh_token = refresh_token
+
+    @classmethod
+    async def from_refresh_token(
+        cls, refresh_token: str, redirect_uri: str
+    ) -> "CachedOauth2":
+        return cls(refresh_token)
+
+    @classmethod
+    async def from_code(cls, code: str, redirect_uri: str) -> "CachedOauth2":
+        raise NotImplementedError
+
+
+@require_logged_in
+async def handler(request: Request) -> Response:
+    return Response(ok=True)
+
+
+def chain(middlewares: List[Any]) -> Callable[[Request], Awaitable[Any]]:
+    app = Application()
+
+    async def run(request: Request) -> Any:
+        # As aiohttp does for old style middlewares, on every request
+        wrapped: Any = handler
+        for middleware in reversed(middlewares):
+            wrapped = await middleware(app, wrapped)
+        return await wrapped(request)
+
+    return run
+
+
+CONFIG = {"refresh_uri": "http://localhost"}
+
+
+@benchmark("middleware/stacked")
+def bench_middleware_stacked() -> Callable[[], Awaitable[Any]]:
+    run = chain(
+        [
+            convert_response([]),
+            oauth2_handler(CONFIG, bot=None, wrapper=CachedOauth2),  # type: ignore
+            attach_user,
+        ]
+    )
+    request = mocked_request("GET", "/", headers={"Authorization": "token"})
+    return lambda: run(request)
+
+
+@benchmark("middleware/fused")
+def bench_middleware_fused() -> Callable[[], Awaitable[Any]]:
+    run = chain(
+        [oauth_middleware(CONFIG, bot=None, wrapper=CachedOauth2)]  # type: ignore
+    )
+    request = mocked_request("GET", "/", headers={"Authorization": "token"})
+    return lambda: run(request)
@@ -1,18 +1,70 @@
+from .codec import JSONCodec, get_json_codec, set_json_codec
+from .metrics import (
+    MetricsSink,
+    MemorySink,
+    PrometheusSink,
+    get_metrics_sink,
+    set_metrics_sink,
+)
 from .response import Response, TextResponse, HTTPError, convert_response
+from .compression import Compression
 from .oauth2 import oauth2_handler, oauth2_wrapper
 from .login import require_logged_in, attach_user, User, not_logged_in_error
+from .middleware import oauth_middleware, RequestContext, get_context
+from .response_cache import ResponseCache
 from .get_params import get_params
+from .http import HTTPPool, RateLimits
+from .admission import AdmissionControl
+from .breaker import CircuitBreaker
+from .cache import NegativeCache, GuildCache, UserCache
+from .refresher import TokenRefresher
+from .profiling import SlowRequestRecorder, StackSampler
+from .members import MemberResolver
+from .guilds import GuildIndex
+from .joins import JoinResult, JoinStats
+from .backends import CacheBackend, MemoryBackend, SQLiteBackend, RedisBackend
 
 __all__ = [
     "Response",
     "TextResponse",
     "HTTPError",
     "convert_response",
+    "Compression",
     "oauth2_handler",
     "oauth2_wrapper",
     "require_logged_in",
     "attach_user",
     "User",
     "not_logged_in_error",
+    "oauth_middleware",
+    "RequestContext",
+    "get_context",
+    "ResponseCache",
     "get_params",
+    "HTTPPool",
+    "RateLimits",
+    "AdmissionControl",
+    "CircuitBreaker",
+    "NegativeCache",
+    "GuildCache",
+    "UserCache",
+    "TokenRefresher",
+    "SlowRequestRecorder",
+    "StackSampler",
+    "MemberResolver",
+    "GuildIndex",
+    "JoinResult",
+    "JoinStats",
+    "CacheBackend",
+    "MemoryBackend",
+    "SQLiteBackend",
+    "RedisBackend",
+    "JSONCodec",
+    "get_json_codec",
+    "set_json_codec",
+    "MetricsSink",
+    "MemorySink",
+    "PrometheusSink",
+    "get_metrics_sink",
+    "set_metrics_sink",
 ]
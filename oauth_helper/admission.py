@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from types import TracebackType
+from typing import Callable, List, Optional, Type
+
+from cachetools import LRUCache
+
+from . import metrics
+from .cache import fingerprint
+from .response import HTTPError
+
+
+class ConcurrencyLimit:
+    """
+    Lets `limit` operations run at once, with up to `max_queue` more waiting
+    for a slot. Anything beyond that, or waiting longer than `timeout`
+    seconds, is shed with a 503 rather than piling up on the event loop.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        max_queue: int = 1024,
+        timeout: Optional[float] = None,
+    ):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    def _shed(self, reason: str) -> HTTPError:
+        if metrics.sink is not None:
+            metrics.sink.inc(
+                "oauth_helper_shed_total", (("limit", self.name), ("reason", reason))
+            )
+        return HTTPError(status=503, message="Too busy, try again later")
+
+    async def __aenter__(self) -> None:
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                raise self._shed("queue")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                raise self._shed("timeout") from None
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+
+
+class RateLimiter:
+    """
+    A token bucket per key, refilling at `rate` per second up to `burst`.
+
+    Only fingerprints of the keys are kept, for the least recently used
+    `maxsize` of them.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        maxsize: int = 10000,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.timer = timer
+        # Fingerprint -> [tokens, last updated]
+        self._buckets: LRUCache[bytes, List[float]] = LRUCache(maxsize=maxsize)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def acquire(self, key: str) -> float:
+        """
+        Takes a token from `key`'s bucket, returning 0 if there was one or
+        else how many seconds until there will be.
+        """
+        now = self.timer()
+        fp = fingerprint(key)
+        bucket = self._buckets.get(fp)
+        if bucket is None:
+            bucket = self._buckets[fp] = [self.burst, now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return (1 - tokens) / self.rate
+        bucket[0] = tokens - 1
+        return 0.0
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+
+class AdmissionControl:
+    """
+    Limits on the work done for logged in requests.
+
+    At most `token_exchanges` refresh or code exchanges with Discord, and
+    `discord_calls` API requests made with users' tokens, run at once.
+    Each queues up to `max_queue` more for at most `queue_timeout` seconds
+    before shedding with a 503. With `rate` set, each Authorization header
+    may be used for `rate` requests per second (bursting to `burst`)
+    before getting a 429, checked before any network work is done.
+    """
+
+    def __init__(
+        self,
+        *,
+        token_exchanges: int = 64,
+        discord_calls: int = 512,
+        max_queue: int = 1024,
+        queue_timeout: Optional[float] = None,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self.token_exchanges = ConcurrencyLimit(
+            "token_exchanges", token_exchanges, max_queue, queue_timeout
+        )
+        self.discord_calls = ConcurrencyLimit(
+            "discord_calls", discord_calls, max_queue, queue_timeout
+        )
+        self.rate_limiter = (
+            None
+            if rate is None
+            else RateLimiter(
+                rate, max(rate, 1) if burst is None else burst, timer=timer
+            )
+        )
+
+    def check_rate(self, auth: str) -> None:
+        if self.rate_limiter is None:
+            return
+        retry_after = self.rate_limiter.acquire(auth)
+        if retry_after:
+            if metrics.sink is not None:
+                metrics.sink.inc("oauth_helper_rate_limited_total")
+            raise HTTPError(
+                status=429,
+                message="Too many requests",
+                retry_after=round(retry_after, 3),
+            )
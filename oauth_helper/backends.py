@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Protocol, Tuple, Union
+
+from cachetools import TLRUCache
+
+
+class CacheBackend(Protocol):
+    """
+    A key/value store with per-key expiry which the token and user caches can
+    be stored in. Values are opaque bytes.
+
+    Sharing a backend shares cached tokens. As Discord rotates refresh
+    tokens, only one exchange of each can succeed, so workers take a lease
+    before redeeming one and the others wait for the successor it stores.
+    """
+
+    async def get(self, key: str) -> Optional[bytes]: ...
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None: ...
+
+    async def delete(self, key: str) -> None: ...
+
+    async def lease(self, key: str, ttl: float) -> bool:
+        """
+        Sets `key` only if it isn't set already, returning whether it was.
+        `delete` releases the lease, and it's released after `ttl` anyway in
+        case its holder dies.
+        """
+        ...
+
+    async def close(self) -> None: ...
+
+
+class MemoryBackend:
+    """An in-process backend, mostly useful for testing."""
+
+    def __init__(self, maxsize: int = 100000):
+        self._cache: TLRUCache[str, Tuple[bytes, float]] = TLRUCache(
+            maxsize=maxsize,
+            ttu=lambda key, value, now: now + value[1],
+            timer=time.monotonic,
+        )
+
+    async def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self._cache[key][0]
+        except KeyError:
+            return None
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._cache[key] = (value, ttl)
+
+    async def delete(self, key: str) -> None:
+        self._cache.pop(key, None)
+
+    async def lease(self, key: str, ttl: float) -> bool:
+        if key in self._cache:
+            return False
+        self._cache[key] = (b"", ttl)
+        return True
+
+    async def close(self) -> None:
+        self._cache.clear()
+
+
+class SQLiteBackend:
+    """
+    A backend stored in an SQLite file, which lets every worker process on a
+    host share one cache.
+
+    All queries run on a single dedicated thread so a locked database never
+    blocks the event loop.
+    """
+
+    # Expired rows are deleted once every this many writes
+    vacuum_every = 1000
+
+    def __init__(self, path: str, timeout: float = 5):
+        self.path = path
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="oauth_helper-sqlite"
+        )
+        self._db: Optional[sqlite3.Connection] = None
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)"
+            )
+            self._db = db
+        return self._db
+
+    def _get(self, key: str) -> Optional[bytes]:
+        row = (
+            self._connect()
+            .execute(
+                "SELECT value FROM cache WHERE key = ? AND expires > ?",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        return None if row is None else bytes(row[0])
+
+    def _set(self, key: str, value: bytes, ttl: float) -> None:
+        db = self._connect()
+        now = time.time()
+        db.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, value, now + ttl),
+        )
+        self._writes += 1
+        if self._writes % self.vacuum_every == 0:
+            db.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+
+    def _delete(self, key: str) -> None:
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def _lease(self, key: str, ttl: float) -> bool:
+        db = self._connect()
+        now = time.time()
+        db.execute("DELETE FROM cache WHERE key = ? AND expires <= ?", (key, now))
+        # Only one of the workers racing for it inserts the row
+        cursor = db.execute(
+            "INSERT OR IGNORE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, b"", now + ttl),
+        )
+        return cursor.rowcount == 1
+
+    def _close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def get(self, key: str) -> Optional[bytes]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._get, key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._set, key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._delete, key)
+
+    async def lease(self, key: str, ttl: float) -> bool:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._lease, key, ttl)
+
+    async def close(self) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._close)
+        self._executor.shutdown()
+
+
+class RedisError(Exception):
+    pass
+
+
+_Connection = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class RedisBackend:
+    """
+    A backend stored in a Redis protocol (RESP2) server.
+
+    Only GET, SET (with PX and NX) and DEL are used, so any server speaking the protocol
+    (Redis, Valkey, KeyDB, Dragonfly) works. Up to `pool_size` connections
+    are kept open and reused.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 6379,
+        *,
+        db: int = 0,
+        password: Optional[str] = None,
+        pool_size: int = 8,
+    ):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self._idle: List[_Connection] = []
+        self._semaphore = asyncio.Semaphore(pool_size)
+
+    async def _connect(self) -> _Connection:
+        connection = await asyncio.open_connection(self.host, self.port)
+        try:
+            if self.password is not None:
+                await self._execute(connection, "AUTH", self.password)
+            if self.db:
+                await self._execute(connection, "SELECT", str(self.db))
+        except BaseException:
+            connection[1].close()
+            raise
+        return connection
+
+    async def command(self, *args: Union[str, bytes]) -> Any:
+        async with self._semaphore:
+            connection = self._idle.pop() if self._idle else await self._connect()
+            try:
+                rtn = await self._execute(connection, *args)
+            except RedisError:
+                self._idle.append(connection)
+                raise
+            except BaseException:
+                # The connection may have a reply left unread
+                connection[1].close()
+                raise
+            self._idle.append(connection)
+            return rtn
+
+    async def _execute(self, connection: _Connection, *args: Union[str, bytes]) -> Any:
+        reader, writer = connection
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg.encode() if isinstance(arg, str) else arg
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        writer.write(b"".join(parts))
+        await writer.drain()
+        return await self._read_reply(reader)
+
+    async def _read_reply(self, reader: asyncio.StreamReader) -> Any:
+        line = await reader.readuntil(b"\r\n")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b"+":
+            return rest.decode()
+        if prefix == b"-":
+            raise RedisError(rest.decode())
+        if prefix == b":":
+            return int(rest)
+        if prefix == b"$":
+            length = int(rest)
+            if length == -1:
+                return None
+            return (await reader.readexactly(length + 2))[:-2]
+        if prefix == b"*":
+            length = int(rest)
+            if length == -1:
+                return None
+            return [await self._read_reply(reader) for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply: {line!r}")
+
+    async def get(self, key: str) -> Optional[bytes]:
+        rtn: Optional[bytes] = await self.command("GET", key)
+        return rtn
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self.command("SET", key, value, "PX", str(max(1, int(ttl * 1000))))
+
+    async def delete(self, key: str) -> None:
+        await self.command("DEL", key)
+
+    async def lease(self, key: str, ttl: float) -> bool:
+        # A nil reply means the key is set already
+        rtn = await self.command(
+            "SET", key, b"", "NX", "PX", str(max(1, int(ttl * 1000)))
+        )
+        return rtn is not None
+
+    async def close(self) -> None:
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
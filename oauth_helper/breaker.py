@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from types import TracebackType
+from typing import Callable, Optional, Type
+
+import aiohttp
+
+from . import metrics
+from .response import HTTPError
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    """
+    Stops calling an endpoint which keeps failing.
+
+    After `failure_threshold` consecutive failures (connection errors,
+    timeouts and 5xx responses raised as aiohttp.ClientResponseError) the
+    circuit opens, and calls fail straight away with a 503 HTTPError. Once
+    `recovery_time` seconds have passed a single call is let through as a
+    probe: if it succeeds the circuit closes again, otherwise it stays open
+    for another `recovery_time`.
+
+        async with breaker:
+            ...
+    """
+
+    def __init__(
+        self,
+        name: str = "token",
+        failure_threshold: int = 5,
+        recovery_time: float = 30.0,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.timer = timer
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return CLOSED
+        if self._probing or self.timer() >= self._opened_at + self.recovery_time:
+            return HALF_OPEN
+        return OPEN
+
+    def _transition(self, state: str) -> None:
+        if metrics.sink is not None:
+            metrics.sink.inc(
+                "oauth_helper_circuit_transitions_total",
+                (("circuit", self.name), ("state", state)),
+            )
+
+    async def __aenter__(self) -> None:
+        if self._opened_at is None:
+            return
+        if self._probing or self.timer() < self._opened_at + self.recovery_time:
+            if metrics.sink is not None:
+                metrics.sink.inc(
+                    "oauth_helper_circuit_rejections_total", (("circuit", self.name),)
+                )
+            raise HTTPError(
+                status=503, message="Discord is unavailable, try again later"
+            )
+        self._probing = True
+        self._transition(HALF_OPEN)
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        probing, self._probing = self._probing, False
+        if exc_type is None:
+            self.failures = 0
+            if self._opened_at is not None:
+                self._opened_at = None
+                self._transition(CLOSED)
+        elif issubclass(exc_type, (aiohttp.ClientError, asyncio.TimeoutError)):
+            self.failures += 1
+            if probing or (
+                self._opened_at is None and self.failures >= self.failure_threshold
+            ):
+                self._opened_at = self.timer()
+                self._transition(OPEN)
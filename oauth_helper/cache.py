@@ -0,0 +1,584 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import sys
+import time
+from itertools import islice
+from typing import (
+    Callable,
+    Dict,
+    List,
+    MutableMapping,
+    Optional,
+    Protocol,
+    Tuple,
+    TYPE_CHECKING,
+    Union,
+)
+
+from cachetools import LRUCache, TTLCache
+from discord import User
+
+from .backends import CacheBackend
+from .guilds import GuildList
+
+if TYPE_CHECKING:
+    from discord.types.guild import Guild as GuildPayload
+    from discord.types.user import User as UserPayload
+
+
+def fingerprint(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+class NotInCacheError(Exception):
+    pass
+
+
+class NegativeCache:
+    """
+    Remembers tokens which Discord recently rejected.
+
+    Only a fixed width fingerprint of each token is kept, so a flood of
+    distinct garbage tokens costs at most `maxsize` small entries.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        ttl: float = 60,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self._cache: MutableMapping[bytes, bool] = TTLCache(
+            maxsize=maxsize, ttl=ttl, timer=timer
+        )
+
+    def __contains__(self, token: str) -> bool:
+        return fingerprint(token) in self._cache
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def add(self, token: str) -> None:
+        self._cache[fingerprint(token)] = True
+
+    def discard(self, token: str) -> None:
+        self._cache.pop(fingerprint(token), None)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+class TokenCacheProtocol(Protocol):
+    # Whether the statistics `expiring` goes by are kept
+    track_usage: bool
+
+    async def get_token(self, refresh_token: str) -> Dict[str, str]: ...
+
+    async def add_access_token(
+        self,
+        refresh_token: str,
+        access_token: str,
+        expires: int,
+        scope: str,
+    ) -> None: ...
+
+    async def add_successor(self, refresh_token: str, successor: str) -> None:
+        """
+        Points a rotated refresh token at its replacement, so clients still
+        sending the old token are handed the new one instead of failing.
+        """
+
+    async def discard(self, refresh_token: str) -> None: ...
+
+    async def expiring(
+        self, within: float, min_hits: int, max_idle: float
+    ) -> List[str]:
+        """
+        Returns current refresh tokens expiring in the next `within` seconds
+        which were used at least `min_hits` times, most recently in the last
+        `max_idle` seconds.
+        """
+
+
+class _TokenEntry:
+    __slots__ = ("access_token", "scope", "expires")
+
+    def __init__(self, access_token: str, scope: str, expires: float):
+        self.access_token = access_token
+        self.scope = scope
+        self.expires = expires
+
+
+class _UsageEntry(_TokenEntry):
+    """An entry with the usage statistics TokenRefresher picks tokens by."""
+
+    __slots__ = ("refresh_token", "hits", "last_used")
+
+    def __init__(
+        self, refresh_token: str, access_token: str, scope: str, expires: float
+    ):
+        super().__init__(access_token, scope, expires)
+        self.refresh_token = refresh_token
+        self.hits = 0
+        self.last_used = 0.0
+
+
+class TokenCache:
+    """
+    An in-process token cache bounded to `maxsize` entries.
+
+    Entries are keyed by token fingerprint and evicted least recently used
+    first, or once expired. Expired entries are swept at most once every
+    `sweep_interval` seconds when a token is added. A rotated refresh token
+    maps to its successor. Usage statistics are only kept once
+    `track_usage` is set, which TokenRefresher does.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 100000,
+        sweep_interval: float = 60,
+        *,
+        track_usage: bool = False,
+    ):
+        self.maxsize = maxsize
+        self.sweep_interval = sweep_interval
+        self.track_usage = track_usage
+        # Kept in least recently used order by popping and reinserting keys.
+        # A rotated refresh token maps to its successor.
+        self._cache: Dict[bytes, Union[_TokenEntry, str]] = {}
+        self._last_sweep = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def _use(self, key: bytes) -> Optional[Union[_TokenEntry, str]]:
+        try:
+            value = self._cache.pop(key)
+        except KeyError:
+            return None
+        self._cache[key] = value
+        return value
+
+    async def get_token(self, refresh_token: str) -> Dict[str, str]:
+        key = fingerprint(refresh_token)
+        current = refresh_token
+        entry = self._use(key)
+        while isinstance(entry, str):
+            current = entry
+            entry = self._use(fingerprint(current))
+            if entry is None:
+                # The successor is gone, so the rotated token is no use
+                del self._cache[key]
+        if entry is None:
+            self.misses += 1
+            raise NotInCacheError()
+        now = time.time()
+        if entry.expires <= now:
+            del self._cache[key]
+            self.expirations += 1
+            self.misses += 1
+            raise NotInCacheError()
+        self.hits += 1
+        if isinstance(entry, _UsageEntry):
+            entry.hits += 1
+            entry.last_used = now
+        return {
+            "access_token": entry.access_token,
+            "refresh_token": current,
+            "scope": entry.scope,
+        }
+
+    def _insert(self, key: bytes, value: Union[_TokenEntry, str]) -> None:
+        self._cache.pop(key, None)
+        self._cache[key] = value
+        if len(self._cache) > self.maxsize:
+            # Evicts a batch at once, as finding the oldest key scans past
+            # every key deleted from the front since the dict was resized
+            count = len(self._cache) - self.maxsize + self.maxsize // 100
+            for key in list(islice(self._cache, count)):
+                del self._cache[key]
+            self.evictions += count
+
+    async def add_access_token(
+        self,
+        refresh_token: str,
+        access_token: str,
+        expires: int,
+        scope: str,
+    ) -> None:
+        now = time.time()
+        if now - self._last_sweep >= self.sweep_interval:
+            self.sweep(now)
+        scope = sys.intern(scope)
+        entry = (
+            _UsageEntry(refresh_token, access_token, scope, now + expires)
+            if self.track_usage
+            else _TokenEntry(access_token, scope, now + expires)
+        )
+        self._insert(fingerprint(refresh_token), entry)
+
+    async def add_successor(self, refresh_token: str, successor: str) -> None:
+        if refresh_token == successor:
+            return
+        key = fingerprint(refresh_token)
+        entry = self._cache.get(fingerprint(successor))
+        if not isinstance(entry, _TokenEntry):
+            return
+        previous = self._cache.get(key)
+        if isinstance(entry, _UsageEntry) and isinstance(previous, _UsageEntry):
+            entry.last_used = max(entry.last_used, previous.last_used)
+        self._insert(key, successor)
+
+    async def discard(self, refresh_token: str) -> None:
+        self._cache.pop(fingerprint(refresh_token), None)
+
+    async def expiring(
+        self, within: float, min_hits: int, max_idle: float
+    ) -> List[str]:
+        now = time.time()
+        return [
+            entry.refresh_token
+            for entry in self._cache.values()
+            if isinstance(entry, _UsageEntry)
+            and entry.expires - now <= within
+            and entry.hits >= min_hits
+            and now - entry.last_used <= max_idle
+        ]
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """
+        Drops every expired entry, and rotated tokens whose successor is
+        gone, returning how many were dropped.
+        """
+        if now is None:
+            now = time.time()
+        self._last_sweep = now
+        expired = [
+            key
+            for key, entry in self._cache.items()
+            if isinstance(entry, _TokenEntry) and entry.expires <= now
+        ]
+        for key in expired:
+            del self._cache[key]
+        orphaned = [
+            key
+            for key, entry in self._cache.items()
+            if isinstance(entry, str) and fingerprint(entry) not in self._cache
+        ]
+        for key in orphaned:
+            del self._cache[key]
+        self.expirations += len(expired) + len(orphaned)
+        return len(expired) + len(orphaned)
+
+
+class SharedTokenCache:
+    """
+    A TokenCache stored in a CacheBackend, so every worker sees the tokens
+    (and rotated refresh tokens) any other worker has exchanged.
+
+    Usage statistics used by TokenRefresher are kept per process once
+    `track_usage` is set, for the least recently used `maxsize` refresh
+    tokens.
+    """
+
+    def __init__(
+        self,
+        backend: CacheBackend,
+        prefix: str = "oauth_helper:token:",
+        *,
+        maxsize: int = 100000,
+        track_usage: bool = False,
+    ):
+        self.backend = backend
+        self.prefix = prefix
+        self.track_usage = track_usage
+        # Refresh tokens this process has seen -> expiry
+        self._expires: LRUCache[str, float] = LRUCache(maxsize=maxsize)
+        # Current refresh token -> (hits since it was issued, last used)
+        self._usage: LRUCache[str, Tuple[int, float]] = LRUCache(maxsize=maxsize)
+
+    def _touch(self, refresh_token: str, now: float) -> None:
+        hits, _ = self._usage.get(refresh_token, (0, now))
+        self._usage[refresh_token] = (hits + 1, now)
+
+    def _rotate(self, refresh_token: str, successor: str) -> None:
+        _, last_used = self._usage.pop(refresh_token, (0, time.time()))
+        self._usage[successor] = (0, last_used)
+
+    def _is_hot(
+        self, refresh_token: str, now: float, min_hits: int, max_idle: float
+    ) -> bool:
+        hits, last_used = self._usage.get(refresh_token, (0, 0))
+        return hits >= min_hits and now - last_used <= max_idle
+
+    def _key(self, refresh_token: str) -> str:
+        return self.prefix + fingerprint(refresh_token).hex()
+
+    async def _get(self, refresh_token: str) -> Optional[Tuple[str, float, str, str]]:
+        data = await self.backend.get(self._key(refresh_token))
+        if data is None:
+            return None
+        access_token, expires, scope, current = json.loads(data)
+        return access_token, expires, scope, current
+
+    async def _set(
+        self, refresh_token: str, entry: Tuple[str, float, str, str]
+    ) -> None:
+        ttl = entry[1] - time.time()
+        if ttl > 0:
+            await self.backend.set(
+                self._key(refresh_token), json.dumps(entry).encode(), ttl
+            )
+            if self.track_usage:
+                self._expires[refresh_token] = entry[1]
+
+    async def get_token(self, refresh_token: str) -> Dict[str, str]:
+        entry = await self._get(refresh_token)
+        if entry is None:
+            self._expires.pop(refresh_token, None)
+            raise NotInCacheError()
+        access_token, expires, scope, current = entry
+        now = time.time()
+        if expires <= now:
+            await self.discard(refresh_token)
+            raise NotInCacheError()
+        if self.track_usage:
+            self._expires[current] = expires
+            self._touch(current, now)
+        return {
+            "access_token": access_token,
+            "refresh_token": current,
+            "scope": scope,
+        }
+
+    async def add_access_token(
+        self,
+        refresh_token: str,
+        access_token: str,
+        expires: int,
+        scope: str,
+    ) -> None:
+        await self._set(
+            refresh_token,
+            (access_token, time.time() + expires, scope, refresh_token),
+        )
+
+    async def add_successor(self, refresh_token: str, successor: str) -> None:
+        if refresh_token == successor:
+            return
+        entry = await self._get(successor)
+        if entry is None:
+            return
+        access_token, expires, scope, _ = entry
+        await self._set(refresh_token, (access_token, expires, scope, successor))
+        self._expires.pop(refresh_token, None)
+        self._rotate(refresh_token, successor)
+
+    async def discard(self, refresh_token: str) -> None:
+        await self.backend.delete(self._key(refresh_token))
+        self._expires.pop(refresh_token, None)
+        self._usage.pop(refresh_token, None)
+
+    async def expiring(
+        self, within: float, min_hits: int, max_idle: float
+    ) -> List[str]:
+        now = time.time()
+        candidates = []
+        for refresh_token, expires in list(self._expires.items()):
+            if expires <= now:
+                self._expires.pop(refresh_token, None)
+                self._usage.pop(refresh_token, None)
+            elif expires - now <= within and self._is_hot(
+                refresh_token, now, min_hits, max_idle
+            ):
+                candidates.append(refresh_token)
+        rtn = []
+        for refresh_token in candidates:
+            # Another worker may have rotated it already
+            entry = await self._get(refresh_token)
+            if entry is not None and entry[3] == refresh_token:
+                rtn.append(refresh_token)
+            else:
+                self._expires.pop(refresh_token, None)
+        return rtn
+
+
+class UserIdentity:
+    """The parts of `/users/@me` kept in the user cache."""
+
+    __slots__ = (
+        "id",
+        "username",
+        "discriminator",
+        "global_name",
+        "avatar",
+        "public_flags",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        username: str,
+        discriminator: str,
+        global_name: Optional[str],
+        avatar: Optional[str],
+        public_flags: int,
+    ):
+        self.id = id
+        self.username = sys.intern(username)
+        self.discriminator = sys.intern(discriminator)
+        self.global_name = global_name
+        self.avatar = avatar
+        self.public_flags = public_flags
+
+    @classmethod
+    def from_payload(cls, data: UserPayload) -> "UserIdentity":
+        return cls(
+            int(data["id"]),
+            data["username"],
+            data["discriminator"],
+            data.get("global_name"),
+            data["avatar"],
+            data.get("public_flags", 0),
+        )
+
+    def to_payload(self) -> UserPayload:
+        return {
+            "id": self.id,
+            "username": self.username,
+            "discriminator": self.discriminator,
+            "global_name": self.global_name,
+            "avatar": self.avatar,
+            "public_flags": self.public_flags,
+        }
+
+    def to_user(self) -> User:
+        return User(data=self.to_payload(), state=NotImplemented)
+
+
+class UserCache:
+    """
+    Caches `/users/@me`, either in process or in a CacheBackend shared
+    between workers.
+
+    Tokens are mapped to user IDs separately from the identities themselves,
+    so when a token is rotated the new one can be linked to the identity
+    already cached instead of fetching it again.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[CacheBackend] = None,
+        maxsize: int = 10000,
+        ttl: float = 36000,
+        prefix: str = "oauth_helper:user:",
+    ):
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self._tokens: MutableMapping[bytes, int] = TTLCache(
+            ttl=ttl, maxsize=maxsize * 2
+        )
+        self._users: MutableMapping[int, UserIdentity] = TTLCache(
+            ttl=ttl, maxsize=maxsize
+        )
+
+    def _token_key(self, token: bytes) -> str:
+        return f"{self.prefix}token:{token.hex()}"
+
+    def _user_key(self, user_id: int) -> str:
+        return f"{self.prefix}id:{user_id}"
+
+    async def _get_user_id(self, token: str) -> Optional[int]:
+        key = fingerprint(token)
+        if self.backend is None:
+            return self._tokens.get(key)
+        data = await self.backend.get(self._token_key(key))
+        return None if data is None else int(data)
+
+    async def _set_user_id(self, token: str, user_id: int) -> None:
+        key = fingerprint(token)
+        if self.backend is None:
+            self._tokens[key] = user_id
+        else:
+            await self.backend.set(self._token_key(key), b"%d" % user_id, self.ttl)
+
+    async def get(self, access_token: str) -> Optional[UserIdentity]:
+        user_id = await self._get_user_id(access_token)
+        if user_id is None:
+            return None
+        if self.backend is None:
+            return self._users.get(user_id)
+        data = await self.backend.get(self._user_key(user_id))
+        if data is None:
+            return None
+        return UserIdentity.from_payload(json.loads(data))
+
+    async def set(self, data: UserPayload, *tokens: Optional[str]) -> UserIdentity:
+        """Caches an identity, linking every given token to it."""
+        user = UserIdentity.from_payload(data)
+        if self.backend is None:
+            self._users[user.id] = user
+        else:
+            await self.backend.set(
+                self._user_key(user.id),
+                json.dumps(user.to_payload()).encode(),
+                self.ttl,
+            )
+        for token in tokens:
+            if token is not None:
+                await self._set_user_id(token, user.id)
+        return user
+
+    async def link(self, token: str, *new_tokens: str) -> None:
+        """Links tokens which replaced `token` to its user, if known."""
+        user_id = await self._get_user_id(token)
+        if user_id is not None:
+            for new_token in new_tokens:
+                await self._set_user_id(new_token, user_id)
+
+
+# A user ID, or the fingerprint of the access token of a user whose ID can't
+# be looked up as the token lacks the identify scope
+GuildOwner = Union[int, bytes]
+
+
+class GuildCache:
+    """Caches a user's full guild list by user ID and granted scopes."""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300):
+        self._cache: MutableMapping[Tuple[GuildOwner, str], GuildList] = TTLCache(
+            maxsize=maxsize, ttl=ttl
+        )
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def get(self, owner: GuildOwner, scope: str) -> Optional[List[GuildPayload]]:
+        guilds = self._cache.get((owner, scope))
+        if guilds is None:
+            return None
+        return list(guilds.guilds)
+
+    def get_list(self, owner: GuildOwner, scope: str) -> Optional[GuildList]:
+        return self._cache.get((owner, scope))
+
+    def set(
+        self, owner: GuildOwner, scope: str, guilds: List[GuildPayload]
+    ) -> GuildList:
+        guild_list = self._cache[(owner, scope)] = GuildList(guilds)
+        return guild_list
+
+    def invalidate(self, user_id: int, scope: Optional[str] = None) -> None:
+        if scope is not None:
+            self._cache.pop((user_id, scope), None)
+            return
+        for key in [key for key in self._cache if key[0] == user_id]:
+            self._cache.pop(key, None)
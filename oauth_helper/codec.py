@@ -0,0 +1,63 @@
+import json
+from typing import Any, Callable, Union
+
+try:
+    import orjson  # type: ignore[import-not-found, unused-ignore]
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment, unused-ignore]
+
+
+class JSONCodec:
+    """
+    The JSON encoder and decoder used to parse request bodies and serialise
+    responses. `loads` must accept bytes and raise ValueError on bad input.
+
+    The stdlib codec is used unless another is set with set_json_codec.
+    With the speedups extra installed, `orjson_codec` is faster, but its
+    output differs: it leaves no spaces after separators, and writes NaN
+    and Infinity as null (and fails to parse them) where the stdlib codec
+    writes and reads them as is.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        dumps: Callable[[Any], bytes],
+        loads: Callable[[Union[bytes, str]], Any],
+    ):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self) -> str:
+        return f"JSONCodec({self.name!r})"
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return json.dumps(obj).encode()
+
+
+stdlib_codec = JSONCodec("json", _stdlib_dumps, json.loads)
+
+if orjson is not None:
+
+    def _orjson_dumps(obj: Any) -> bytes:
+        try:
+            encoded: bytes = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+            return encoded
+        except orjson.JSONEncodeError:
+            # Integers over 64 bits, mostly
+            return _stdlib_dumps(obj)
+
+    orjson_codec = JSONCodec("orjson", _orjson_dumps, orjson.loads)
+
+_codec = stdlib_codec
+
+
+def get_json_codec() -> JSONCodec:
+    return _codec
+
+
+def set_json_codec(codec: JSONCodec) -> None:
+    global _codec
+    _codec = codec
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import asyncio
+import zlib
+from concurrent.futures import Executor
+from functools import partial
+from typing import Callable, Dict, Iterable, Optional
+
+from aiohttp import web_response
+from aiohttp.web_request import Request
+
+from . import metrics
+from .response import Response
+from .trace import traced
+
+try:
+    import brotli  # type: ignore[import-not-found]
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+def _gzip(level: int, body: bytes) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+def _deflate(level: int, body: bytes) -> bytes:
+    return zlib.compress(body, level)
+
+
+def _brotli(quality: int, body: bytes) -> bytes:
+    compressed: bytes = brotli.compress(body, quality=quality)
+    return compressed
+
+
+class Compression:
+    """
+    Compresses response bodies of at least `min_size` bytes with the first
+    of `encodings` the client accepts. Brotli ("br") is only used if the
+    brotli package is installed.
+
+    zlib and brotli release the GIL, so bodies of `thread_size` bytes or
+    more are compressed in `executor` (the event loop's default if None)
+    rather than blocking the loop. The compressed bytes are kept with the
+    Response, so a Response served more than once (from a ResponseCache,
+    or a prebuilt error) is only compressed once per encoding.
+    """
+
+    def __init__(
+        self,
+        min_size: int = 1024,
+        *,
+        level: int = 6,
+        brotli_quality: int = 4,
+        thread_size: int = 256 * 1024,
+        executor: Optional[Executor] = None,
+        encodings: Iterable[str] = ("br", "gzip", "deflate"),
+    ):
+        self.min_size = min_size
+        self.thread_size = thread_size
+        self.executor = executor
+        compressors: Dict[str, Callable[[bytes], bytes]] = {
+            "gzip": partial(_gzip, level),
+            "deflate": partial(_deflate, level),
+        }
+        if brotli is not None:
+            compressors["br"] = partial(_brotli, brotli_quality)
+        self.compressors = {e: compressors[e] for e in encodings if e in compressors}
+        # Accept-Encoding header -> encoding, as browsers send only a few
+        self._negotiated: Dict[str, Optional[str]] = {}
+
+    def negotiate(self, accept_encoding: str) -> Optional[str]:
+        """The encoding to use for a request's Accept-Encoding header."""
+        try:
+            return self._negotiated[accept_encoding]
+        except KeyError:
+            pass
+        if len(self._negotiated) >= 1024:
+            self._negotiated.clear()
+        accepted: Dict[str, float] = {}
+        for item in accept_encoding.lower().split(","):
+            coding, _, params = item.partition(";")
+            quality = 1.0
+            name, _, value = params.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+            accepted[coding.strip()] = quality
+        wildcard = accepted.get("*", 0.0)
+        encoding = self._negotiated[accept_encoding] = next(
+            (e for e in self.compressors if accepted.get(e, wildcard) > 0), None
+        )
+        return encoding
+
+    async def compress(self, body: bytes, encoding: str) -> bytes:
+        compressor = self.compressors[encoding]
+        if len(body) < self.thread_size:
+            return compressor(body)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, compressor, body)
+
+    async def apply(
+        self, rtn: Response, request: Request, response: web_response.Response
+    ) -> None:
+        """Compresses `response`, the encoded `rtn`, if the client accepts it."""
+        body = response.body
+        if (
+            not isinstance(body, bytes)
+            or len(body) < self.min_size
+            or "Content-Encoding" in response.headers
+        ):
+            return
+        response.headers["Vary"] = "Accept-Encoding"
+        encoding = self.negotiate(request.headers.get("Accept-Encoding", ""))
+        if encoding is None:
+            return
+        if rtn._compressed is None:
+            rtn._compressed = {}
+        compressed = rtn._compressed.get(encoding)
+        if metrics.sink is not None:
+            metrics.sink.inc(
+                "oauth_helper_compressed_responses_total",
+                (
+                    ("encoding", encoding),
+                    ("result", "miss" if compressed is None else "hit"),
+                ),
+            )
+        if compressed is None:
+            compressed = rtn._compressed[encoding] = await traced(
+                "compress", self.compress(body, encoding)
+            )
+        if len(compressed) < len(body):
+            response.body = compressed
+            response.headers["Content-Encoding"] = encoding
+            etag = response.headers.get("ETag")
+            if etag is not None and not etag.startswith("W/"):
+                # The bytes differ from the uncompressed body's
+                response.headers["ETag"] = "W/" + etag
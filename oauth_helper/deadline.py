@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import asyncio
+from contextvars import ContextVar
+from typing import Awaitable, Optional, TypeVar
+
+from . import metrics
+from .response import HTTPError
+
+T = TypeVar("T")
+
+# The event loop time by which the request being handled has to be
+# answered, if the middleware was given a budget
+current_deadline: ContextVar[Optional[float]] = ContextVar(
+    "oauth_helper_deadline", default=None
+)
+
+
+async def with_budget(budget: float, awaitable: Awaitable[T]) -> T:
+    """
+    Awaits the handling of a request, giving the calls to Discord it makes
+    `budget` seconds in total.
+    """
+    token = current_deadline.set(asyncio.get_running_loop().time() + budget)
+    try:
+        return await awaitable
+    finally:
+        current_deadline.reset(token)
+
+
+async def bounded(awaitable: Awaitable[T]) -> T:
+    """
+    Awaits a call to Discord within what is left of the request's budget.
+    Running out of time, here or in the HTTP session's per call timeout,
+    raises a 504 HTTPError.
+    """
+    deadline = current_deadline.get()
+    try:
+        if deadline is None:
+            return await awaitable
+        timeout = deadline - asyncio.get_running_loop().time()
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        if metrics.sink is not None:
+            metrics.sink.inc("oauth_helper_timeouts_total")
+        raise HTTPError(status=504, message="Timed out waiting for Discord") from None
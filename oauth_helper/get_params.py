@@ -1,14 +1,50 @@
-from typing import Any, Type, Dict, Optional, Collection, NamedTuple, Tuple, Union
+import time
+from typing import (
+    Any,
+    Type,
+    Dict,
+    Optional,
+    Collection,
+    NamedTuple,
+    Tuple,
+    Union,
+    Callable,
+    FrozenSet,
+)
 
 from typing import _GenericAlias  # type: ignore
 
-import json
 from collections import namedtuple
 
 from aiohttp.web_request import Request
 
 from oauth_helper import HTTPError
 from .exceptions import TypeCheckError, CastError, ArgsError
+from .codec import get_json_codec
+from . import metrics
+from .trace import current_trace
+
+# Validators return None if the value is valid as is, otherwise the value to
+# replace it with. They raise TypeCheckError if the value is invalid.
+Validator = Callable[[Any], Optional[Any]]
+
+_validators: Dict[Tuple[Any, str, bool], Validator] = {}
+_class_validators: Dict[Tuple[Tuple[Tuple[str, Any, str], ...], bool], Validator] = {}
+# id(annotations) -> (annotations, cast, validator). Annotations are kept alive
+# so their id can't be reused while cached.
+_annotation_validators: Dict[int, Tuple[Dict[str, Type[Any]], bool, Validator]] = {}
+_result_types: Dict[Tuple[str, ...], Type[Tuple[Any, ...]]] = {}
+_JSON_ERROR = (("reason", "json"),)
+_CAST_ERROR = (("reason", "cast"),)
+_ARGS_ERROR = (("reason", "args"),)
+# Element types whose containers are validated in bulk, and the exact types
+# of values which pass isinstance for them (JSON only produces these).
+_bulk_types: Dict[Any, FrozenSet[type]] = {
+    int: frozenset({int, bool}),
+    float: frozenset({float}),
+    str: frozenset({str}),
+    bool: frozenset({bool}),
+}
 
 
 async def get_params(
@@ -16,10 +52,16 @@ async def get_params(
     annotations: Dict[str, Type[Any]],
     cast: bool = True,
 ) -> NamedTuple:
+    trace = current_trace.get()
+    timed = metrics.sink is not None or trace is not None
     if request.method in {"POST", "PUT", "DELETE"}:
+        body = await request.read()
+        start = time.perf_counter() if timed else 0.0
         try:
-            query = await request.json()
-        except json.decoder.JSONDecodeError:
+            query = get_json_codec().loads(body)
+        except ValueError:
+            if metrics.sink is not None:
+                metrics.sink.inc("oauth_helper_get_params_errors_total", _JSON_ERROR)
             raise HTTPError(status=400, message="Invalid JSON")
     else:
         query = {}
@@ -28,14 +70,19 @@ async def get_params(
                 query[key.rstrip("[]")] = request.rel_url.query.getall(key)
             else:
                 query[key] = request.rel_url.query.get(key)
+        start = time.perf_counter() if timed else 0.0
     try:
-        typecheck_class(query, annotations, cast=cast)
+        compile_annotations(annotations, cast)(query)
     except CastError as e:
+        if metrics.sink is not None:
+            metrics.sink.inc("oauth_helper_get_params_errors_total", _CAST_ERROR)
         raise HTTPError(
             status=400,
             message=f"{e.value} was not of type `{e.type.__name__}`",
         )
     except ArgsError as e:
+        if metrics.sink is not None:
+            metrics.sink.inc("oauth_helper_get_params_errors_total", _ARGS_ERROR)
         raise HTTPError(
             status=400,
             message="Invalid parameters passed",
@@ -43,8 +90,20 @@ async def get_params(
             expected=e.expected,
             got=e.got,
         )
-    rtn_type = namedtuple("RequestQuery", query.keys())  # type: ignore
-    return rtn_type(**query)
+    fields = tuple(query.keys())
+    try:
+        rtn_type = _result_types[fields]
+    except KeyError:
+        if len(_result_types) >= 1024:
+            _result_types.clear()
+        rtn_type = _result_types[fields] = namedtuple("RequestQuery", fields)
+    if timed:
+        elapsed = time.perf_counter() - start
+        if metrics.sink is not None:
+            metrics.sink.observe("oauth_helper_get_params_seconds", elapsed)
+        if trace is not None:
+            trace.add("get_params", elapsed)
+    return rtn_type(**query)  # type: ignore
 
 
 def is_namedtuple(x: Any) -> bool:
@@ -54,47 +113,203 @@ def is_namedtuple(x: Any) -> bool:
         return False
 
 
-def typecheck_single(x: Any, t: Type[Any], cast: bool = False) -> Optional[Any]:
+def compile_annotations(
+    annotations: Dict[str, Type[Any]], cast: bool = False
+) -> Validator:
+    """
+    Returns the validator for a handler's annotations, compiling it on first
+    use. Annotations are looked up by identity first, then by contents.
+    """
+    try:
+        cached_annotations, cached_cast, validator = _annotation_validators[
+            id(annotations)
+        ]
+    except KeyError:
+        pass
+    else:
+        if cached_annotations is annotations and cached_cast == cast:
+            return validator
+    validator = compile_class(annotations, cast)
+    if len(_annotation_validators) >= 1024:
+        _annotation_validators.clear()
+    _annotation_validators[id(annotations)] = (annotations, cast, validator)
+    return validator
+
+
+def compile_class(t: Dict[str, Type[Any]], cast: bool = False) -> Validator:
+    key = (tuple((attr, hint, repr(hint)) for attr, hint in t.items()), cast)
+    try:
+        return _class_validators[key]
+    except KeyError:
+        pass
+    checks = {attr: compile_type(hint, cast) for attr, hint in t.items()}
+    size = len(checks)
+
+    def check(x: Any) -> None:
+        if not isinstance(x, dict):
+            _dict = x.__dict__
+        else:
+            _dict = x
+        if len(_dict) != size:
+            raise ArgsError(x, t, _dict)
+        for attr, value in _dict.items():
+            try:
+                typecheck = checks[attr]
+            except KeyError:
+                raise ArgsError(x, t, _dict)
+            rtn = typecheck(value)
+            if cast and rtn is not None:
+                x[attr] = rtn
+
+    _class_validators[key] = check
+    return check
+
+
+def compile_type(t: Type[Any], cast: bool = False) -> Validator:
+    # Unions compare equal regardless of order, which matters when casting
+    try:
+        key = (t, repr(t), cast)
+        return _validators[key]
+    except KeyError:
+        validator = _validators[key] = _compile_type(t, cast)
+    except TypeError:
+        validator = _compile_type(t, cast)
+    return validator
+
+
+def _typecheck_failure(t: Type[Any]) -> Callable[[Any], TypeCheckError]:
+    prefix = f"Typecheck failure: {t}, given "
+    return lambda x: TypeCheckError(f"{prefix}{type(x)} ({x!r})")
+
+
+def _ignore(x: Any) -> None:
+    return None
+
+
+def _compile_type(t: Type[Any], cast: bool) -> Validator:
     if t is Any:
-        return None
+        return _ignore
     if isinstance(t, _GenericAlias):
         if repr(t).startswith(("typing.Union", "typing.Optional")):
-            for t2 in t.__args__:
-                try:
-                    return typecheck_single(x, t2, cast)
-                except TypeCheckError:
-                    pass
-            raise TypeCheckError(f"Typecheck failure: {t}, given {type(x)} ({x!r})")
+            return _compile_union(t, cast)
         if t._name == "Dict":
-            typecheck_dict(x, t)
-            return None
-        if x == "":
-            return []
+            return _compile_dict(t)
         if t._name == "List":
-            typecheck_collection(x, t, list)
-            return None
-        if t._name == "Set":
-            typecheck_collection(
-                x, t, (set, list)
-            )  # Special case these for deserialising being crap
-            return None
+            collection = _compile_collection(t, list)
+        elif t._name == "Set":
+            # Special case these for deserialising being crap
+            collection = _compile_collection(t, (set, list))
+        else:
+            collection = _compile_instance(t, cast)
+
+        def check_collection(x: Any) -> Optional[Any]:
+            if x == "":
+                return []
+            return collection(x)
+
+        return check_collection
     elif is_namedtuple(t):
-        typecheck_class(x, t.__annotations__)
-        return None
+        fields = compile_class(t.__annotations__)
+
+        def check_namedtuple(x: Any) -> None:
+            fields(x)
+            return None
+
+        return check_namedtuple
+    return _compile_instance(t, cast)
+
+
+def _compile_union(t: Type[Any], cast: bool) -> Validator:
+    options = [compile_type(t2, cast) for t2 in t.__args__]
+    failure = _typecheck_failure(t)
+
+    def check(x: Any) -> Optional[Any]:
+        for option in options:
+            try:
+                return option(x)
+            except TypeCheckError:
+                pass
+        raise failure(x)
+
+    return check
+
+
+def _compile_dict(t: Type[Any]) -> Validator:
+    keys, values = t.__args__
+    check_key = compile_type(keys)
+    check_value = compile_type(values)
+    bulk_keys = _bulk_types.get(keys)
+    bulk_values = _bulk_types.get(values)
+    failure = _typecheck_failure(t)
+
+    def check_items(x: Dict[Any, Any]) -> None:
+        for k, v in x.items():
+            check_key(k)
+            check_value(v)
+
+    def check(x: Any) -> None:
+        if not isinstance(x, dict):
+            raise failure(x)
+        if bulk_keys is None or not bulk_keys.issuperset(map(type, x)):
+            check_items(x)
+        elif bulk_values is None:
+            for v in x.values():
+                check_value(v)
+        elif not bulk_values.issuperset(map(type, x.values())):
+            # Find the offending value for the error message
+            check_items(x)
+
+    return check
+
+
+def _compile_collection(
+    t: Type[Any], correct: Union[Type[Any], Tuple[Type[Any], ...]]
+) -> Validator:
+    (of,) = t.__args__
+    check_item = compile_type(of)
+    bulk = _bulk_types.get(of)
+    failure = _typecheck_failure(t)
+
+    def check(x: Any) -> None:
+        if not isinstance(x, correct):
+            raise failure(x)
+        if bulk is not None and bulk.issuperset(map(type, x)):
+            return
+        # Either not a primitive, or find the offending value
+        for i in x:
+            check_item(i)
+
+    return check
+
+
+def _compile_instance(t: Type[Any], cast: bool) -> Validator:
     try:
-        isinstance(x, t)
+        isinstance(None, t)
     except TypeError:
-        pass
-    else:
-        if not isinstance(x, t):
-            if cast:
-                try:
-                    return t(x)
-                except:
-                    raise CastError(t, x)
-            raise TypeCheckError(f"Typecheck failure: {t}, given {type(x)} ({x!r})")
-        return None
-    raise NotImplementedError(f"Unable to find type of variable: {type(x)}: {t}")
+
+        def unknown(x: Any) -> None:
+            raise NotImplementedError(
+                f"Unable to find type of variable: {type(x)}: {t}"
+            )
+
+        return unknown
+    failure = _typecheck_failure(t)
+
+    def check(x: Any) -> Optional[Any]:
+        if isinstance(x, t):
+            return None
+        if cast:
+            try:
+                return t(x)
+            except Exception:
+                raise CastError(t, x)
+        raise failure(x)
+
+    return check
+
+
+def typecheck_single(x: Any, t: Type[Any], cast: bool = False) -> Optional[Any]:
+    return compile_type(t, cast)(x)
 
 
 def typecheck_collection(
@@ -102,34 +317,12 @@ def typecheck_collection(
     t: Type[Any],
     correct: Union[Type[Any], Tuple[Type[Any], ...]],
 ) -> None:
-    (of,) = t.__args__
-    if not isinstance(x, correct):
-        raise TypeCheckError(f"Typecheck failure: {t}, given {type(x)} ({x!r})")
-    for i in x:
-        typecheck_single(i, of)
+    _compile_collection(t, correct)(x)
 
 
 def typecheck_dict(x: Dict[Any, Any], t: Type[Any]) -> None:
-    keys, values = t.__args__
-    if not isinstance(x, dict):
-        raise TypeCheckError(f"Typecheck failure: {t}, given {type(x)} ({x!r})")
-    for k, v in x.items():
-        typecheck_single(k, keys)
-        typecheck_single(v, values)
+    _compile_dict(t)(x)
 
 
 def typecheck_class(x: Any, t: Dict[str, Type[Any]], cast: bool = False) -> None:
-    if not isinstance(x, dict):
-        _dict = x.__dict__
-    else:
-        _dict = x
-    if len(_dict) != len(t):
-        raise ArgsError(x, t, _dict)
-    for attr, value in _dict.items():
-        try:
-            typehint = t[attr]
-        except KeyError:
-            raise ArgsError(x, t, _dict)
-        rtn = typecheck_single(value, typehint, cast)
-        if cast and rtn is not None:
-            x[attr] = rtn
+    compile_class(t, cast)(x)
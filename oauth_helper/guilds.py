@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+from typing import (
+    AbstractSet,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TYPE_CHECKING,
+    Union,
+)
+from weakref import WeakKeyDictionary
+
+from discord import Client, Guild, Permissions
+
+if TYPE_CHECKING:
+    from discord.types.guild import Guild as GuildPayload
+
+
+ALL_PERMISSIONS = Permissions.all().value
+ADMINISTRATOR = Permissions(administrator=True).value
+MANAGE_GUILD = Permissions(manage_guild=True).value
+
+# Each bot's shared index, so its listeners are only added once
+_indexes: WeakKeyDictionary[Client, GuildIndex] = WeakKeyDictionary()
+
+
+class GuildIndex:
+    """
+    The IDs of the guilds the bot is in.
+
+    Built from `bot.guilds` on first use and kept up to date by guild join
+    and remove events if `bot` supports `add_listener`; other clients can
+    forward those events to the `on_*` methods themselves. Until an index
+    gets events it asks `bot.get_guild` on every lookup, as a set built once
+    would go stale, or stay empty if built before the bot was ready.
+    `version` changes whenever the set of guilds does.
+    """
+
+    def __init__(self, bot: Optional[Client]):
+        self.bot = bot
+        self.version = 0
+        self._ids: Optional[Set[int]] = None
+        self._tracking = False
+        add_listener = getattr(bot, "add_listener", None)
+        if add_listener is not None:
+            add_listener(self.on_ready)
+            add_listener(self.on_guild_join)
+            add_listener(self.on_guild_remove)
+            self._tracking = True
+
+    @classmethod
+    def for_bot(cls, bot: Optional[Client]) -> GuildIndex:
+        """Returns the index shared by everything using `bot`."""
+        if bot is None:
+            return cls(bot)
+        try:
+            return _indexes[bot]
+        except KeyError:
+            index = _indexes[bot] = cls(bot)
+            return index
+        except TypeError:
+            # Only stand-ins for a Client can't be weakly referenced
+            return cls(bot)
+
+    @property
+    def tracking(self) -> bool:
+        """Whether events keep the index up to date."""
+        return self._tracking
+
+    @property
+    def ids(self) -> AbstractSet[int]:
+        if not self._tracking:
+            return set() if self.bot is None else {g.id for g in self.bot.guilds}
+        return self._build()
+
+    def _build(self) -> Set[int]:
+        if self._ids is None:
+            self._ids = set() if self.bot is None else {g.id for g in self.bot.guilds}
+        return self._ids
+
+    def __contains__(self, guild_id: int) -> bool:
+        if not self._tracking:
+            return self.bot is not None and self.bot.get_guild(guild_id) is not None
+        return guild_id in self._build()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def rebuild(self) -> None:
+        self._ids = None
+        self.version += 1
+
+    async def on_ready(self) -> None:
+        self._tracking = True
+        self.rebuild()
+
+    async def on_guild_join(self, guild: Guild) -> None:
+        self._tracking = True
+        ids = self._build()
+        if guild.id not in ids:
+            ids.add(guild.id)
+            self.version += 1
+
+    async def on_guild_remove(self, guild: Guild) -> None:
+        self._tracking = True
+        ids = self._build()
+        if guild.id in ids:
+            ids.discard(guild.id)
+            self.version += 1
+
+
+class GuildList:
+    """
+    A user's guild list with each guild's permissions parsed once.
+
+    Filtered views are memoised per guild index version and permission mask,
+    so they're computed once for every version of the list.
+    """
+
+    __slots__ = ("guilds", "_ids", "_permissions", "_views")
+
+    # Distinct filtered views kept before starting over
+    max_views = 16
+
+    def __init__(self, guilds: List[GuildPayload]):
+        self.guilds = list(guilds)
+        self._ids = [int(g["id"]) for g in self.guilds]
+        self._permissions = [_permissions(g) for g in self.guilds]
+        self._views: Dict[Tuple[int, int], List[GuildPayload]] = {}
+
+    def __len__(self) -> int:
+        return len(self.guilds)
+
+    def mutual(self, index: GuildIndex, permissions: int = 0) -> List[GuildPayload]:
+        """
+        Returns the guilds the bot is also in where the user has every
+        permission in `permissions`.
+        """
+        if not index.tracking:
+            # The version never changes, so there's nothing to memoise by
+            return self._filter(index, permissions)
+        key = (index.version, permissions)
+        try:
+            guilds = self._views[key]
+        except KeyError:
+            guilds = self._filter(index.ids, permissions)
+            if len(self._views) >= self.max_views:
+                self._views.clear()
+            self._views[key] = guilds
+        return list(guilds)
+
+    def _filter(
+        self, bot_guilds: Union[AbstractSet[int], GuildIndex], permissions: int
+    ) -> List[GuildPayload]:
+        return [
+            g
+            for g, guild_id, perms in zip(self.guilds, self._ids, self._permissions)
+            if perms & permissions == permissions and guild_id in bot_guilds
+        ]
+
+
+def _permissions(guild: GuildPayload) -> int:
+    if guild.get("owner"):
+        return ALL_PERMISSIONS
+    perms = int(guild.get("permissions", 0))
+    if perms & ADMINISTRATOR:
+        return ALL_PERMISSIONS
+    return perms
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Dict, Optional
+
+import aiohttp
+from aiohttp.web_app import Application
+from cachetools import LRUCache
+from discord.http import HTTPClient, Ratelimit
+
+from .cache import fingerprint
+
+
+class NoConcatString(str):
+    def __radd__(self, other: Any) -> str:
+        return self
+
+
+class TokenRateLimits:
+    """The rate limit buckets and global limit of a single user token."""
+
+    __slots__ = ("buckets", "global_over")
+
+    def __init__(self) -> None:
+        # Bucket hash + major parameters -> rate limit, as in HTTPClient
+        self.buckets: Dict[str, Ratelimit] = {}
+        self.global_over = asyncio.Event()
+        self.global_over.set()
+
+
+class RateLimits:
+    """
+    Rate limit state for every user token, shared by all the clients a pool
+    hands out.
+
+    Discord rate limits bearer tokens separately, so each token gets its own
+    buckets and global limit, which outlive any one Oauth2 object. The
+    mapping of routes to bucket hashes is the same for everyone and stays on
+    the shared client. The least recently used `maxsize` tokens are kept.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self._tokens: LRUCache[bytes, TokenRateLimits] = LRUCache(maxsize=maxsize)
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def get(self, access_token: str) -> TokenRateLimits:
+        key = fingerprint(access_token)
+        try:
+            return self._tokens[key]
+        except KeyError:
+            limits = self._tokens[key] = TokenRateLimits()
+            return limits
+
+    def clear(self) -> None:
+        self._tokens.clear()
+
+
+class HTTPPool:
+    """
+    A long-lived connection pool shared by every Oauth2 object of a wrapper.
+
+    The session is created lazily on first use so the pool can be built
+    outside of a running event loop, and is closed with the aiohttp
+    application once `setup` has been called. Each request made through it
+    is given up on after `timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 0,
+        keepalive_timeout: float = 30.0,
+        rate_limits: Optional[RateLimits] = None,
+        timeout: Optional[float] = 10.0,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.rate_limits = RateLimits() if rate_limits is None else rate_limits
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._client: Optional[HTTPClient] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                cookie_jar=aiohttp.DummyCookieJar(),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._client = None
+        return self._session
+
+    @property
+    def client(self) -> HTTPClient:
+        session = self.session
+        if self._client is None:
+            loop = asyncio.get_running_loop()
+            client = HTTPClient(loop, connector=session.connector)
+            client._HTTPClient__session = session  # type: ignore
+            client._global_over = asyncio.Event()
+            client._global_over.set()
+            self._client = client
+        return self._client
+
+    def for_token(self, access_token: str) -> UserHTTPClient:
+        return UserHTTPClient(self.client, access_token, self.rate_limits)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._client = None
+        # Buckets are bound to the event loop they were created in
+        self.rate_limits.clear()
+
+    def setup(self, app: Application) -> None:
+        app.on_cleanup.append(self._on_cleanup)
+
+    async def _on_cleanup(self, app: Application) -> None:
+        await self.close()
+
+
+class UserHTTPClient(HTTPClient):
+    """
+    A view over a shared HTTPClient which sends a user's bearer token.
+
+    HTTPClient.__init__ is deliberately not called: any attribute other than
+    the token and its rate limits (the session, bucket hashes) is read from
+    the shared client, so creating one of these costs a single small object.
+    Without `rate_limits`, the shared client's buckets are used.
+    """
+
+    def __init__(
+        self,
+        shared: HTTPClient,
+        access_token: str,
+        rate_limits: Optional[RateLimits] = None,
+    ):
+        self._shared = shared
+        self._rate_limits = rate_limits
+        self.set_bearer(access_token)
+
+    def __getattr__(self, item: str) -> Any:
+        if item == "_shared":
+            raise AttributeError(item)
+        return getattr(self._shared, item)
+
+    def set_bearer(self, access_token: str) -> None:
+        self.token = NoConcatString(f"Bearer {access_token}")
+        if self._rate_limits is not None:
+            limits = self._rate_limits.get(access_token)
+            self._buckets = limits.buckets
+            self._global_over = limits.global_over
+
+    async def close(self) -> None:
+        # The session belongs to the pool
+        pass
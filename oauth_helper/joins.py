@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+import aiohttp
+from discord.errors import HTTPException
+
+log = logging.getLogger(__name__)
+
+# Statuses worth retrying. discord.py already waits out most 429s itself.
+TRANSIENT_STATUSES = frozenset({429, 500, 502, 503, 504, 524})
+
+Join = Callable[[int, int, str], Awaitable[None]]
+
+
+class JoinResult(NamedTuple):
+    guild_id: int
+    user_id: int
+    # None if the user was added, otherwise Discord's error
+    error: Optional[str]
+    attempts: int
+
+
+class JoinStats:
+    """Progress of a bulk join, updated as results come in."""
+
+    def __init__(self, timer: Callable[[], float] = time.monotonic):
+        self._timer = timer
+        self.started = timer()
+        self.total = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+
+    @property
+    def done(self) -> int:
+        return self.succeeded + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        return self._timer() - self.started
+
+    @property
+    def rate(self) -> float:
+        """Completed joins per second."""
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"JoinStats(done={self.done}/{self.total}, succeeded={self.succeeded}, "
+            f"failed={self.failed}, retries={self.retries}, rate={self.rate:.1f}/s)"
+        )
+
+
+async def bulk_join(
+    join: Join,
+    joins: Iterable[Tuple[int, int, str]],
+    *,
+    concurrency: int = 16,
+    per_guild: int = 2,
+    retries: int = 3,
+    backoff: float = 1.0,
+    stats: Optional[JoinStats] = None,
+) -> AsyncIterator[JoinResult]:
+    """
+    Adds users to guilds from (guild ID, user ID, access token) triples,
+    yielding each result as it completes.
+
+    Adding members is rate limited per guild, so at most `per_guild` joins
+    run for a guild at once and at most `concurrency` overall. Transient
+    failures (server errors, unhandled 429s, connection errors) are retried
+    up to `retries` times with exponential backoff starting at `backoff`
+    seconds. Pass `stats` to watch progress and throughput.
+    """
+    if stats is None:
+        stats = JoinStats()
+    queues: Dict[int, Deque[Tuple[int, str]]] = {}
+    for guild_id, user_id, access_token in joins:
+        queues.setdefault(guild_id, deque()).append((user_id, access_token))
+    total = sum(len(queue) for queue in queues.values())
+    stats.total += total
+    results: asyncio.Queue[JoinResult] = asyncio.Queue()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def join_one(guild_id: int, user_id: int, access_token: str) -> JoinResult:
+        attempt = 0
+        while True:
+            attempt += 1
+            async with semaphore:
+                try:
+                    await join(guild_id, user_id, access_token)
+                except HTTPException as e:
+                    error = e.text or str(e)
+                    transient = e.status in TRANSIENT_STATUSES
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                    error = str(e) or type(e).__name__
+                    transient = True
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                    transient = False
+                else:
+                    stats.succeeded += 1
+                    return JoinResult(guild_id, user_id, None, attempt)
+            if not transient or attempt > retries:
+                stats.failed += 1
+                return JoinResult(guild_id, user_id, error, attempt)
+            stats.retries += 1
+            # Back off without holding a slot
+            await asyncio.sleep(backoff * 2 ** (attempt - 1))
+
+    async def worker(guild_id: int, queue: Deque[Tuple[int, str]]) -> None:
+        while queue:
+            user_id, access_token = queue.popleft()
+            results.put_nowait(await join_one(guild_id, user_id, access_token))
+
+    workers: List[asyncio.Future[None]] = [
+        asyncio.ensure_future(worker(guild_id, queue))
+        for guild_id, queue in queues.items()
+        for _ in range(min(per_guild, len(queue)))
+    ]
+    try:
+        for _ in range(total):
+            yield await results.get()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        log.info("Bulk join finished: %r", stats)
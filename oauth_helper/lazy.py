@@ -0,0 +1,58 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Generator, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Lazy(Generic[T]):
+    """
+    A value which is only computed the first time it is awaited.
+
+    Every later await (including concurrent ones) gets the same result or
+    exception.
+    """
+
+    __slots__ = ("_factory", "_task")
+
+    def __init__(self, factory: Callable[[], Awaitable[T]]):
+        self._factory: Optional[Callable[[], Awaitable[T]]] = factory
+        self._task: Optional["asyncio.Future[T]"] = None
+
+    @classmethod
+    def resolved(cls, value: T) -> "Lazy[T]":
+        lazy: Lazy[T] = cls.__new__(cls)
+        lazy._factory = None
+        lazy._task = asyncio.get_running_loop().create_future()
+        lazy._task.set_result(value)
+        return lazy
+
+    @property
+    def done(self) -> bool:
+        return self._task is not None and self._task.done()
+
+    @property
+    def succeeded(self) -> bool:
+        """Whether the value has been resolved without raising."""
+        task = self._task
+        return (
+            task is not None
+            and task.done()
+            and not task.cancelled()
+            and task.exception() is None
+        )
+
+    def result(self) -> T:
+        """Returns the value if it has been successfully resolved."""
+        if self._task is None:
+            raise asyncio.InvalidStateError("Not resolved yet")
+        return self._task.result()
+
+    async def get(self) -> T:
+        if self._task is None:
+            assert self._factory is not None
+            self._task = asyncio.ensure_future(self._factory())
+            self._factory = None
+        return await self._task
+
+    def __await__(self) -> Generator[Any, None, T]:
+        return self.get().__await__()
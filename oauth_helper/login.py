@@ -4,9 +4,20 @@ import discord
 from aiohttp.web import Request
 from aiohttp.web_app import Application
 from discord import Guild, Member
-from typing import Optional, Any, Callable, Awaitable, List, TYPE_CHECKING
+from functools import partial
+from typing import (
+    Optional,
+    Any,
+    Callable,
+    Awaitable,
+    Dict,
+    Iterable,
+    List,
+    TYPE_CHECKING,
+)
 
 from .oauth2 import Oauth2Protocol
+from .lazy import Lazy
 from .response import HTTPError, Response
 
 if TYPE_CHECKING:
@@ -17,6 +28,7 @@ not_logged_in_error = HTTPError(
     message="You need to be logged in to use this endpoint",
     status=403,
 )
+not_logged_in_error.encode()
 
 
 def require_logged_in(func: Any) -> Any:
@@ -29,6 +41,8 @@ async def attach_user(
     handler: Callable[[Request], Awaitable[Response]],
 ) -> Callable[[Request], Awaitable[Response]]:
     async def _inner(request: Request) -> Response:
+        if isinstance(request["oauth"], Lazy):
+            return await _attach_lazy_user(request, handler)
         if request["oauth"] is None:
             if getattr(handler, "require_logged_in", False):
                 return not_logged_in_error
@@ -40,27 +54,68 @@ async def attach_user(
     return _inner
 
 
+async def _attach_lazy_user(
+    request: Request,
+    handler: Callable[[Request], Awaitable[Response]],
+) -> Response:
+    lazy_oauth: Lazy[Optional[Oauth2Protocol]] = request["oauth"]
+    if getattr(handler, "require_logged_in", False):
+        oauth = await lazy_oauth
+        if oauth is None:
+            return not_logged_in_error
+        request["user"] = Lazy.resolved(User(oauth))
+    else:
+        request["user"] = Lazy(partial(resolve_user, lazy_oauth))
+    return await handler(request)
+
+
+async def resolve_user(lazy_oauth: Lazy[Optional[Oauth2Protocol]]) -> Optional[User]:
+    """The User for a lazily resolved token, or None if not logged in."""
+    oauth = await lazy_oauth
+    if oauth is None:
+        return None
+    return User(oauth)
+
+
 class User:
     def __init__(self, oauth: Oauth2Protocol):
         self._oauth = oauth
         self._id = -1
+        self._user: Optional[discord.User] = None
 
     def __str__(self) -> str:
         return f"User({self._oauth})"
 
     async def user_info(self) -> discord.User:
-        user = await self._oauth.get_user_info()
-        self._id = user.id
-        return user
+        if self._user is None:
+            self._user = await self._oauth.get_user_info()
+            self._id = self._user.id
+        return self._user
 
     async def guilds(self) -> List[guild.Guild]:
         guilds = await self._oauth.get_guilds()
         return guilds
 
+    async def mutual_guilds(self, permissions: int = 0) -> List[guild.Guild]:
+        """
+        The user's guilds which the bot is also in, optionally only those
+        where the user has every permission in `permissions`.
+        """
+        guilds = await self._oauth.get_mutual_guilds(permissions)
+        return guilds
+
+    async def manageable_guilds(self) -> List[guild.Guild]:
+        guilds = await self._oauth.get_manageable_guilds()
+        return guilds
+
     async def fetch_member(self, guild: Guild) -> Optional[Member]:
         if self._id == -1:
             return None
-        member = guild.get_member(self._id)
-        if member is None:
-            member = await guild.fetch_member(self._id)
-        return member
+        return await self._oauth.members.fetch_member(guild, self._id)
+
+    async def fetch_members(
+        self, guilds: Iterable[Guild]
+    ) -> Dict[int, Optional[Member]]:
+        if self._id == -1:
+            return {}
+        return await self._oauth.members.fetch_members(guilds, self._id)
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import discord
+from cachetools import TTLCache
+from discord import Client, Guild, Member
+
+from .singleflight import SingleFlight
+
+# The most user IDs Discord accepts in one gateway member request
+QUERY_LIMIT = 100
+
+_Key = Tuple[int, int]
+
+
+class MemberResolver:
+    """
+    Looks up guild members which aren't in the bot's member cache.
+
+    Lookups for the same member are coalesced, lookups for different members
+    of one guild made in the same loop iteration are sent as a single gateway
+    member request when the bot is connected (falling back to the REST API
+    otherwise), and at most `concurrency` requests run at once.
+
+    Results, including "not a member", are cached for `ttl` and
+    `negative_ttl` seconds respectively. If `bot` supports `add_listener`,
+    member join, update and remove events keep the cache up to date; other
+    clients can forward those events to the `on_*` methods themselves.
+    """
+
+    def __init__(
+        self,
+        bot: Optional[Client],
+        *,
+        ttl: float = 60,
+        negative_ttl: float = 30,
+        maxsize: int = 10000,
+        concurrency: int = 8,
+        gateway: bool = True,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self.bot = bot
+        self.gateway = gateway
+        self._members: TTLCache[_Key, Member] = TTLCache(
+            maxsize=maxsize, ttl=ttl, timer=timer
+        )
+        self._missing: TTLCache[_Key, bool] = TTLCache(
+            maxsize=maxsize, ttl=negative_ttl, timer=timer
+        )
+        self._fetches: SingleFlight[_Key, Optional[Member]] = SingleFlight()
+        self._batches: Dict[int, Dict[int, asyncio.Future[Optional[Member]]]] = {}
+        self._queries: Set[asyncio.Task[None]] = set()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        add_listener = getattr(bot, "add_listener", None)
+        if add_listener is not None:
+            add_listener(self.on_member_join)
+            add_listener(self.on_member_update)
+            add_listener(self.on_raw_member_remove)
+
+    def __len__(self) -> int:
+        return len(self._members) + len(self._missing)
+
+    async def fetch_member(self, guild: Guild, user_id: int) -> Optional[Member]:
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member
+        key = (guild.id, user_id)
+        try:
+            return self._members[key]
+        except KeyError:
+            pass
+        if key in self._missing:
+            return None
+        return await self._fetches.run(key, partial(self._resolve, guild, user_id))
+
+    async def fetch_members(
+        self, guilds: Iterable[Guild], user_id: int
+    ) -> Dict[int, Optional[Member]]:
+        """Looks up a user in every guild at once, keyed by guild ID."""
+        guilds = list(guilds)
+        members = await asyncio.gather(
+            *(self.fetch_member(guild, user_id) for guild in guilds)
+        )
+        return {guild.id: member for guild, member in zip(guilds, members)}
+
+    def invalidate(self, guild_id: int, user_id: int) -> None:
+        self._members.pop((guild_id, user_id), None)
+        self._missing.pop((guild_id, user_id), None)
+
+    def clear(self) -> None:
+        self._members.clear()
+        self._missing.clear()
+
+    def _store(self, guild_id: int, user_id: int, member: Optional[Member]) -> None:
+        key = (guild_id, user_id)
+        if member is None:
+            self._members.pop(key, None)
+            self._missing[key] = True
+        else:
+            self._missing.pop(key, None)
+            self._members[key] = member
+
+    async def on_member_join(self, member: Member) -> None:
+        self._store(member.guild.id, member.id, member)
+
+    async def on_member_update(self, before: Member, after: Member) -> None:
+        self._store(after.guild.id, after.id, after)
+
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent) -> None:
+        self._store(payload.guild_id, payload.user.id, None)
+
+    def _use_gateway(self) -> bool:
+        return (
+            self.gateway
+            and self.bot is not None
+            and self.bot.is_ready()
+            and not self.bot.is_closed()
+        )
+
+    async def _resolve(self, guild: Guild, user_id: int) -> Optional[Member]:
+        member: Optional[Member]
+        if self._use_gateway():
+            try:
+                member = await self._query(guild, user_id)
+            except (asyncio.TimeoutError, discord.ClientException, RuntimeError):
+                member = await self._fetch(guild, user_id)
+        else:
+            member = await self._fetch(guild, user_id)
+        self._store(guild.id, user_id, member)
+        return member
+
+    async def _fetch(self, guild: Guild, user_id: int) -> Optional[Member]:
+        async with self._semaphore:
+            try:
+                return await guild.fetch_member(user_id)
+            except discord.NotFound:
+                return None
+
+    async def _query(self, guild: Guild, user_id: int) -> Optional[Member]:
+        batch = self._batches.get(guild.id)
+        if batch is None:
+            batch = self._batches[guild.id] = {}
+            asyncio.get_running_loop().call_soon(self._flush, guild)
+        future = batch.get(user_id)
+        if future is None:
+            future = batch[user_id] = asyncio.get_running_loop().create_future()
+        return await future
+
+    def _flush(self, guild: Guild) -> None:
+        batch = self._batches.pop(guild.id)
+        user_ids = list(batch)
+        for i in range(0, len(user_ids), QUERY_LIMIT):
+            chunk = {
+                user_id: batch[user_id] for user_id in user_ids[i : i + QUERY_LIMIT]
+            }
+            task = asyncio.ensure_future(self._query_chunk(guild, chunk))
+            self._queries.add(task)
+            task.add_done_callback(self._queries.discard)
+
+    async def _query_chunk(
+        self, guild: Guild, waiters: Dict[int, asyncio.Future[Optional[Member]]]
+    ) -> None:
+        try:
+            async with self._semaphore:
+                members: List[Member] = await guild.query_members(
+                    user_ids=list(waiters), limit=len(waiters), cache=True
+                )
+        except asyncio.CancelledError:
+            for future in waiters.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in waiters.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        found = {member.id: member for member in members}
+        for user_id, future in waiters.items():
+            if not future.done():
+                future.set_result(found.get(user_id))
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import math
+from bisect import bisect_left
+from typing import Dict, List, Optional, Protocol, Sequence, Tuple
+
+from aiohttp import web
+from aiohttp.web_request import Request
+
+# ((label name, label value), ...), built once by callers where possible
+Labels = Tuple[Tuple[str, str], ...]
+
+# Labels shared by the cache and authentication counters
+HIT: Labels = (("result", "hit"),)
+MISS: Labels = (("result", "miss"),)
+ANONYMOUS: Labels = (("result", "anonymous"),)
+AUTHENTICATED: Labels = (("result", "authenticated"),)
+DEFERRED: Labels = (("result", "lazy"),)
+INVALID: Labels = (("result", "invalid"),)
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class MetricsSink(Protocol):
+    """
+    Receives counter increments and histogram observations.
+
+    Metric names follow Prometheus conventions: counters end in `_total`
+    and durations are observed in seconds.
+    """
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1) -> None: ...
+
+    def observe(self, name: str, value: float, labels: Labels = ()) -> None: ...
+
+
+# None disables instrumentation. Instrumented code reads this directly and
+# only measures anything if it is set.
+sink: Optional[MetricsSink] = None
+
+
+def get_metrics_sink() -> Optional[MetricsSink]:
+    return sink
+
+
+def set_metrics_sink(new_sink: Optional[MetricsSink]) -> None:
+    global sink
+    sink = new_sink
+
+
+def inc(name: str, labels: Labels = (), value: float = 1) -> None:
+    if sink is not None:
+        sink.inc(name, labels, value)
+
+
+def observe(name: str, value: float, labels: Labels = ()) -> None:
+    if sink is not None:
+        sink.observe(name, value, labels)
+
+
+class MemorySink:
+    """Keeps every counter and observation, for tests and debugging."""
+
+    def __init__(self) -> None:
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.observations: Dict[Tuple[str, Labels], List[float]] = {}
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1) -> None:
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Labels = ()) -> None:
+        self.observations.setdefault((name, labels), []).append(value)
+
+    def counter(self, name: str, **labels: str) -> float:
+        return self.counters.get((name, tuple(labels.items())), 0)
+
+    def samples(self, name: str, **labels: str) -> List[float]:
+        return self.observations.get((name, tuple(labels.items())), [])
+
+    def clear(self) -> None:
+        self.counters.clear()
+        self.observations.clear()
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class PrometheusSink:
+    """
+    Aggregates metrics in process and renders them in the Prometheus text
+    exposition format.
+
+    `handler` can be added as a route directly. It returns a plain aiohttp
+    response, so its path needs to be in convert_response's `ignore` list.
+    """
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1) -> None:
+        counters = self._counters.get(name)
+        if counters is None:
+            counters = self._counters[name] = {}
+        counters[labels] = counters.get(labels, 0) + value
+
+    def observe(self, name: str, value: float, labels: Labels = ()) -> None:
+        histograms = self._histograms.get(name)
+        if histograms is None:
+            histograms = self._histograms[name] = {}
+        histogram = histograms.get(labels)
+        if histogram is None:
+            histogram = histograms[labels] = _Histogram(len(self.buckets) + 1)
+        histogram.counts[bisect_left(self.buckets, value)] += 1
+        histogram.sum += value
+        histogram.count += 1
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for name, counters in sorted(self._counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in counters.items():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for name, histograms in sorted(self._histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in histograms.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram.counts):
+                    cumulative += count
+                    le = labels + (("le", _format_value(bound)),)
+                    lines.append(f"{name}_bucket{_format_labels(le)} {cumulative}")
+                le = labels + (("le", "+Inf"),)
+                lines.append(f"{name}_bucket{_format_labels(le)} {histogram.count}")
+                lines.append(
+                    f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}"
+                )
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        lines.append("")
+        return "\n".join(lines)
+
+    async def handler(self, request: Request) -> web.Response:
+        return web.Response(
+            text=self.render(), headers={"Content-Type": self.content_type}
+        )
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return f"{{{pairs}}}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import time
+from functools import partial
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    Iterable,
+    Optional,
+    Type,
+    Union,
+    cast,
+)
+from weakref import WeakKeyDictionary
+
+from aiohttp import web_response
+from aiohttp.web_app import Application
+from aiohttp.web_request import Request
+from discord import Client
+
+from . import metrics
+from .admission import AdmissionControl
+from .compression import Compression
+from .deadline import with_budget
+from .exceptions import TypeCheckError
+from .lazy import Lazy
+from .login import User, not_logged_in_error, resolve_user
+from .oauth2 import (
+    InvalidTokenError,
+    Oauth2Protocol,
+    invalid_token_error,
+    oauth2_wrapper,
+)
+from .response import HTTPError, Response, encode_response, record_response
+
+CONTEXT_KEY = "oauth_context"
+
+Handler = Callable[[Request], Awaitable[Response]]
+WebHandler = Callable[[Request], Awaitable[web_response.StreamResponse]]
+Dispatcher = Callable[[Handler, Request], Awaitable[web_response.StreamResponse]]
+
+
+class RequestContext:
+    """Everything the fused middleware resolves for a request."""
+
+    __slots__ = ("auth", "oauth", "user", "from_code")
+
+    def __init__(
+        self,
+        auth: Optional[str],
+        oauth: Union[None, Oauth2Protocol, Lazy[Optional[Oauth2Protocol]]],
+        user: Union[None, User, Lazy[Optional[User]]],
+        from_code: Callable[[str, str], Awaitable[Oauth2Protocol]],
+    ):
+        self.auth = auth
+        self.oauth = oauth
+        self.user = user
+        self.from_code = from_code
+
+
+def get_context(request: Request) -> RequestContext:
+    context: RequestContext = request[CONTEXT_KEY]
+    return context
+
+
+def oauth_middleware(
+    config: Dict[str, str],
+    bot: Client,
+    *,
+    ignore: Iterable[str] = (),
+    allow_dbl: bool = False,
+    wrapper: Optional[Type[Oauth2Protocol]] = None,
+    lazy: bool = False,
+    legacy_keys: bool = True,
+    budget: Optional[float] = None,
+    compression: Optional[Compression] = None,
+) -> Callable[
+    [Application, Handler],
+    Coroutine[Any, Any, WebHandler],
+]:
+    """
+    `convert_response(ignore)`, `oauth2_handler(...)` and `attach_user` in a
+    single middleware, behaving the same as
+
+        middlewares=[convert_response(ignore), oauth2_handler(...), attach_user]
+
+    The resolved state is stored as one RequestContext (see `get_context`).
+    With `legacy_keys`, `request["oauth"]`, `request["user"]` and
+    `request["from_code"]` are set as well so existing handlers keep working.
+    `budget` is as for `oauth2_handler`, and `compression` as for
+    `convert_response`. As with `oauth2_handler`, call the middleware's
+    `setup(app)` to close the wrapper it builds without `wrapper` along with
+    the application.
+
+    aiohttp only passes the handler to old style middlewares per request, so
+    the wrapping code is built once up front, and bound to each of an
+    application's route handlers on its first request.
+    """
+    owned = wrapper is None
+    if wrapper is None:
+        wrapper = oauth2_wrapper(config, bot)
+    ignored = frozenset(ignore)
+    oauth2 = wrapper
+    admission: Optional[AdmissionControl] = getattr(wrapper, "admission", None)
+
+    def store(request: Request, context: RequestContext) -> None:
+        request[CONTEXT_KEY] = context
+        if legacy_keys:
+            request["oauth"] = context.oauth
+            request["user"] = context.user
+            request["from_code"] = context.from_code
+
+    def build(require_logged_in: bool) -> Dispatcher:
+        async def logged_out(
+            handler: Handler, request: Request, auth: Optional[str]
+        ) -> Response:
+            if metrics.sink is not None:
+                metrics.sink.inc("oauth_helper_auth_requests_total", metrics.ANONYMOUS)
+            if require_logged_in:
+                return not_logged_in_error
+            if lazy:
+                context = RequestContext(
+                    auth, Lazy.resolved(None), Lazy.resolved(None), oauth2.from_code
+                )
+            else:
+                context = RequestContext(auth, None, None, oauth2.from_code)
+            store(request, context)
+            try:
+                return await handler(request)
+            except InvalidTokenError:
+                return invalid_token_error
+            except TypeCheckError as err:
+                return HTTPError(message=str(err), status=400)
+
+        async def logged_in(handler: Handler, request: Request, auth: str) -> Response:
+            if admission is not None:
+                admission.check_rate(auth)
+            try:
+                oauth = await oauth2.from_refresh_token(auth, config["refresh_uri"])
+            except InvalidTokenError:
+                if metrics.sink is not None:
+                    metrics.sink.inc(
+                        "oauth_helper_auth_requests_total", metrics.INVALID
+                    )
+                return invalid_token_error
+            if metrics.sink is not None:
+                metrics.sink.inc(
+                    "oauth_helper_auth_requests_total", metrics.AUTHENTICATED
+                )
+            context = RequestContext(
+                auth, oauth, None if oauth is None else User(oauth), oauth2.from_code
+            )
+            store(request, context)
+            rtn: Response
+            try:
+                if oauth is None and require_logged_in:
+                    rtn = not_logged_in_error
+                else:
+                    rtn = await handler(request)
+            except InvalidTokenError:
+                return invalid_token_error
+            except TypeCheckError as err:
+                rtn = HTTPError(message=str(err), status=400)
+            if oauth and oauth.refresh_token != auth:
+                rtn["authorization"] = oauth.refresh_token
+            return rtn
+
+        async def lazy_logged_in(
+            handler: Handler, request: Request, auth: str
+        ) -> Response:
+            if admission is not None:
+                admission.check_rate(auth)
+            if metrics.sink is not None:
+                metrics.sink.inc("oauth_helper_auth_requests_total", metrics.DEFERRED)
+            lazy_oauth: Lazy[Optional[Oauth2Protocol]] = Lazy(
+                partial(oauth2.from_refresh_token, auth, config["refresh_uri"])
+            )
+            context = RequestContext(auth, lazy_oauth, None, oauth2.from_code)
+            rtn: Response
+            try:
+                if require_logged_in:
+                    oauth = await lazy_oauth
+                    if oauth is None:
+                        store(request, context)
+                        rtn = not_logged_in_error
+                    else:
+                        context.user = Lazy.resolved(User(oauth))
+                        store(request, context)
+                        rtn = await handler(request)
+                else:
+                    context.user = Lazy(partial(resolve_user, lazy_oauth))
+                    store(request, context)
+                    rtn = await handler(request)
+            except InvalidTokenError:
+                return invalid_token_error
+            except TypeCheckError as err:
+                rtn = HTTPError(message=str(err), status=400)
+            # A failed resolve was either handled above or by the handler
+            if lazy_oauth.succeeded:
+                oauth = lazy_oauth.result()
+                if oauth and oauth.refresh_token != auth:
+                    rtn["authorization"] = oauth.refresh_token
+            return rtn
+
+        async def _inner(
+            handler: Handler, request: Request
+        ) -> web_response.StreamResponse:
+            start = time.perf_counter() if metrics.sink is not None else 0.0
+            auth = request.headers.get("Authorization")
+            rtn: Union[Response, web_response.StreamResponse]
+            handle: Awaitable[Response]
+            if not auth or (
+                allow_dbl and "Top.gg" in request.headers.get("User-Agent", "")
+            ):
+                handle = logged_out(handler, request, auth)
+            elif lazy:
+                handle = lazy_logged_in(handler, request, auth)
+            else:
+                handle = logged_in(handler, request, auth)
+            try:
+                rtn = await (handle if budget is None else with_budget(budget, handle))
+            except HTTPError as err:
+                rtn = err
+            if metrics.sink is not None:
+                record_response(start, rtn)
+            if request.method == "OPTIONS" or request.path in ignored:
+                return rtn  # type: ignore
+            assert isinstance(rtn, Response), "Not using local response class."
+            response = encode_response(rtn, request)
+            if compression is not None:
+                await compression.apply(rtn, request, response)
+            return response
+
+        return _inner
+
+    # For handlers without and with require_logged_in
+    dispatchers = (build(False), build(True))
+
+    def bind(handler: Handler) -> WebHandler:
+        require_logged_in = getattr(handler, "require_logged_in", False)
+        return partial(dispatchers[bool(require_logged_in)], handler)
+
+    # Application -> route handler -> its bound dispatcher. The router is
+    # frozen by the first request, whereas on_startup would need the
+    # application before aiohttp hands it to the middleware.
+    bound: WeakKeyDictionary[Application, Dict[Handler, WebHandler]] = (
+        WeakKeyDictionary()
+    )
+
+    async def _middleware(app: Application, handler: Handler) -> WebHandler:
+        try:
+            handlers = bound[app]
+        except KeyError:
+            handlers = bound[app] = {}
+            for route in app.router.routes():
+                route_handler = cast(Handler, route.handler)
+                handlers[route_handler] = bind(route_handler)
+        try:
+            return handlers[handler]
+        except KeyError:
+            # Handlers wrapped by the middlewares after this one are new
+            # objects each request, so can't be looked up by route
+            return bind(handler)
+
+    # As in oauth2_handler, the cleanup can't be registered per request
+    _middleware.wrapper = wrapper  # type: ignore[attr-defined]
+    _middleware.setup = (  # type: ignore[attr-defined]
+        wrapper.setup if owned else lambda app: None
+    )
+    return _middleware
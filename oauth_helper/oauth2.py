@@ -1,50 +1,173 @@
 from __future__ import annotations
 
+import asyncio
+import time
+from functools import partial
 from types import TracebackType
 from typing import (
     Optional,
     Dict,
+    Iterable,
     Any,
+    AsyncIterator,
     Awaitable,
     Callable,
     Coroutine,
-    Tuple,
-    MutableMapping,
     List,
     Protocol,
+    Tuple,
     Type,
     TYPE_CHECKING,
     cast,
 )
 
-from aiohttp import ClientResponse
+from aiohttp import ClientError, ClientResponse, ClientResponseError
 from aiohttp.web_app import Application
 from aiohttp.web_request import Request
 from discord.http import HTTPClient, Route
 from discord.errors import HTTPException
 from discord import User, Client
-import aiohttp
-import time
-from cachetools import TTLCache
-import asyncio
 
+from . import metrics
+from .trace import current_trace, traced
 from .response import HTTPError, Response
 from .exceptions import TypeCheckError
+from .http import HTTPPool, NoConcatString  # noqa: F401
+from .singleflight import SingleFlight
+from .lazy import Lazy
+from .cache import (
+    GuildCache,
+    GuildOwner,
+    NegativeCache,
+    NotInCacheError,
+    TokenCache,
+    TokenCacheProtocol,
+    SharedTokenCache,
+    UserCache,
+    UserIdentity,
+    fingerprint,
+)
+from .backends import CacheBackend
+from .admission import AdmissionControl
+from .breaker import CircuitBreaker
+from .deadline import bounded, with_budget
+from .members import MemberResolver
+from .guilds import GuildIndex, GuildList, MANAGE_GUILD
+from .joins import JoinResult, JoinStats, bulk_join
 
 
 if TYPE_CHECKING:
     from discord.types import guild
 
 
+# The most guilds Discord returns from /users/@me/guilds at once
+GUILDS_PAGE_SIZE = 200
+
+TOKEN_URL = "https://discord.com/api/v6/oauth2/token"
+
+# How long a worker may take exchanging a refresh token before another one
+# sharing the backend gives up waiting and exchanges it itself
+EXCHANGE_LEASE_TTL = 30
+EXCHANGE_LEASE_POLL_INTERVAL = 0.05
+
+invalid_token_error = HTTPError(message="Invalid login token", status=403)
+invalid_token_error.encode()
+
+# Metric labels
+_REFRESH_GRANT = "refresh_token"
+_CODE_GRANT = "authorization_code"
+
+
+def _exchange_result(status: int, json: Dict[str, Any]) -> str:
+    if status == 429:
+        return "rate_limited"
+    if status < 300 and "access_token" in json:
+        return "ok"
+    # Only this means the grant itself is no good, rather than the request
+    if status == 400 and json.get("error") == "invalid_grant":
+        return "invalid"
+    return "error"
+
+
+def _retry_after(value: Optional[str]) -> float:
+    try:
+        return float(value)  # type: ignore[arg-type]
+    except (TypeError, ValueError):
+        return 1.0
+
+
+def _record_exchange(grant: str, start: float, result: str) -> None:
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(f"token exchange ({grant})", time.perf_counter() - start)
+    sink = metrics.sink
+    if sink is None:
+        return
+    sink.observe(
+        "oauth_helper_token_exchange_seconds",
+        time.perf_counter() - start,
+        (("grant", grant),),
+    )
+    sink.inc(
+        "oauth_helper_token_exchanges_total", (("grant", grant), ("result", result))
+    )
+
+
+async def _timed_request(
+    request: Callable[..., Awaitable[Any]], route: Route, *args: Any, **kwargs: Any
+) -> Any:
+    sink = metrics.sink
+    trace = current_trace.get()
+    if sink is None and trace is None:
+        return await request(route, *args, **kwargs)
+    labels = (("method", route.method), ("route", route.path))
+    start = time.perf_counter()
+    try:
+        return await request(route, *args, **kwargs)
+    except HTTPException as e:
+        if sink is not None:
+            sink.inc(
+                "oauth_helper_discord_errors_total",
+                labels + (("status", str(e.status)),),
+            )
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        if sink is not None:
+            sink.observe("oauth_helper_discord_request_seconds", elapsed, labels)
+        if trace is not None:
+            trace.add(f"discord {route.method} {route.path}", elapsed)
+
+
 def oauth2_handler(
     config: Dict[str, str],
     bot: Client,
     allow_dbl: bool = False,
+    wrapper: Optional[Type[Oauth2Protocol]] = None,
+    lazy: bool = False,
+    budget: Optional[float] = None,
 ) -> Callable[
     [Application, Callable[[Request], Awaitable[Response]]],
     Coroutine[Any, Any, Callable[[Request], Awaitable[Response]]],
 ]:
-    wrapper = oauth2_wrapper(config, bot)
+    """
+    Resolves the Authorization header into `request["oauth"]`.
+
+    With `lazy` set, `request["oauth"]` (and `request["user"]` if attach_user
+    is used) are Lazy handles which only resolve the token when awaited, so
+    handlers which never look at them skip any token refresh.
+
+    With `budget` set, the calls to Discord made while handling a request
+    share that many seconds, after which they fail with a 504.
+
+    Without `wrapper`, one is built from `config` and kept as the returned
+    middleware's `wrapper`. Call the middleware's `setup(app)` so its
+    connections are closed along with the application.
+    """
+    owned = wrapper is None
+    if wrapper is None:
+        wrapper = oauth2_wrapper(config, bot)
+    admission: Optional[AdmissionControl] = getattr(wrapper, "admission", None)
 
     async def _middleware(
         app: Application,
@@ -52,71 +175,97 @@ def oauth2_handler(
     ) -> Callable[[Request], Awaitable[Response]]:
         async def _inner(request: Request) -> Response:
             auth = request.headers.get("Authorization", None)
+            oauth: Optional[Oauth2Protocol] = None
+            lazy_oauth: Optional[Lazy[Optional[Oauth2Protocol]]] = None
             if auth in [None, ""] or (
                 allow_dbl and "Top.gg" in request.headers.get("User-Agent", "")
             ):
-                request["oauth"] = oauth = None
+                if metrics.sink is not None:
+                    metrics.sink.inc(
+                        "oauth_helper_auth_requests_total", metrics.ANONYMOUS
+                    )
+                if lazy:
+                    request["oauth"] = Lazy.resolved(None)
+                else:
+                    request["oauth"] = None
+            elif lazy:
+                if admission is not None:
+                    admission.check_rate(auth)
+                if metrics.sink is not None:
+                    metrics.sink.inc(
+                        "oauth_helper_auth_requests_total", metrics.DEFERRED
+                    )
+                request["oauth"] = lazy_oauth = Lazy(
+                    partial(wrapper.from_refresh_token, auth, config["refresh_uri"])
+                )
             else:
                 assert auth is not None
+                if admission is not None:
+                    admission.check_rate(auth)
                 try:
                     request["oauth"] = oauth = await wrapper.from_refresh_token(
                         auth, config["refresh_uri"]
                     )
                 except InvalidTokenError:
-                    return HTTPError(message="Invalid login token", status=403)
+                    if metrics.sink is not None:
+                        metrics.sink.inc(
+                            "oauth_helper_auth_requests_total", metrics.INVALID
+                        )
+                    return invalid_token_error
+                if metrics.sink is not None:
+                    metrics.sink.inc(
+                        "oauth_helper_auth_requests_total", metrics.AUTHENTICATED
+                    )
             request["from_code"] = wrapper.from_code
             try:
                 rtn = await handler(request)
             except InvalidTokenError:
-                return HTTPError(message="Invalid login token", status=403)
+                return invalid_token_error
             except TypeCheckError as err:
                 rtn = HTTPError(message=str(err), status=400)
+            # A failed resolve was either handled above or by the handler
+            if lazy_oauth is not None and lazy_oauth.succeeded:
+                oauth = lazy_oauth.result()
             if oauth and oauth.refresh_token != auth:
                 rtn["authorization"] = oauth.refresh_token
             return rtn
 
-        return _inner
+        if budget is None:
+            return _inner
 
-    return _middleware
+        async def _budgeted(request: Request) -> Response:
+            return await with_budget(budget, _inner(request))
 
+        return _budgeted
 
-class NotInCacheError(Exception):
-    pass
+    # aiohttp only calls old style middlewares once the application is
+    # running and its signals are frozen, so the cleanup can't be registered
+    # from in here
+    _middleware.wrapper = wrapper  # type: ignore[attr-defined]
+    _middleware.setup = (  # type: ignore[attr-defined]
+        wrapper.setup if owned else lambda app: None
+    )
+    return _middleware
 
 
 class InvalidTokenError(Exception):
     pass
 
 
-class TokenCache:
-    def __init__(self) -> None:
-        self._cache: Dict[str, Tuple[str, float, str]] = {}
-
-    def get_token(self, refresh_token: str) -> Dict[str, str]:
-        if refresh_token not in self._cache:
-            raise NotInCacheError()
-        access_token, expires, scope = self._cache[refresh_token]
-        if expires <= time.time():
-            del self._cache[refresh_token]
-            raise NotInCacheError()
-        return {"access_token": access_token, "scope": scope}
-
-    def add_access_token(
-        self,
-        refresh_token: str,
-        access_token: str,
-        expires: int,
-        scope: str,
-    ) -> None:
-        self._cache[refresh_token] = (access_token, time.time() + expires, scope)
-
-
 class Oauth2Protocol(Protocol):
     access_token: str
     refresh_token: Optional[str]
     redirect_uri: str
     scopes: List[str]
     guild_id: Optional[int]
+    pool: HTTPPool
+    invalid_tokens: NegativeCache
+    token_cache: TokenCacheProtocol
+    guild_cache: GuildCache
+    members: MemberResolver
+    guild_index: GuildIndex
+    admission: AdmissionControl
+    breaker: CircuitBreaker
 
     def __init__(
         self,
@@ -142,10 +291,42 @@ class Oauth2Protocol(Protocol):
 
     async def get_guilds(self) -> List[guild.Guild]: ...
 
+    async def get_mutual_guilds(self, permissions: int = 0) -> List[guild.Guild]: ...
+
+    async def get_manageable_guilds(self) -> List[guild.Guild]: ...
+
     async def join_guild(
         self, guild_id: int, user_id: int, access_token: str, **kwargs: Any
     ) -> Optional[str]: ...
 
+    @classmethod
+    def join_guilds(
+        cls,
+        joins: Iterable[Tuple[int, int, str]],
+        *,
+        concurrency: int = 16,
+        per_guild: int = 2,
+        retries: int = 3,
+        backoff: float = 1.0,
+        stats: Optional[JoinStats] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[JoinResult]: ...
+
+    @classmethod
+    def setup(cls, app: Application) -> None: ...
+
+    @classmethod
+    async def close(cls) -> None: ...
+
+    @classmethod
+    def forget_invalid_token(cls, refresh_token: str) -> None: ...
+
+    @classmethod
+    def invalidate_guilds(cls, user_id: int) -> None: ...
+
+    @classmethod
+    async def refresh_ahead(cls, refresh_token: str, redirect_uri: str) -> None: ...
+
     @classmethod
     async def from_code(cls, code: str, redirect_uri: str) -> "Oauth2Protocol": ...
 
@@ -165,11 +346,116 @@ class Oauth2Protocol(Protocol):
     ) -> "Oauth2Protocol": ...
 
 
-def oauth2_wrapper(config: Dict[str, str], bot: Client) -> Type[Oauth2Protocol]:
-    cache = TokenCache()
-    user_id_cache: MutableMapping[str, User] = TTLCache(ttl=36000, maxsize=500)
+def oauth2_wrapper(
+    config: Dict[str, str],
+    bot: Client,
+    *,
+    pool: Optional[HTTPPool] = None,
+    invalid_tokens: Optional[NegativeCache] = None,
+    backend: Optional[CacheBackend] = None,
+    token_cache: Optional[TokenCacheProtocol] = None,
+    guild_cache: Optional[GuildCache] = None,
+    user_cache: Optional[UserCache] = None,
+    members: Optional[MemberResolver] = None,
+    guild_index: Optional[GuildIndex] = None,
+    admission: Optional[AdmissionControl] = None,
+    breaker: Optional[CircuitBreaker] = None,
+) -> Type[Oauth2Protocol]:
+    """
+    Creates the Oauth2 class for an application. `config` needs the
+    application's `client_id` and `client_secret`. `api_base` optionally
+    replaces the Discord API URL for token exchanges and user requests.
+    """
+    if token_cache is not None:
+        cache = token_cache
+    elif backend is not None:
+        cache = SharedTokenCache(backend)
+    else:
+        cache = TokenCache()
+    user_id_cache = UserCache(backend) if user_cache is None else user_cache
+    # Discord rotates refresh tokens, so only one exchange per token can succeed
+    refreshes: SingleFlight[str, Dict[str, Any]] = SingleFlight()
+    guild_fetches: SingleFlight[Tuple[GuildOwner, str], GuildList] = SingleFlight()
+    user_fetches: SingleFlight[str, UserIdentity] = SingleFlight()
+    if pool is None:
+        pool = HTTPPool()
+    if invalid_tokens is None:
+        invalid_tokens = NegativeCache()
+    if guild_cache is None:
+        guild_cache = GuildCache()
+    if members is None:
+        members = MemberResolver(bot)
+    if guild_index is None:
+        guild_index = GuildIndex.for_bot(bot)
+    if admission is None:
+        admission = AdmissionControl()
+    if breaker is None:
+        breaker = CircuitBreaker()
+    # Lets the Discord API be pointed elsewhere, eg. at a fake in load tests
+    api_base = config.get("api_base")
+    token_url = TOKEN_URL if api_base is None else f"{api_base}/oauth2/token"
+
+    async def post_token(grant: str, data: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Raises InvalidTokenError only if Discord rejected the grant, and an
+        HTTPError for failures which may go away if tried again.
+        """
+        async with Oauth2.admission.token_exchanges:
+            start = time.perf_counter()
+            try:
+                async with Oauth2.breaker:
+                    async with Oauth2.pool.session.post(
+                        token_url,
+                        data=data,
+                        headers={"Content-Type": "application/x-www-form-urlencoded"},
+                    ) as res:
+                        if res.status >= 500:
+                            raise ClientResponseError(
+                                res.request_info, res.history, status=res.status
+                            )
+                        status = res.status
+                        retry_after = res.headers.get("Retry-After")
+                        # Cloudflare's 429s aren't JSON
+                        json: Dict[str, Any] = {} if status == 429 else await res.json()
+            except ClientError as e:
+                if isinstance(e, TimeoutError):
+                    raise
+                raise HTTPError(status=502, message="Couldn't reach Discord") from e
+        result = _exchange_result(status, json)
+        _record_exchange(grant, start, result)
+        if result == "ok":
+            return json
+        if result == "invalid":
+            raise InvalidTokenError()
+        if result == "rate_limited":
+            raise HTTPError(
+                status=503,
+                message="Discord is rate limiting logins, try again later",
+                retry_after=_retry_after(retry_after),
+            )
+        raise HTTPError(status=502, message="Discord rejected the token exchange")
+
+    async def add_member(
+        guild_id: int, user_id: int, access_token: str, **kwargs: Any
+    ) -> None:
+        r = Route(
+            "PUT",
+            "/guilds/{guild_id}/members/{user_id}",
+            guild_id=guild_id,
+            user_id=user_id,
+        )
+        await bot.http.request(r, json={"access_token": access_token, **kwargs})
 
     class Oauth2:
+        pool: HTTPPool
+        invalid_tokens: NegativeCache
+        token_cache = cache
+        guild_cache: GuildCache
+        members: MemberResolver
+        guild_index: GuildIndex
+        admission: AdmissionControl
+        breaker: CircuitBreaker
+
         def __init__(
             self,
             access_token: str,
@@ -188,33 +474,44 @@ def oauth2_wrapper(config: Dict[str, str], bot: Client) -> Type[Oauth2Protocol]:
             return f"Oauth2(access_token={self.access_token!r}, refresh_token={self.refresh_token!r}, redirect_uri={self.redirect_uri!r}, scope={' '.join(self.scopes)!r})"
 
         async def __aenter__(self) -> HTTPClient:
-            loop = asyncio.get_event_loop()
-            connector = aiohttp.TCPConnector(loop=loop, limit=0)
-            self._http = HTTPClient(connector=connector, loop=loop)
-            self._http._HTTPClient__session = self._http._HTTPClient__session = (  # type: ignore
-                aiohttp.ClientSession(connector=connector)
-            )
-            self._http.token = NoConcatString(f"Bearer {self.access_token}")
-            self._http._global_over = asyncio.Event()
-            self._http._global_over.set()
+            self._http = self.pool.for_token(self.access_token)
 
             orig_request = self._http.request
 
+            async def limited_request(route: Route, *args: Any, **kwargs: Any) -> Any:
+                async with self.admission.discord_calls:
+                    return await orig_request(route, *args, **kwargs)
+
             async def request(route: Route, *args: Any, **kwargs: Any) -> Any:
+                # Covers both calls when the token has to be refreshed
+                return await bounded(attempt(route, *args, **kwargs))
+
+            async def attempt(route: Route, *args: Any, **kwargs: Any) -> Any:
+                if api_base is not None and route.url.startswith(Route.BASE):
+                    route.url = api_base + route.url[len(Route.BASE) :]
                 try:
-                    return await orig_request(route, **kwargs)
+                    return await _timed_request(limited_request, route, **kwargs)
                 except HTTPException as e:
                     if cast(ClientResponse, e.response).status == 401:
+                        if metrics.sink is not None:
+                            metrics.sink.inc(
+                                "oauth_helper_unauthorized_refreshes_total"
+                            )
                         if self.refresh_token is None:
                             raise InvalidTokenError()
                         json_data = await self._create_from_refresh_token(
                             self.refresh_token, self.redirect_uri
                         )
-                        if "access_token" not in json_data:
-                            raise InvalidTokenError()
+                        await user_id_cache.link(
+                            self.access_token, json_data["access_token"]
+                        )
                         self.access_token = json_data["access_token"]
-                        self._http.token = f"Bearer {self.access_token}"
-                        return await orig_request(route, *args, **kwargs)
+                        if "refresh_token" in json_data:
+                            self.refresh_token = json_data["refresh_token"]
+                        self._http.set_bearer(self.access_token)
+                        return await _timed_request(
+                            limited_request, route, *args, **kwargs
+                        )
                     raise
 
             self._http.request = request  # type: ignore
@@ -231,36 +528,135 @@ def oauth2_wrapper(config: Dict[str, str], bot: Client) -> Type[Oauth2Protocol]:
             return False
 
         async def get_user_info(self) -> User:
-            try:
-                return user_id_cache[self.access_token]
-            except KeyError:
-                async with self as http:
-                    rtn = user_id_cache[self.access_token] = User(
-                        data=await http.get_user("@me"), state=NotImplemented
-                    )
-            return rtn
+            identity = await user_id_cache.get(self.access_token)
+            if metrics.sink is not None:
+                metrics.sink.inc(
+                    "oauth_helper_user_cache_requests_total",
+                    metrics.MISS if identity is None else metrics.HIT,
+                )
+            if identity is None:
+                identity = await traced(
+                    "user info",
+                    user_fetches.run(self.access_token, self._fetch_user_info),
+                )
+            return identity.to_user()
+
+        async def _fetch_user_info(self) -> UserIdentity:
+            async with self as http:
+                data = await http.get_user("@me")
+            return await user_id_cache.set(data, self.access_token, self.refresh_token)
 
         async def get_guilds(self) -> List[guild.Guild]:
-            if "guilds" in self.scopes:
-                async with self as http:
-                    return await http.get_guilds(200)
-            return []
+            guild_list = await self._get_guild_list()
+            return [] if guild_list is None else list(guild_list.guilds)
+
+        async def get_mutual_guilds(self, permissions: int = 0) -> List[guild.Guild]:
+            guild_list = await self._get_guild_list()
+            if guild_list is None:
+                return []
+            return guild_list.mutual(self.guild_index, permissions)
+
+        async def get_manageable_guilds(self) -> List[guild.Guild]:
+            return await self.get_mutual_guilds(MANAGE_GUILD)
+
+        async def _get_guild_list(self) -> Optional[GuildList]:
+            if "guilds" not in self.scopes:
+                return None
+            owner: GuildOwner
+            if "identify" in self.scopes:
+                owner = (await self.get_user_info()).id
+            else:
+                # Looking the user up needs identify
+                owner = fingerprint(self.access_token)
+            scope = " ".join(sorted(self.scopes))
+            guild_list = self.guild_cache.get_list(owner, scope)
+            if metrics.sink is not None:
+                metrics.sink.inc(
+                    "oauth_helper_guild_cache_requests_total",
+                    metrics.MISS if guild_list is None else metrics.HIT,
+                )
+            if guild_list is None:
+                guild_list = await traced(
+                    "guilds",
+                    guild_fetches.run(
+                        (owner, scope), partial(self._load_guilds, owner, scope)
+                    ),
+                )
+            return guild_list
+
+        async def _load_guilds(self, owner: GuildOwner, scope: str) -> GuildList:
+            return self.guild_cache.set(owner, scope, await self._fetch_guilds())
+
+        async def _fetch_guilds(self) -> List[guild.Guild]:
+            # Pages are cursor based, so can only be fetched one after another
+            guilds: List[guild.Guild] = []
+            async with self as http:
+                while True:
+                    page = await http.get_guilds(
+                        GUILDS_PAGE_SIZE, after=guilds[-1]["id"] if guilds else None
+                    )
+                    guilds.extend(page)
+                    if len(page) < GUILDS_PAGE_SIZE:
+                        break
+            return guilds
 
         async def join_guild(
             self, guild_id: int, user_id: int, access_token: str, **kwargs: Any
         ) -> Optional[str]:
-            r = Route(
-                "PUT",
-                "/guilds/{guild_id}/members/{user_id}",
-                guild_id=guild_id,
-                user_id=user_id,
-            )
             try:
-                await bot.http.request(r, json={"access_token": access_token, **kwargs})
+                await add_member(guild_id, user_id, access_token, **kwargs)
                 return None
             except HTTPException as e:
                 return e.text
 
+        @classmethod
+        def join_guilds(
+            cls,
+            joins: Iterable[Tuple[int, int, str]],
+            *,
+            concurrency: int = 16,
+            per_guild: int = 2,
+            retries: int = 3,
+            backoff: float = 1.0,
+            stats: Optional[JoinStats] = None,
+            **kwargs: Any,
+        ) -> AsyncIterator[JoinResult]:
+            """
+            Adds many users to guilds, yielding a result for each
+            (guild ID, user ID, access token) as it completes. `kwargs` are
+            sent with every join, as with `join_guild`.
+            """
+            return bulk_join(
+                partial(add_member, **kwargs),
+                joins,
+                concurrency=concurrency,
+                per_guild=per_guild,
+                retries=retries,
+                backoff=backoff,
+                stats=stats,
+            )
+
+        @classmethod
+        def setup(cls, app: Application) -> None:
+            async def _on_cleanup(app: Application) -> None:
+                await cls.close()
+
+            app.on_cleanup.append(_on_cleanup)
+
+        @classmethod
+        async def close(cls) -> None:
+            await cls.pool.close()
+            if backend is not None:
+                await backend.close()
+
+        @classmethod
+        def forget_invalid_token(cls, refresh_token: str) -> None:
+            cls.invalid_tokens.discard(refresh_token)
+
+        @classmethod
+        def invalidate_guilds(cls, user_id: int) -> None:
+            cls.guild_cache.invalidate(user_id)
+
         @classmethod
         async def from_code(cls, code: str, redirect_uri: str) -> "Oauth2Protocol":
             config_data = {
@@ -270,34 +666,107 @@ def oauth2_wrapper(config: Dict[str, str], bot: Client) -> Type[Oauth2Protocol]:
                 "code": code,
                 "redirect_uri": redirect_uri,
             }
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    "https://discord.com/api/v6/oauth2/token",
-                    data=config_data,
-                    headers={"Content-Type": "application/x-www-form-urlencoded"},
-                ) as res:
-                    return cls.create_from_json(await res.json(), redirect_uri)
+            json = await bounded(post_token(_CODE_GRANT, config_data))
+            return await cls._from_json(json, redirect_uri)
 
         @classmethod
         async def from_refresh_token(
             cls, refresh_token: str, redirect_uri: str
         ) -> "Oauth2Protocol":
             try:
-                return Oauth2(
-                    refresh_token=refresh_token,
+                oauth = Oauth2(
                     redirect_uri=redirect_uri,
-                    **cache.get_token(refresh_token),  # type: ignore
+                    guild_id=None,
+                    **await cache.get_token(refresh_token),
                 )
             except NotInCacheError:
-                pass
+                if metrics.sink is not None:
+                    metrics.sink.inc(
+                        "oauth_helper_token_cache_requests_total", metrics.MISS
+                    )
+            else:
+                if metrics.sink is not None:
+                    metrics.sink.inc(
+                        "oauth_helper_token_cache_requests_total", metrics.HIT
+                    )
+                return oauth
             return cls.create_from_json(
                 await cls._create_from_refresh_token(refresh_token, redirect_uri),
                 redirect_uri,
             )
 
+        @classmethod
+        async def refresh_ahead(cls, refresh_token: str, redirect_uri: str) -> None:
+            try:
+                cls.create_from_json(
+                    await cls._create_from_refresh_token(refresh_token, redirect_uri),
+                    redirect_uri,
+                )
+            except InvalidTokenError:
+                await cache.discard(refresh_token)
+
         @staticmethod
         async def _create_from_refresh_token(
             refresh_token: str, redirect_uri: str
+        ) -> Dict[str, Any]:
+            if refresh_token in Oauth2.invalid_tokens:
+                if metrics.sink is not None:
+                    metrics.sink.inc("oauth_helper_invalid_token_cache_hits_total")
+                raise InvalidTokenError()
+            # A caller running out of time stops waiting, but the exchange
+            # carries on for any others
+            return await bounded(
+                traced(
+                    "token refresh",
+                    refreshes.run(
+                        refresh_token,
+                        lambda: Oauth2._exchange_refresh_token(
+                            refresh_token, redirect_uri
+                        ),
+                    ),
+                )
+            )
+
+        @staticmethod
+        async def _exchange_refresh_token(
+            refresh_token: str, redirect_uri: str
+        ) -> Dict[str, Any]:
+            if backend is None:
+                return await Oauth2._redeem_refresh_token(refresh_token, redirect_uri)
+            # SingleFlight only coalesces within this process, so workers
+            # sharing the backend take a lease on redeeming the token too
+            lease = "oauth_helper:lease:" + fingerprint(refresh_token).hex()
+            while not await backend.lease(lease, EXCHANGE_LEASE_TTL):
+                while await backend.get(lease) is not None:
+                    await asyncio.sleep(EXCHANGE_LEASE_POLL_INTERVAL)
+                successor = await Oauth2._cached_successor(refresh_token)
+                if successor is not None:
+                    return successor
+                # The other worker's exchange failed, so try ours
+            try:
+                # It may have finished between our cache miss and the lease
+                successor = await Oauth2._cached_successor(refresh_token)
+                if successor is not None:
+                    return successor
+                return await Oauth2._redeem_refresh_token(refresh_token, redirect_uri)
+            finally:
+                await backend.delete(lease)
+
+        @staticmethod
+        async def _cached_successor(refresh_token: str) -> Optional[Dict[str, Any]]:
+            try:
+                json = await cache.get_token(refresh_token)
+            except NotInCacheError:
+                return None
+            # The token itself being cached doesn't count, as refreshing
+            # ahead or after a 401 wants a new access token
+            if json["refresh_token"] == refresh_token:
+                return None
+            return json
+
+        @staticmethod
+        async def _redeem_refresh_token(
+            refresh_token: str, redirect_uri: str
         ) -> Dict[str, Any]:
             config_data = {
                 "client_id": config["client_id"],
@@ -306,13 +775,17 @@ def oauth2_wrapper(config: Dict[str, str], bot: Client) -> Type[Oauth2Protocol]:
                 "refresh_token": refresh_token,
                 "redirect_uri": redirect_uri,
             }
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    "https://discord.com/api/v6/oauth2/token",
-                    data=config_data,
-                    headers={"Content-Type": "application/x-www-form-urlencoded"},
-                ) as res:
-                    return await res.json()  # type: ignore
+            try:
+                json = await post_token(_REFRESH_GRANT, config_data)
+            except InvalidTokenError:
+                Oauth2.invalid_tokens.add(refresh_token)
+                raise
+            if "refresh_token" in json:
+                # Before the exchange resolves, so a request arriving just
+                # after finds the successor rather than redeeming the old
+                # token again
+                await Oauth2._store(json, previous=refresh_token)
+            return json
 
         @classmethod
         def from_access_token(
@@ -332,12 +805,6 @@ def oauth2_wrapper(config: Dict[str, str], bot: Client) -> Type[Oauth2Protocol]:
         ) -> "Oauth2Protocol":
             if "refresh_token" not in json:
                 raise InvalidTokenError()
-            cache.add_access_token(
-                json["refresh_token"],
-                json["access_token"],
-                json["expires_in"],
-                json["scope"],
-            )
             return Oauth2(
                 json["access_token"],
                 json["refresh_token"],
@@ -346,9 +813,33 @@ def oauth2_wrapper(config: Dict[str, str], bot: Client) -> Type[Oauth2Protocol]:
                 "guild" in json and int(json["guild"]["id"]) or None,
             )
 
-    return Oauth2
+        @classmethod
+        async def _from_json(
+            cls, json: Dict[str, Any], redirect_uri: str
+        ) -> "Oauth2Protocol":
+            oauth = cls.create_from_json(json, redirect_uri)
+            await cls._store(json)
+            return oauth
 
+        @staticmethod
+        async def _store(json: Dict[str, Any], previous: Optional[str] = None) -> None:
+            await cache.add_access_token(
+                json["refresh_token"],
+                json["access_token"],
+                json["expires_in"],
+                json["scope"],
+            )
+            if previous is not None:
+                await cache.add_successor(previous, json["refresh_token"])
+                await user_id_cache.link(
+                    previous, json["access_token"], json["refresh_token"]
+                )
 
-class NoConcatString(str):
-    def __radd__(self, other: Any) -> str:
-        return self
+    Oauth2.pool = pool
+    Oauth2.invalid_tokens = invalid_tokens
+    Oauth2.guild_cache = guild_cache
+    Oauth2.members = members
+    Oauth2.guild_index = guild_index
+    Oauth2.admission = admission
+    Oauth2.breaker = breaker
+    return Oauth2
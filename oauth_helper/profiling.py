@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from types import FrameType
+from typing import Any, Awaitable, Callable, Deque, List, Optional, Tuple
+
+from aiohttp.web_app import Application
+from aiohttp.web_request import Request
+
+from .response import HTTPError, Response
+from .trace import RequestTrace, current_trace
+
+
+class StackSampler:
+    """
+    A sampling profiler for one thread, run from a background thread.
+
+    Every `interval` seconds the target thread's stack is recorded. Stacks
+    are collected in the folded format flame graph tools read.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self._target = 0
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, thread_id: Optional[int] = None) -> None:
+        self._target = threading.get_ident() if thread_id is None else thread_id
+        threading.Thread(
+            target=self._run, name="oauth_helper-sampler", daemon=True
+        ).start()
+
+    def stop(self) -> str:
+        """Stops sampling (without waiting for the thread) and returns the stacks."""
+        with self._lock:
+            self._stopped.set()
+            samples = self.samples.most_common()
+        return "\n".join(f"{stack} {count}" for stack, count in samples)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            stack = _fold(frame)
+            with self._lock:
+                if self._stopped.is_set():
+                    return
+                self.samples[stack] += 1
+
+
+def _fold(frame: Optional[FrameType]) -> str:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+class SlowRequestRecorder:
+    """
+    Records a breakdown of where the time went for requests slower than
+    `threshold` seconds, keeping the slowest `size` of them.
+
+    Stages are timed by the code they happen in (token exchanges, Discord
+    API calls, get_params and response encoding); the rest of a request's
+    duration was spent in the handler itself. A fraction `profile_rate` of
+    requests additionally run under a StackSampler. Samples cover
+    everything on the event loop while the request is in flight, so
+    concurrent requests show up too. Only one request is profiled at a
+    time, and the latest `size` profiled requests are kept separately, fast
+    or not.
+
+    Add `middleware` first in the application's middlewares so it times
+    the others as well. `handler` lists the slow requests, slowest first,
+    then the profiled ones, latest first. It should only be reachable by
+    administrators.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.5,
+        size: int = 50,
+        *,
+        profile_rate: float = 0.0,
+        profile_interval: float = 0.005,
+        timer: Callable[[], float] = time.perf_counter,
+    ):
+        self.threshold = threshold
+        self.size = size
+        self.profile_rate = profile_rate
+        self.profile_interval = profile_interval
+        self.timer = timer
+        self.profiles: Deque[RequestTrace] = deque(maxlen=size)
+        # A min-heap of (duration, order recorded, trace), so the fastest
+        # of the slow requests is the one replaced
+        self._slow: List[Tuple[float, int, RequestTrace]] = []
+        self._order = itertools.count()
+        self._profiling = False
+
+    def slowest(self, limit: Optional[int] = None) -> List[RequestTrace]:
+        requests = [trace for _, _, trace in sorted(self._slow, reverse=True)]
+        return requests if limit is None else requests[:limit]
+
+    def profiled(self, limit: Optional[int] = None) -> List[RequestTrace]:
+        requests = list(reversed(self.profiles))
+        return requests if limit is None else requests[:limit]
+
+    def record(self, trace: RequestTrace) -> None:
+        if trace.duration >= self.threshold:
+            entry = (trace.duration, next(self._order), trace)
+            if len(self._slow) < self.size:
+                heapq.heappush(self._slow, entry)
+            else:
+                heapq.heappushpop(self._slow, entry)
+        if trace.profile is not None:
+            self.profiles.append(trace)
+
+    def clear(self) -> None:
+        self._slow.clear()
+        self.profiles.clear()
+
+    async def middleware(
+        self,
+        app: Application,
+        handler: Callable[[Request], Awaitable[Any]],
+    ) -> Callable[[Request], Awaitable[Any]]:
+        async def _inner(request: Request) -> Any:
+            trace = RequestTrace(request.method, request.path, time.time())
+            token = current_trace.set(trace)
+            sampler: Optional[StackSampler] = None
+            if (
+                self.profile_rate
+                and not self._profiling
+                and random.random() < self.profile_rate
+            ):
+                self._profiling = True
+                sampler = StackSampler(self.profile_interval)
+                sampler.start()
+            start = self.timer()
+            try:
+                rtn = await handler(request)
+                trace.status = getattr(rtn, "status", 0)
+                return rtn
+            except Exception as e:
+                trace.status = getattr(e, "status", 500)
+                raise
+            finally:
+                trace.duration = self.timer() - start
+                current_trace.reset(token)
+                if sampler is not None:
+                    trace.profile = sampler.stop()
+                    self._profiling = False
+                self.record(trace)
+
+        return _inner
+
+    async def handler(self, request: Request) -> Response:
+        limit = request.rel_url.query.get("limit")
+        try:
+            count = None if limit is None else int(limit)
+        except ValueError:
+            raise HTTPError(status=400, message="limit must be an integer")
+        return Response(
+            threshold=self.threshold,
+            requests=[trace.to_dict() for trace in self.slowest(count)],
+            profiled=[trace.to_dict() for trace in self.profiled(count)],
+        )
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Optional, Type, TYPE_CHECKING
+
+from aiohttp.web_app import Application
+
+if TYPE_CHECKING:
+    from .oauth2 import Oauth2Protocol
+
+
+log = logging.getLogger(__name__)
+
+
+class TokenRefresher:
+    """
+    Refreshes access tokens of active users shortly before they expire, so
+    requests find a fresh token in the cache instead of exchanging inline.
+
+    A token is refreshed if it expires within `window` seconds, was used at
+    least `min_hits` times since it was issued and was last used no more
+    than `max_idle` seconds ago.
+    """
+
+    def __init__(
+        self,
+        wrapper: Type[Oauth2Protocol],
+        redirect_uri: str,
+        *,
+        window: float = 300,
+        interval: float = 30,
+        concurrency: int = 4,
+        min_hits: int = 2,
+        max_idle: float = 900,
+    ):
+        self.wrapper = wrapper
+        # Caches only keep the statistics tokens are picked by when asked to
+        wrapper.token_cache.track_usage = True
+        self.redirect_uri = redirect_uri
+        self.window = window
+        self.interval = interval
+        self.min_hits = min_hits
+        self.max_idle = max_idle
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def setup(self, app: Application) -> None:
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+
+    async def _on_startup(self, app: Application) -> None:
+        self.start()
+
+    async def _on_cleanup(self, app: Application) -> None:
+        await self.stop()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh_once()
+            except Exception:
+                # Eg. the cache backend being briefly unreachable
+                log.exception("Failed to find tokens to refresh")
+            await asyncio.sleep(self.interval)
+
+    async def refresh_once(self) -> int:
+        tokens = await self.wrapper.token_cache.expiring(
+            self.window, self.min_hits, self.max_idle
+        )
+        await asyncio.gather(*(self._refresh(token) for token in tokens))
+        return len(tokens)
+
+    async def _refresh(self, refresh_token: str) -> None:
+        async with self._semaphore:
+            try:
+                await self.wrapper.refresh_ahead(refresh_token, self.redirect_uri)
+            except Exception:
+                log.exception("Failed to refresh a token ahead of expiry")
@@ -1,21 +1,68 @@
-from typing import Any, Optional, Awaitable, Callable, List, Coroutine
+import time
+from typing import (
+    Any,
+    Optional,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Coroutine,
+    Tuple,
+    TYPE_CHECKING,
+)
 
 from aiohttp import web_response
 from aiohttp.web import Application
-from aiohttp.web import Request, json_response
+from aiohttp.web import Request
 from aiohttp.web import Response as WebResponse
 
+from . import metrics
+from .codec import JSONCodec, get_json_codec
+from .trace import current_trace
+
+if TYPE_CHECKING:
+    from .compression import Compression
+
 
 class Response:
+    # A strong validator for the encoded body, if it has one
+    etag: Optional[str] = None
+
     def __init__(self, status: int = 200, **kwargs: Any):
         self.attrs = kwargs
         self.status = status
+        self._body: Optional[Tuple[JSONCodec, bytes]] = None
+        # Encoding -> compressed body, see Compression
+        self._compressed: Optional[Dict[str, bytes]] = None
+
+    def encode(self) -> bytes:
+        """
+        Serialises the attributes, reusing the previous result if they
+        haven't been changed through __setitem__ since.
+        """
+        codec = get_json_codec()
+        if self._body is None or self._body[0] is not codec:
+            self._body = (codec, codec.dumps(self.attrs))
+            self._compressed = None
+        return self._body[1]
 
     def to_response(self) -> web_response.Response:
-        return json_response(self.attrs, status=self.status)
+        response = WebResponse(
+            body=self.encode(),
+            status=self.status,
+            content_type="application/json",
+            charset="utf-8",
+        )
+        if self.etag is not None:
+            response.headers["ETag"] = self.etag
+            response.headers["Cache-Control"] = "private"
+        return response
 
     def __setitem__(self, key: str, value: Any) -> None:
         self.attrs[key] = value
+        self._body = None
+        self._compressed = None
+        self.etag = None
 
     def __getitem__(self, item: str) -> Any:
         return self.attrs[item]
@@ -43,6 +90,7 @@ class HTTPError(Response, Exception):
 
 def convert_response(
     ignore: List[str],
+    compression: Optional["Compression"] = None,
 ) -> Callable[
     [Application, Callable[[Request], Awaitable[Response]]],
     Coroutine[Any, Any, Callable[[Request], Awaitable[web_response.Response]]],
@@ -52,17 +100,69 @@ def convert_response(
         handler: Callable[[Request], Awaitable[Response | web_response.Response]],
     ) -> Callable[[Request], Awaitable[web_response.Response]]:
         async def _inner(request: Request) -> web_response.Response:
+            start = time.perf_counter() if metrics.sink is not None else 0.0
             try:
                 rtn = await handler(request)
             except HTTPError as err:
                 rtn = err
+            if metrics.sink is not None:
+                record_response(start, rtn)
             if request.method == "OPTIONS":
                 return rtn  # type: ignore
             if request.path in ignore:
                 return rtn  # type: ignore
             assert isinstance(rtn, Response), "Not using local response class."
-            return rtn.to_response()
+            response = encode_response(rtn, request)
+            if compression is not None:
+                await compression.apply(rtn, request, response)
+            return response
 
         return _inner
 
     return _outer
+
+
+def record_response(start: float, rtn: Any) -> None:
+    """Counts a response, whose handler was called at `start`."""
+    sink = metrics.sink
+    if sink is None:
+        return
+    sink.observe("oauth_helper_handler_seconds", time.perf_counter() - start)
+    sink.inc(
+        "oauth_helper_responses_total", (("status", str(getattr(rtn, "status", 0))),)
+    )
+
+
+def _not_modified(rtn: Response, request: Request) -> Optional[str]:
+    """The response's ETag, if the client already has this version of it."""
+    etag = rtn.etag
+    if etag is None or request.method not in ("GET", "HEAD"):
+        return None
+    header = request.headers.get("If-None-Match")
+    if header is None:
+        return None
+    if header.strip() == "*" or any(
+        tag.strip().removeprefix("W/") == etag for tag in header.split(",")
+    ):
+        return etag
+    return None
+
+
+def encode_response(rtn: Response, request: Request) -> web_response.Response:
+    """
+    Serialises `rtn`, or returns an empty 304 if the client already has it.
+    """
+    etag = _not_modified(rtn, request)
+    if etag is not None:
+        if metrics.sink is not None:
+            metrics.sink.inc("oauth_helper_not_modified_total")
+        return WebResponse(
+            status=304, headers={"ETag": etag, "Cache-Control": "private"}
+        )
+    trace = current_trace.get()
+    if trace is None:
+        return rtn.to_response()
+    start = time.perf_counter()
+    response = rtn.to_response()
+    trace.add("encode", time.perf_counter() - start)
+    return response
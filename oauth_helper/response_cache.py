@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import hashlib
+import itertools
+import time
+from functools import wraps
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Optional,
+    Tuple,
+)
+
+from aiohttp.web_request import Request
+from cachetools import LRUCache
+
+from . import metrics
+from .codec import JSONCodec
+from .lazy import Lazy
+from .login import User
+from .middleware import CONTEXT_KEY
+from .response import Response
+
+Handler = Callable[[Request], Awaitable[Response]]
+# Handler, user ID, path and query string
+Key = Tuple[str, int, str]
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+class CachedResponse(Response):
+    """
+    A Response served from a ResponseCache. Each request gets its own
+    copy, so middlewares can still change it.
+    """
+
+    def __init__(
+        self,
+        status: int,
+        attrs: Dict[str, Any],
+        body: Tuple[JSONCodec, bytes],
+        etag: str,
+        compressed: Dict[str, bytes],
+    ):
+        super().__init__(status, **attrs)
+        self._body = body
+        self.etag = etag
+        # Shared with the cache entry, so each body is compressed once
+        self._compressed = compressed
+
+
+class _Entry:
+    __slots__ = (
+        "status",
+        "attrs",
+        "body",
+        "etag",
+        "expires",
+        "stored",
+        "tags",
+        "compressed",
+    )
+
+    def __init__(
+        self,
+        status: int,
+        attrs: Dict[str, Any],
+        body: Tuple[JSONCodec, bytes],
+        expires: float,
+        stored: int,
+        tags: Tuple[str, ...],
+    ):
+        self.status = status
+        self.attrs = attrs
+        self.body = body
+        self.etag = make_etag(body[1])
+        self.expires = expires
+        self.stored = stored
+        self.tags = tags
+        self.compressed: Dict[str, bytes] = {}
+
+
+class ResponseCache:
+    """
+    Serialised responses of logged in GET handlers, per user and query.
+
+        cache = ResponseCache()
+
+        @cache.cached(ttl=30, tags=["guilds"])
+        async def guilds(request):
+            ...
+
+        cache.invalidate("guilds", user_id=user.id)
+
+    Handlers served from the cache are not called. Responses carry a strong
+    ETag, so convert_response (or oauth_middleware) answers a matching
+    If-None-Match with an empty 304. Cached handlers require the user to be
+    logged in, and `request["user"]` to be set by attach_user or
+    oauth_middleware. Only 200 responses are stored, for the least
+    recently used `maxsize` keys.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self.timer = timer
+        self._entries: LRUCache[Key, _Entry] = LRUCache(maxsize=maxsize)
+        # (tag, user ID or None for everyone) -> when it was last invalidated
+        self._invalidated: Dict[Tuple[str, Optional[int]], int] = {}
+        self._clock = itertools.count(1)
+        self._maxsize = maxsize
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def cached(
+        self, ttl: float = 60, tags: Iterable[str] = ()
+    ) -> Callable[[Handler], Handler]:
+        tags = tuple(tags)
+
+        def decorator(handler: Handler) -> Handler:
+            name = f"{handler.__module__}.{handler.__qualname__}"
+
+            @wraps(handler)
+            async def _inner(request: Request) -> Response:
+                if request.method not in ("GET", "HEAD"):
+                    return await handler(request)
+                user = await _get_user(request)
+                key = (name, (await user.user_info()).id, request.path_qs)
+                entry = self._get(key)
+                if metrics.sink is not None:
+                    metrics.sink.inc(
+                        "oauth_helper_response_cache_requests_total",
+                        metrics.MISS if entry is None else metrics.HIT,
+                    )
+                if entry is None:
+                    stored = next(self._clock)
+                    rtn = await handler(request)
+                    if type(rtn) is not Response or rtn.status != 200:
+                        return rtn
+                    rtn.encode()
+                    assert rtn._body is not None
+                    entry = self._entries[key] = _Entry(
+                        rtn.status,
+                        rtn.attrs,
+                        rtn._body,
+                        self.timer() + ttl,
+                        stored,
+                        tags,
+                    )
+                return CachedResponse(
+                    entry.status,
+                    dict(entry.attrs),
+                    entry.body,
+                    entry.etag,
+                    entry.compressed,
+                )
+
+            _inner.require_logged_in = True  # type: ignore
+            return _inner
+
+        return decorator
+
+    def _get(self, key: Key) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= self.timer() or any(
+            self._invalidated.get((tag, user_id), 0) >= entry.stored
+            for tag in entry.tags
+            for user_id in (None, key[1])
+        ):
+            del self._entries[key]
+            return None
+        return entry
+
+    def invalidate(self, tag: str, user_id: Optional[int] = None) -> None:
+        """
+        Drops the responses tagged with `tag`, for one user or everyone.
+        Responses being generated at the time are dropped too.
+        """
+        if len(self._invalidated) >= self._maxsize:
+            # Nothing older than now can be valid anyway
+            self.clear()
+        self._invalidated[tag, user_id] = next(self._clock)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._invalidated.clear()
+
+
+async def _get_user(request: Request) -> User:
+    user = request.get("user")
+    if user is None and CONTEXT_KEY in request:
+        user = request[CONTEXT_KEY].user
+    if isinstance(user, Lazy):
+        user = await user
+    assert isinstance(user, User), "ResponseCache needs a logged in user"
+    return user
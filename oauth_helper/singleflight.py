@@ -0,0 +1,39 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class SingleFlight(Generic[K, V]):
+    """
+    Coalesces concurrent calls for the same key into a single awaitable.
+
+    The shared call runs as its own task, so a caller being cancelled (for
+    example because its client disconnected) does not cancel the call for
+    everybody else waiting on it.
+    """
+
+    def __init__(self) -> None:
+        self._in_flight: Dict[K, "asyncio.Task[V]"] = {}
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._in_flight
+
+    async def run(self, key: K, func: Callable[[], Awaitable[V]]) -> V:
+        try:
+            task = self._in_flight[key]
+        except KeyError:
+            task = self._in_flight[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: K, task: "asyncio.Task[V]") -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved if every waiter went away
+            task.exception()
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# The trace of the request being handled, if it is being recorded. Code on
+# the hot path reads this and only times its stages when it is set.
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar(
+    "oauth_helper_trace", default=None
+)
+
+
+class RequestTrace:
+    """Where the time of a single request went."""
+
+    __slots__ = ("method", "path", "started", "duration", "status", "stages", "profile")
+
+    def __init__(self, method: str, path: str, started: float):
+        self.method = method
+        self.path = path
+        # Wall clock time, for display
+        self.started = started
+        self.duration = 0.0
+        self.status = 0
+        self.stages: List[Tuple[str, float]] = []
+        # Folded stacks ("frame;frame;frame count" lines), if sampled
+        self.profile: Optional[str] = None
+
+    def add(self, stage: str, duration: float) -> None:
+        self.stages.append((stage, duration))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "started": self.started,
+            "duration": self.duration,
+            "status": self.status,
+            "stages": [
+                {"stage": stage, "duration": duration}
+                for stage, duration in self.stages
+            ],
+            "profile": self.profile,
+        }
+
+
+async def traced(stage: str, awaitable: Awaitable[T]) -> T:
+    """Awaits `awaitable`, adding the time taken to the current trace."""
+    trace = current_trace.get()
+    if trace is None:
+        return await awaitable
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        trace.add(stage, time.perf_counter() - start)
@@ -9,4 +9,5 @@ setup(
     url="https://nqn.blue/",
     packages=["oauth_helper"],
     install_requires=["cachetools", "discord.py"],
+    extras_require={"speedups": ["orjson"], "brotli": ["brotli"]},
 )
@@ -0,0 +1,179 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from oauth_helper import (
+    AdmissionControl,
+    HTTPError,
+    MemorySink,
+    Response,
+    attach_user,
+    convert_response,
+    oauth2_handler,
+    oauth2_wrapper,
+    oauth_middleware,
+    set_metrics_sink,
+)
+from oauth_helper.admission import ConcurrencyLimit, RateLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit_sheds():
+    limit = ConcurrencyLimit("test", 1, max_queue=1)
+    release = asyncio.Event()
+
+    async def hold():
+        async with limit:
+            await release.wait()
+
+    first = asyncio.ensure_future(hold())
+    second = asyncio.ensure_future(hold())
+    await asyncio.sleep(0)
+    assert (limit.in_flight, limit.waiting) == (1, 1)
+    with pytest.raises(HTTPError) as e:
+        async with limit:
+            pass
+    assert e.value.status == 503
+    release.set()
+    await asyncio.gather(first, second)
+    assert (limit.in_flight, limit.waiting) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit_timeout():
+    limit = ConcurrencyLimit("test", 1, timeout=0.01)
+    async with limit:
+        with pytest.raises(HTTPError):
+            async with limit:
+                pass
+        assert limit.waiting == 0
+    async with limit:
+        pass
+
+
+def test_rate_limiter():
+    clock = Clock()
+    limiter = RateLimiter(rate=2, burst=2, timer=clock)
+    assert [limiter.acquire("a") for _ in range(2)] == [0, 0]
+    assert limiter.acquire("a") == pytest.approx(0.5)
+    assert limiter.acquire("b") == 0
+    clock.now = 0.5
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == pytest.approx(0.5)
+
+
+class FakeOauth2:
+    admission = AdmissionControl(rate=1, burst=2)
+
+    def __init__(self, refresh_token):
+        self.refresh_token = refresh_token
+
+    @classmethod
+    async def from_refresh_token(cls, refresh_token, redirect_uri):
+        return cls(refresh_token)
+
+    @classmethod
+    async def from_code(cls, code, redirect_uri):
+        raise NotImplementedError
+
+
+async def handler(request):
+    return Response(ok=True)
+
+
+CONFIG = {"refresh_uri": "http://localhost"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+@pytest.mark.parametrize("lazy", [False, True])
+@pytest.mark.parametrize(
+    "middlewares",
+    [
+        lambda lazy: [
+            convert_response([]),
+            oauth2_handler(CONFIG, None, wrapper=FakeOauth2, lazy=lazy),
+            attach_user,
+        ],
+        lambda lazy: [oauth_middleware(CONFIG, None, wrapper=FakeOauth2, lazy=lazy)],
+    ],
+    ids=["stacked", "fused"],
+)
+async def test_rate_limited_per_token(middlewares, lazy):
+    FakeOauth2.admission.rate_limiter.clear()
+    sink = MemorySink()
+    set_metrics_sink(sink)
+    app = web.Application(middlewares=middlewares(lazy))
+    app.router.add_get("/", handler)
+    try:
+        async with TestClient(TestServer(app)) as client:
+            statuses = [
+                (await client.get("/", headers={"Authorization": "a"})).status
+                for _ in range(3)
+            ]
+            assert statuses == [200, 200, 429]
+            res = await client.get("/", headers={"Authorization": "a"})
+            assert 0 < (await res.json())["retry_after"] <= 1
+            assert (await client.get("/", headers={"Authorization": "b"})).status == 200
+            assert (await client.get("/")).status == 200
+    finally:
+        set_metrics_sink(None)
+    assert sink.counter("oauth_helper_rate_limited_total") == 2
+
+
+@pytest.mark.asyncio
+async def test_token_exchanges_are_shed():
+    async def token(request):
+        await asyncio.sleep(0.05)
+        data = await request.post()
+        return web.Response(
+            body=json.dumps(
+                {
+                    "access_token": "access",
+                    "refresh_token": data["refresh_token"] + "-new",
+                    "expires_in": 604800,
+                    "scope": "identify",
+                }
+            ),
+            content_type="application/json",
+        )
+
+    app = web.Application()
+    app.router.add_post("/oauth2/token", token)
+    sink = MemorySink()
+    set_metrics_sink(sink)
+    async with TestServer(app) as server:
+        wrapper = oauth2_wrapper(
+            {
+                "client_id": "1",
+                "client_secret": "secret",
+                "api_base": str(server.make_url("")).rstrip("/"),
+            },
+            bot=None,
+            admission=AdmissionControl(token_exchanges=1, max_queue=1),
+        )
+        try:
+            results = await asyncio.gather(
+                *(wrapper.from_refresh_token(str(i), "") for i in range(3)),
+                return_exceptions=True,
+            )
+        finally:
+            await wrapper.close()
+            set_metrics_sink(None)
+    assert [r.refresh_token for r in results[:2]] == ["0-new", "1-new"]
+    assert isinstance(results[2], HTTPError) and results[2].status == 503
+    assert (
+        sink.counter("oauth_helper_shed_total", limit="token_exchanges", reason="queue")
+        == 1
+    )
@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from oauth_helper.backends import (
+    MemoryBackend,
+    RedisBackend,
+    RedisError,
+    SQLiteBackend,
+)
+
+
+class FakeRedis:
+    """Just enough of a RESP2 server to exercise RedisBackend."""
+
+    def __init__(self):
+        self.data = {}
+
+    async def handle(self, reader, writer):
+        while True:
+            try:
+                line = await reader.readuntil(b"\r\n")
+            except asyncio.IncompleteReadError:
+                break
+            args = []
+            for _ in range(int(line[1:-2])):
+                length = int((await reader.readuntil(b"\r\n"))[1:-2])
+                args.append((await reader.readexactly(length + 2))[:-2])
+            command = args[0].upper()
+            if command == b"GET":
+                value = self.data.get(args[1])
+                if value is None:
+                    writer.write(b"$-1\r\n")
+                else:
+                    writer.write(b"$%d\r\n%s\r\n" % (len(value), value))
+            elif command == b"SET":
+                if b"NX" in args[3:] and args[1] in self.data:
+                    writer.write(b"$-1\r\n")
+                else:
+                    self.data[args[1]] = args[2]
+                    writer.write(b"+OK\r\n")
+            elif command == b"DEL":
+                writer.write(b":%d\r\n" % int(self.data.pop(args[1], None) is not None))
+            else:
+                writer.write(b"-ERR unknown command\r\n")
+            await writer.drain()
+        writer.close()
+
+
+@pytest_asyncio.fixture
+async def redis_server():
+    fake = FakeRedis()
+    server = await asyncio.start_server(fake.handle, "127.0.0.1", 0)
+    async with server:
+        yield server.sockets[0].getsockname()[1]
+
+
+@pytest_asyncio.fixture(params=["memory", "sqlite", "redis"])
+async def backend(request, tmp_path, redis_server):
+    if request.param == "memory":
+        backend = MemoryBackend()
+    elif request.param == "sqlite":
+        backend = SQLiteBackend(str(tmp_path / "cache.db"))
+    else:
+        backend = RedisBackend("127.0.0.1", redis_server)
+    yield backend
+    await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_backend_roundtrip(backend):
+    assert await backend.get("key") is None
+    await backend.set("key", b"value", 60)
+    assert await backend.get("key") == b"value"
+    await backend.delete("key")
+    assert await backend.get("key") is None
+
+
+@pytest.mark.asyncio
+async def test_backend_lease(backend):
+    assert await backend.lease("lease", 60)
+    assert not await backend.lease("lease", 60)
+    await backend.delete("lease")
+    assert await backend.lease("lease", 60)
+
+
+@pytest.mark.asyncio
+async def test_sqlite_expired_lease_is_taken(tmp_path):
+    first = SQLiteBackend(str(tmp_path / "cache.db"))
+    second = SQLiteBackend(str(tmp_path / "cache.db"))
+    assert await first.lease("lease", -1)
+    assert await second.lease("lease", 60)
+    assert not await first.lease("lease", 60)
+    await first.close()
+    await second.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_expiry(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.db"))
+    await backend.set("key", b"value", -1)
+    assert await backend.get("key") is None
+    await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_shared_between_instances(tmp_path):
+    first = SQLiteBackend(str(tmp_path / "cache.db"))
+    second = SQLiteBackend(str(tmp_path / "cache.db"))
+    await first.set("key", b"value", 60)
+    assert await second.get("key") == b"value"
+    await first.close()
+    await second.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_close_stops_thread(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.db"))
+    await backend.set("key", b"value", 60)
+    await backend.close()
+    with pytest.raises(RuntimeError):
+        backend._executor.submit(print)
+
+
+@pytest.mark.asyncio
+async def test_redis_connections_are_reused(redis_server):
+    backend = RedisBackend("127.0.0.1", redis_server, pool_size=2)
+    await asyncio.gather(*(backend.set(f"key{i}", b"v", 60) for i in range(10)))
+    assert len(backend._idle) == 2
+    await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_redis_failed_auth_closes_connection(redis_server, monkeypatch):
+    writers = []
+    open_connection = asyncio.open_connection
+
+    async def recording_open_connection(*args, **kwargs):
+        reader, writer = await open_connection(*args, **kwargs)
+        writers.append(writer)
+        return reader, writer
+
+    monkeypatch.setattr(asyncio, "open_connection", recording_open_connection)
+    backend = RedisBackend("127.0.0.1", redis_server, password="secret")
+    with pytest.raises(RedisError):
+        await backend.get("key")
+    assert len(writers) == 1 and writers[0].is_closing()
+    assert backend._idle == []
@@ -0,0 +1,35 @@
+import pytest
+
+from benchmarks import load
+from benchmarks.fake_discord import FakeDiscord
+from benchmarks.runner import format_results, run_suite
+from benchmarks.suite import BENCHMARKS
+
+
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+def test_benchmarks_run():
+    report = run_suite(repeat=2, min_time=0)
+    assert list(report["results"]) == list(BENCHMARKS)
+    for result in report["results"].values():
+        assert result["loops"] == 1 and result["min"] <= result["median"]
+    lines = format_results(report, report).splitlines()
+    assert len(lines) == len(BENCHMARKS)
+    assert all(line.endswith("1.00x") for line in lines)
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+@pytest.mark.parametrize("stacked", [False, True])
+async def test_load_harness(stacked):
+    discord = FakeDiscord(
+        latency=0, unauthorized_rate=0.1, ratelimit_rate=0.1, retry_after=0.01
+    )
+    levels = await load.run(
+        [1, 4], 0.3, users=10, warmup=0, discord=discord, stacked=stacked
+    )
+    assert [level["concurrency"] for level in levels] == [1, 4]
+    for level in levels:
+        assert level["requests"] > 0 and list(level["statuses"]) == ["200"]
+        assert level["p50"] <= level["p90"] <= level["p99"]
+    assert discord.stats["401"] > 0 and discord.stats["429"] > 0
+    assert load.format_levels(levels).count("\n") == 2
@@ -0,0 +1,105 @@
+import json
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from oauth_helper import HTTPError, oauth2_wrapper
+from oauth_helper.breaker import CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+async def call(breaker, error=None):
+    async with breaker:
+        if error is not None:
+            raise error
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=2, recovery_time=10, timer=clock)
+    # Only connection errors and timeouts count
+    with pytest.raises(ValueError):
+        await call(breaker, ValueError())
+    for _ in range(2):
+        with pytest.raises(aiohttp.ClientError):
+            await call(breaker, aiohttp.ClientError())
+    assert breaker.state == "open"
+    with pytest.raises(HTTPError) as e:
+        await call(breaker)
+    assert e.value.status == 503
+
+    # A failed probe keeps it open
+    clock.now = 10
+    assert breaker.state == "half-open"
+    with pytest.raises(TimeoutError):
+        await call(breaker, TimeoutError())
+    assert breaker.state == "open"
+    clock.now = 15
+    with pytest.raises(HTTPError):
+        await call(breaker)
+
+    # Only one probe at a time
+    clock.now = 20
+    async with breaker:
+        with pytest.raises(HTTPError):
+            await call(breaker)
+    assert breaker.state == "closed" and breaker.failures == 0
+    await call(breaker)
+
+
+@pytest.mark.asyncio
+async def test_token_endpoint_failures_open_the_circuit():
+    calls = []
+
+    async def token(request):
+        calls.append(request)
+        if len(calls) <= 2:
+            return web.Response(status=500, text="Internal Server Error")
+        return web.Response(
+            body=json.dumps(
+                {
+                    "access_token": "access",
+                    "refresh_token": "new",
+                    "expires_in": 604800,
+                    "scope": "identify",
+                }
+            ),
+            content_type="application/json",
+        )
+
+    app = web.Application()
+    app.router.add_post("/oauth2/token", token)
+    clock = Clock()
+    async with TestServer(app) as server:
+        wrapper = oauth2_wrapper(
+            {
+                "client_id": "1",
+                "client_secret": "secret",
+                "api_base": str(server.make_url("")).rstrip("/"),
+            },
+            bot=None,
+            breaker=CircuitBreaker(failure_threshold=2, recovery_time=5, timer=clock),
+        )
+        try:
+            for status in [502, 502, 503, 503]:
+                with pytest.raises(HTTPError) as e:
+                    await wrapper.from_refresh_token("refresh", "")
+                assert e.value.status == status
+            assert len(calls) == 2
+            # Failures aren't taken as the token being invalid
+            clock.now = 5
+            oauth = await wrapper.from_refresh_token("refresh", "")
+            assert oauth.refresh_token == "new"
+            assert wrapper.breaker.state == "closed"
+        finally:
+            await wrapper.close()
@@ -0,0 +1,204 @@
+from types import SimpleNamespace
+
+import pytest
+
+from oauth_helper.backends import MemoryBackend
+from oauth_helper.cache import (
+    NegativeCache,
+    NotInCacheError,
+    SharedTokenCache,
+    TokenCache,
+    UserCache,
+)
+from oauth_helper.guilds import ADMINISTRATOR, MANAGE_GUILD, GuildIndex, GuildList
+
+
+def test_negative_cache():
+    cache = NegativeCache(maxsize=2, ttl=60)
+    cache.add("revoked")
+    assert "revoked" in cache
+    assert "valid" not in cache
+    cache.discard("revoked")
+    assert "revoked" not in cache
+
+
+def test_negative_cache_is_bounded():
+    cache = NegativeCache(maxsize=2, ttl=60)
+    for token in ("a", "b", "c"):
+        cache.add(token)
+    assert len(cache) == 2
+
+
+def test_negative_cache_expires():
+    now = 0.0
+    cache = NegativeCache(ttl=1, timer=lambda: now)
+    cache.add("revoked")
+    now = 2.0
+    assert "revoked" not in cache
+
+
+@pytest.fixture(params=["memory", "shared"])
+def token_cache(request):
+    if request.param == "memory":
+        return TokenCache()
+    return SharedTokenCache(MemoryBackend())
+
+
+@pytest.mark.asyncio
+async def test_token_cache_hit_and_miss(token_cache):
+    with pytest.raises(NotInCacheError):
+        await token_cache.get_token("refresh")
+    await token_cache.add_access_token("refresh", "access", 600, "identify")
+    assert await token_cache.get_token("refresh") == {
+        "access_token": "access",
+        "refresh_token": "refresh",
+        "scope": "identify",
+    }
+    await token_cache.discard("refresh")
+    with pytest.raises(NotInCacheError):
+        await token_cache.get_token("refresh")
+
+
+@pytest.mark.asyncio
+async def test_token_cache_expired(token_cache):
+    await token_cache.add_access_token("refresh", "access", -1, "identify")
+    with pytest.raises(NotInCacheError):
+        await token_cache.get_token("refresh")
+
+
+@pytest.mark.asyncio
+async def test_token_cache_successor(token_cache):
+    await token_cache.add_access_token("new", "access", 600, "identify")
+    await token_cache.add_successor("old", "new")
+    assert await token_cache.get_token("old") == {
+        "access_token": "access",
+        "refresh_token": "new",
+        "scope": "identify",
+    }
+
+
+@pytest.mark.asyncio
+async def test_token_cache_expiring(token_cache):
+    token_cache.track_usage = True
+    await token_cache.add_access_token("hot", "a", 60, "identify")
+    await token_cache.add_access_token("cold", "b", 60, "identify")
+    await token_cache.add_access_token("later", "c", 6000, "identify")
+    for _ in range(2):
+        await token_cache.get_token("hot")
+        await token_cache.get_token("later")
+    await token_cache.get_token("cold")
+    assert await token_cache.expiring(within=300, min_hits=2, max_idle=60) == ["hot"]
+
+
+@pytest.mark.asyncio
+async def test_token_cache_usage_is_optional(token_cache):
+    await token_cache.add_access_token("hot", "a", 60, "identify")
+    for _ in range(2):
+        await token_cache.get_token("hot")
+    assert await token_cache.expiring(within=300, min_hits=1, max_idle=60) == []
+
+
+@pytest.mark.asyncio
+async def test_token_cache_rotated_twice():
+    cache = TokenCache()
+    await cache.add_access_token("b", "1", 600, "identify")
+    await cache.add_successor("a", "b")
+    await cache.add_access_token("c", "2", 600, "identify")
+    await cache.add_successor("b", "c")
+    assert (await cache.get_token("a"))["refresh_token"] == "c"
+
+
+@pytest.mark.asyncio
+async def test_token_cache_lru_eviction():
+    cache = TokenCache(maxsize=2)
+    await cache.add_access_token("a", "1", 600, "identify")
+    await cache.add_access_token("b", "2", 600, "identify")
+    await cache.get_token("a")
+    await cache.add_access_token("c", "3", 600, "identify")
+    assert len(cache) == 2
+    assert cache.evictions == 1
+    await cache.get_token("a")
+    with pytest.raises(NotInCacheError):
+        await cache.get_token("b")
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+@pytest.mark.asyncio
+async def test_shared_token_cache_usage_is_bounded():
+    cache = SharedTokenCache(MemoryBackend(), maxsize=10, track_usage=True)
+    for i in range(100):
+        await cache.add_access_token(str(i), "access", 600, "identify")
+        await cache.get_token(str(i))
+    assert len(cache._expires) == 10
+    assert len(cache._usage) == 10
+    assert await cache.expiring(within=6000, min_hits=1, max_idle=60) == [
+        str(i) for i in range(90, 100)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_token_cache_sweep():
+    cache = TokenCache()
+    await cache.add_access_token("old", "1", -1, "identify")
+    await cache.add_access_token("new", "2", 600, "identify")
+    await cache.add_successor("rotated", "new")
+    assert cache.sweep() == 1
+    assert len(cache) == 2
+    assert cache.expirations == 1
+    # A rotated token goes with its successor
+    await cache.add_access_token("newer", "3", 600, "identify")
+    await cache.add_successor("new", "newer")
+    await cache.discard("newer")
+    assert cache.sweep() == 1
+    assert len(cache) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", [None, MemoryBackend()])
+async def test_user_cache_links_rotated_tokens(backend):
+    cache = UserCache(backend)
+    payload = {"id": "1", "username": "user", "discriminator": "0", "avatar": None}
+    await cache.set(payload, "access", "refresh")
+    await cache.link("refresh", "new access")
+    assert (await cache.get("new access")).id == 1
+    assert await cache.get("refresh") is not None
+    assert await cache.get("unknown") is None
+    assert (await cache.get("access")).to_user().name == "user"
+
+
+def fake_bot(guild_ids):
+    # A client without add_listener, which GuildIndex can't get events from
+    guilds = {i: SimpleNamespace(id=i) for i in guild_ids}
+    return SimpleNamespace(guilds=list(guilds.values()), get_guild=guilds.get)
+
+
+def test_guild_list_owner_and_admin_have_every_permission():
+    index = GuildIndex(fake_bot(range(1, 5)))
+    guild_list = GuildList(
+        [
+            {"id": "1", "permissions": "0", "owner": True},
+            {"id": "2", "permissions": str(ADMINISTRATOR)},
+            {"id": "3", "permissions": str(MANAGE_GUILD)},
+            {"id": "4", "permissions": "0"},
+            {"id": "5", "permissions": str(MANAGE_GUILD)},
+        ]
+    )
+    assert [g["id"] for g in guild_list.mutual(index)] == ["1", "2", "3", "4"]
+    assert [g["id"] for g in guild_list.mutual(index, MANAGE_GUILD)] == ["1", "2", "3"]
+
+
+@pytest.mark.asyncio
+async def test_guild_index_without_events_asks_bot():
+    bot = fake_bot([])
+    # Built before the bot is ready
+    index = GuildIndex(bot)
+    guild_list = GuildList([{"id": "1", "permissions": "0"}])
+    assert guild_list.mutual(index) == []
+    assert not index.tracking
+    bot.get_guild = fake_bot([1]).get_guild
+    assert 1 in index
+    assert [g["id"] for g in guild_list.mutual(index)] == ["1"]
+    # Forwarded events make it keep its own set
+    await index.on_guild_remove(SimpleNamespace(id=1))
+    assert index.tracking
+    assert guild_list.mutual(index) == []
@@ -0,0 +1,131 @@
+import gzip
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from oauth_helper import (
+    Compression,
+    Response,
+    ResponseCache,
+    TextResponse,
+    convert_response,
+)
+from oauth_helper.compression import brotli
+
+BEST = "br" if brotli is not None else "gzip"
+
+
+@pytest.mark.parametrize(
+    "header,encoding",
+    [
+        ("gzip, deflate, br", BEST),
+        ("deflate", "deflate"),
+        ("gzip;q=0, deflate;q=0.5", "deflate"),
+        ("identity", None),
+        ("*", BEST),
+        ("*, gzip;q=0, br;q=0", "deflate"),
+        ("", None),
+    ],
+)
+def test_negotiate(header, encoding):
+    assert Compression().negotiate(header) == encoding
+
+
+class FakeUser:
+    async def user_info(self):
+        return SimpleNamespace(id=1)
+
+
+def counting(compression):
+    calls = []
+    for encoding, compressor in list(compression.compressors.items()):
+
+        def compress(body, compressor=compressor):
+            calls.append(threading.get_ident())
+            return compressor(body)
+
+        compression.compressors[encoding] = compress
+    return calls
+
+
+async def make_client(compression):
+    cache = ResponseCache()
+
+    async def large(request):
+        return Response(guilds=[{"id": str(i), "name": "Guild"} for i in range(100)])
+
+    @cache.cached()
+    async def cached(request):
+        return await large(request)
+
+    async def small(request):
+        return Response(ok=True)
+
+    async def text(request):
+        return TextResponse("x" * 2000)
+
+    @web.middleware
+    async def user(request, handler):
+        request["user"] = FakeUser()
+        return await handler(request)
+
+    app = web.Application(middlewares=[convert_response([], compression), user])
+    app.router.add_get("/large", large)
+    app.router.add_get("/cached", cached)
+    app.router.add_get("/small", small)
+    app.router.add_get("/text", text)
+    return TestClient(TestServer(app), auto_decompress=False)
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+@pytest.mark.parametrize("encoding", ["gzip", "deflate"])
+async def test_compressed_responses(monkeypatch, encoding):
+    monkeypatch.setattr("oauth_helper.response_cache.User", FakeUser)
+    compression = Compression(min_size=100)
+    calls = counting(compression)
+    async with await make_client(compression) as client:
+        res = await client.get("/large", headers={"Accept-Encoding": "identity"})
+        assert "Content-Encoding" not in res.headers
+        plain = await res.read()
+        res = await client.get("/large", headers={"Accept-Encoding": encoding})
+        assert res.headers["Content-Encoding"] == encoding
+        assert res.headers["Vary"] == "Accept-Encoding"
+        body = await res.read()
+        decompress = gzip.decompress if encoding == "gzip" else zlib.decompress
+        assert decompress(body) == plain and len(body) < len(plain)
+
+        res = await client.get("/text", headers={"Accept-Encoding": encoding})
+        assert decompress(await res.read()) == b"x" * 2000
+        res = await client.get("/small", headers={"Accept-Encoding": encoding})
+        assert "Content-Encoding" not in res.headers
+        assert len(calls) == 2
+
+        # Cached bodies are only compressed once, and keep a (weak) ETag
+        for _ in range(3):
+            res = await client.get("/cached", headers={"Accept-Encoding": encoding})
+            assert decompress(await res.read()) == plain
+        assert len(calls) == 3
+        etag = res.headers["ETag"]
+        assert etag.startswith('W/"')
+        res = await client.get(
+            "/cached", headers={"Accept-Encoding": encoding, "If-None-Match": etag}
+        )
+        assert res.status == 304
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+async def test_large_bodies_are_compressed_in_a_thread():
+    with ThreadPoolExecutor(1) as executor:
+        compression = Compression(min_size=100, thread_size=1000, executor=executor)
+        calls = counting(compression)
+        async with await make_client(compression) as client:
+            res = await client.get("/large", headers={"Accept-Encoding": "gzip"})
+            assert res.headers["Content-Encoding"] == "gzip"
+    assert calls and calls[0] != threading.get_ident()
@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from oauth_helper import (
+    HTTPError,
+    HTTPPool,
+    Response,
+    attach_user,
+    convert_response,
+    oauth2_handler,
+    oauth2_wrapper,
+    oauth_middleware,
+    require_logged_in,
+)
+
+
+def discord_json(data):
+    return web.Response(body=json.dumps(data), content_type="application/json")
+
+
+async def token(request):
+    return discord_json(
+        {
+            "access_token": "access",
+            "refresh_token": "refreshed",
+            "expires_in": 604800,
+            "scope": "identify",
+        }
+    )
+
+
+async def me(request):
+    await asyncio.sleep(float(request.app["delay"]))
+    return discord_json(
+        {"id": "1", "username": "user", "discriminator": "0", "avatar": None}
+    )
+
+
+async def discord_server(delay):
+    app = web.Application()
+    app["delay"] = delay
+    app.router.add_post("/oauth2/token", token)
+    app.router.add_get("/users/@me", me)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def config(server):
+    return {
+        "client_id": "1",
+        "client_secret": "secret",
+        "refresh_uri": "http://localhost",
+        "api_base": str(server.make_url("")).rstrip("/"),
+    }
+
+
+@require_logged_in
+async def user_info(request):
+    user = await request["user"].user_info()
+    return Response(name=user.name)
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+@pytest.mark.parametrize("fused", [False, True])
+async def test_request_budget(fused):
+    server = await discord_server(delay=1)
+    wrapper = oauth2_wrapper(config(server), bot=None)
+    if fused:
+        middlewares = [
+            oauth_middleware(config(server), None, wrapper=wrapper, budget=0.1)
+        ]
+    else:
+        middlewares = [
+            convert_response([]),
+            oauth2_handler(config(server), None, wrapper=wrapper, budget=0.1),
+            attach_user,
+        ]
+    app = web.Application(middlewares=middlewares)
+    app.router.add_get("/", user_info)
+    try:
+        async with TestClient(TestServer(app)) as client:
+            start = asyncio.get_running_loop().time()
+            res = await client.get("/", headers={"Authorization": "refresh"})
+            assert asyncio.get_running_loop().time() - start < 0.5
+            assert res.status == 504
+    finally:
+        await wrapper.close()
+        await server.close()
+
+
+@pytest.mark.asyncio
+async def test_per_call_timeout():
+    server = await discord_server(delay=1)
+    wrapper = oauth2_wrapper(config(server), bot=None, pool=HTTPPool(timeout=0.1))
+    try:
+        oauth = await wrapper.from_refresh_token("refresh", "")
+        with pytest.raises(HTTPError) as e:
+            await oauth.get_user_info()
+        assert e.value.status == 504
+    finally:
+        await wrapper.close()
+        await server.close()
@@ -7,6 +7,8 @@ from oauth_helper.get_params import (
     is_namedtuple,
     typecheck_single,
     typecheck_collection,
+    typecheck_class,
+    compile_annotations,
 )
 
 
@@ -111,3 +113,34 @@ def test_namedtuple_unhappy():
         typecheck_single({"foo": 1, "bar": []}, AnnotatedNamedTuple)
     with pytest.raises(ArgsError):
         typecheck_single({"foo": 1}, AnnotatedNamedTuple)
+
+
+def test_compiled_annotations_are_cached():
+    annotations = {"foo": int, "bar": List[str]}
+    assert compile_annotations(annotations) is compile_annotations(annotations)
+    assert compile_annotations(annotations) is compile_annotations(dict(annotations))
+
+
+def test_union_order_is_kept_when_casting():
+    assert typecheck_single("1", Union[int, str], cast=True) == 1
+    assert typecheck_single("1", Union[str, int], cast=True) is None
+
+
+def test_class_cast():
+    query = {"foo": "1", "bar": ""}
+    typecheck_class(query, {"foo": int, "bar": List[int]}, cast=True)
+    assert query == {"foo": 1, "bar": []}
+
+
+def test_bulk_collection_reports_offending_value():
+    typecheck_single(list(range(1000)) + [True], List[int])
+    with pytest.raises(TypeCheckError) as e:
+        typecheck_single(list(range(1000)) + ["x"], List[int])
+    assert (
+        e.value.args[0] == "Typecheck failure: <class 'int'>, given <class 'str'> ('x')"
+    )
+    with pytest.raises(TypeCheckError) as e:
+        typecheck_single({str(i): i for i in range(1000)} | {"x": 1.5}, Dict[str, int])
+    assert e.value.args[0] == (
+        "Typecheck failure: <class 'int'>, given <class 'float'> (1.5)"
+    )
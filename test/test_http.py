@@ -0,0 +1,162 @@
+import asyncio
+import json
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from discord.http import Route
+
+from oauth_helper.http import HTTPPool
+
+
+async def echo_auth(request: web.Request) -> web.Response:
+    # discord.py only decodes bodies sent without a charset
+    return web.Response(
+        body=json.dumps({"authorization": request.headers["Authorization"]}),
+        content_type="application/json",
+    )
+
+
+@pytest_asyncio.fixture
+async def server(monkeypatch):
+    app = web.Application()
+    app.router.add_get("/users/@me", echo_auth)
+    async with TestServer(app) as server:
+        monkeypatch.setattr(Route, "BASE", str(server.make_url("")).rstrip("/"))
+        yield server
+
+
+@pytest.mark.asyncio
+async def test_pool_shares_session_between_users(server):
+    pool = HTTPPool(limit=4)
+    first = pool.for_token("first")
+    second = pool.for_token("second")
+    try:
+        assert await first.request(Route("GET", "/users/@me")) == {
+            "authorization": "Bearer first"
+        }
+        assert await second.request(Route("GET", "/users/@me")) == {
+            "authorization": "Bearer second"
+        }
+        assert first._HTTPClient__session is second._HTTPClient__session
+        await first.close()
+        assert not pool.session.closed
+    finally:
+        await pool.close()
+    assert pool._session is None
+
+
+class RateLimitedDiscord:
+    """Allows `limit` requests per token every `window` seconds."""
+
+    def __init__(self, limit=2, window=0.3):
+        self.limit = limit
+        self.window = window
+        self.windows = {}
+        self.limited = 0
+        self.global_limited = set()
+
+    def reply(self, data, status=200, **headers):
+        return web.Response(
+            body=json.dumps(data),
+            status=status,
+            content_type="application/json",
+            headers=headers,
+        )
+
+    async def me(self, request):
+        loop = asyncio.get_running_loop()
+        token = request.headers["Authorization"]
+        start, count = self.windows.get(token, (0, 0))
+        now = loop.time()
+        if now >= start + self.window:
+            start, count = now, 0
+        count += 1
+        self.windows[token] = (start, count)
+        reset_after = start + self.window - now
+        if count > self.limit:
+            self.limited += 1
+            return self.reply(
+                {"retry_after": reset_after, "global": False}, status=429, Via="1.1"
+            )
+        return self.reply(
+            {},
+            **{
+                "X-RateLimit-Bucket": "me",
+                "X-RateLimit-Limit": str(self.limit),
+                "X-RateLimit-Remaining": str(self.limit - count),
+                "X-RateLimit-Reset-After": str(reset_after),
+            },
+        )
+
+    async def global_limit(self, request):
+        token = request.headers["Authorization"]
+        if token not in self.global_limited:
+            self.global_limited.add(token)
+            return self.reply(
+                {"retry_after": 0.3, "global": True}, status=429, Via="1.1"
+            )
+        return self.reply({})
+
+    async def ping(self, request):
+        return self.reply({})
+
+
+@pytest_asyncio.fixture
+async def rate_limited(monkeypatch):
+    fake = RateLimitedDiscord()
+    app = web.Application()
+    app.router.add_get("/users/@me", fake.me)
+    app.router.add_get("/global", fake.global_limit)
+    app.router.add_get("/ping", fake.ping)
+    async with TestServer(app) as server:
+        monkeypatch.setattr(Route, "BASE", str(server.make_url("")).rstrip("/"))
+        yield fake
+
+
+async def timed(coro):
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    await coro
+    return loop.time() - start
+
+
+@pytest.mark.asyncio
+async def test_buckets_persist_between_clients(rate_limited):
+    pool = HTTPPool()
+    try:
+
+        async def five_requests():
+            for _ in range(5):
+                await pool.for_token("first").request(Route("GET", "/users/@me"))
+
+        first, second = await asyncio.gather(
+            timed(five_requests()),
+            timed(pool.for_token("second").request(Route("GET", "/users/@me"))),
+        )
+        assert rate_limited.limited == 0
+        assert first >= 0.5
+        # Other users' buckets are unaffected
+        assert second < 0.2
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_global_limit_is_per_token(rate_limited):
+    pool = HTTPPool()
+    try:
+        limited = asyncio.ensure_future(
+            pool.for_token("first").request(Route("GET", "/global"))
+        )
+        await asyncio.sleep(0.1)
+        first, second = await asyncio.gather(
+            timed(pool.for_token("first").request(Route("GET", "/ping"))),
+            timed(pool.for_token("second").request(Route("GET", "/ping"))),
+        )
+        await limited
+        assert first >= 0.1
+        assert second < 0.1
+    finally:
+        await pool.close()
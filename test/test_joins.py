@@ -0,0 +1,105 @@
+import asyncio
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+from discord.errors import HTTPException
+
+from oauth_helper import JoinStats, oauth2_wrapper
+from oauth_helper.joins import bulk_join
+
+
+def http_error(status, text):
+    return HTTPException(SimpleNamespace(status=status, reason="Error"), text)
+
+
+class FakeGuilds:
+    def __init__(self, failures=None):
+        self.running = Counter()
+        self.most = Counter()
+        self.calls = Counter()
+        # (guild, user) -> statuses to fail with, in order
+        self.failures = failures or {}
+
+    async def join(self, guild_id, user_id, access_token):
+        self.calls[(guild_id, user_id)] += 1
+        self.running[guild_id] += 1
+        self.most[guild_id] = max(self.most[guild_id], self.running[guild_id])
+        try:
+            await asyncio.sleep(0.01)
+            statuses = self.failures.get((guild_id, user_id))
+            if statuses:
+                status = statuses.pop(0)
+                raise http_error(status, f"{status} for {user_id}")
+        finally:
+            self.running[guild_id] -= 1
+
+
+@pytest.mark.asyncio
+async def test_bulk_join_limits_concurrency_per_guild():
+    guilds = FakeGuilds()
+    joins = [
+        (guild_id, user_id, "token") for guild_id in range(3) for user_id in range(10)
+    ]
+    stats = JoinStats()
+    results = [r async for r in bulk_join(guilds.join, joins, per_guild=2, stats=stats)]
+    assert sorted((r.guild_id, r.user_id) for r in results) == sorted(
+        (g, u) for g, u, _ in joins
+    )
+    assert all(r.error is None and r.attempts == 1 for r in results)
+    assert max(guilds.most.values()) == 2
+    assert stats.succeeded == stats.total == 30
+    assert stats.rate > 0
+
+
+@pytest.mark.asyncio
+async def test_bulk_join_retries_transient_failures():
+    guilds = FakeGuilds({(1, 1): [503, 502], (1, 2): [403], (1, 3): [500] * 5})
+    stats = JoinStats()
+    results = {
+        r.user_id: r
+        async for r in bulk_join(
+            guilds.join,
+            [(1, user_id, "token") for user_id in range(4)],
+            retries=2,
+            backoff=0.01,
+            stats=stats,
+        )
+    }
+    assert results[0].error is None
+    assert results[1].error is None and results[1].attempts == 3
+    assert results[2].error == "403 for 2" and results[2].attempts == 1
+    assert results[3].error == "500 for 3" and results[3].attempts == 3
+    assert (stats.succeeded, stats.failed, stats.retries) == (2, 2, 4)
+
+
+@pytest.mark.asyncio
+async def test_bulk_join_stops_with_consumer():
+    guilds = FakeGuilds()
+    joins = bulk_join(guilds.join, [(1, user_id, "token") for user_id in range(100)])
+    async for _ in joins:
+        break
+    await joins.aclose()
+    await asyncio.sleep(0.05)
+    assert sum(guilds.calls.values()) < 10
+
+
+@pytest.mark.asyncio
+async def test_join_guilds_uses_bot():
+    requests = []
+
+    async def request(route, json):
+        requests.append((route.path, route.method, json))
+
+    bot = SimpleNamespace(http=SimpleNamespace(request=request))
+    wrapper = oauth2_wrapper({"client_id": "1", "client_secret": "secret"}, bot=bot)
+    results = [r async for r in wrapper.join_guilds([(1, 2, "access")], nick="Nick")]
+    assert results[0].error is None
+    assert requests == [
+        (
+            "/guilds/{guild_id}/members/{user_id}",
+            "PUT",
+            {"access_token": "access", "nick": "Nick"},
+        )
+    ]
+    await wrapper.close()
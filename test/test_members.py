@@ -0,0 +1,115 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from oauth_helper import MemberResolver
+
+
+def member(guild, user_id):
+    return SimpleNamespace(id=user_id, guild=guild)
+
+
+class FakeGuild:
+    def __init__(self, id, members=(), cached=()):
+        self.id = id
+        self.members = set(members)
+        self.cached = set(cached)
+        self.queries = []
+        self.fetches = []
+
+    def get_member(self, user_id):
+        return member(self, user_id) if user_id in self.cached else None
+
+    async def query_members(self, *, user_ids, limit, cache):
+        self.queries.append(sorted(user_ids))
+        await asyncio.sleep(0.01)
+        return [member(self, i) for i in user_ids if i in self.members]
+
+    async def fetch_member(self, user_id):
+        self.fetches.append(user_id)
+        await asyncio.sleep(0.01)
+        if user_id not in self.members:
+            raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), {})
+        return member(self, user_id)
+
+
+class FakeBot:
+    def __init__(self, ready=True):
+        self.ready = ready
+        self.listeners = {}
+
+    def is_ready(self):
+        return self.ready
+
+    def is_closed(self):
+        return False
+
+    def add_listener(self, func):
+        self.listeners[func.__name__] = func
+
+
+@pytest.mark.asyncio
+async def test_gateway_lookups_are_batched_per_guild():
+    resolver = MemberResolver(FakeBot())
+    guild = FakeGuild(1, members={1, 2})
+    results = await asyncio.gather(
+        *(resolver.fetch_member(guild, user_id) for user_id in [1, 2, 3, 1])
+    )
+    assert [r and r.id for r in results] == [1, 2, None, 1]
+    assert guild.queries == [[1, 2, 3]]
+    assert guild.fetches == []
+    # Both members and non-members are cached
+    assert await resolver.fetch_member(guild, 3) is None
+    assert (await resolver.fetch_member(guild, 2)).id == 2
+    assert guild.queries == [[1, 2, 3]]
+
+
+@pytest.mark.asyncio
+async def test_rest_fallback_across_guilds():
+    resolver = MemberResolver(None, concurrency=2)
+    guilds = [FakeGuild(i, members={5} if i % 2 else ()) for i in range(6)]
+    guilds[0].cached.add(5)
+    results = await resolver.fetch_members(guilds, 5)
+    assert {k: v and v.id for k, v in results.items()} == {
+        0: 5,
+        1: 5,
+        2: None,
+        3: 5,
+        4: None,
+        5: 5,
+    }
+    assert guilds[0].fetches == []
+    assert all(g.fetches == [5] for g in guilds[1:])
+
+
+@pytest.mark.asyncio
+async def test_member_events_update_cache():
+    bot = FakeBot()
+    resolver = MemberResolver(bot)
+    guild = FakeGuild(1)
+    assert await resolver.fetch_member(guild, 1) is None
+
+    guild.members.add(1)
+    await bot.listeners["on_member_join"](member(guild, 1))
+    assert (await resolver.fetch_member(guild, 1)).id == 1
+
+    await bot.listeners["on_raw_member_remove"](
+        SimpleNamespace(guild_id=1, user=SimpleNamespace(id=1))
+    )
+    assert await resolver.fetch_member(guild, 1) is None
+    assert len(guild.queries) == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_expires():
+    now = 0.0
+    resolver = MemberResolver(None, ttl=60, negative_ttl=10, timer=lambda: now)
+    guild = FakeGuild(1, members={1})
+    await resolver.fetch_member(guild, 1)
+    await resolver.fetch_member(guild, 2)
+    now = 20
+    await resolver.fetch_member(guild, 1)
+    await resolver.fetch_member(guild, 2)
+    assert guild.fetches == [1, 2, 2]
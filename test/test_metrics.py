@@ -0,0 +1,87 @@
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from oauth_helper import (
+    MemorySink,
+    PrometheusSink,
+    Response,
+    convert_response,
+    get_params,
+    set_metrics_sink,
+)
+
+
+@pytest.fixture
+def sink():
+    sink = MemorySink()
+    set_metrics_sink(sink)
+    yield sink
+    set_metrics_sink(None)
+
+
+async def add(request):
+    params = await get_params(request, {"a": int, "b": int})
+    return Response(total=params.a + params.b)
+
+
+@pytest_asyncio.fixture
+async def client():
+    app = web.Application(middlewares=[convert_response([])])
+    app.router.add_post("/add", add)
+    async with TestClient(TestServer(app)) as client:
+        yield client
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+async def test_handler_and_get_params_metrics(client, sink):
+    res = await client.post("/add", json={"a": 1, "b": 2})
+    assert await res.json() == {"total": 3}
+    await client.post("/add", data=b"{")
+    await client.post("/add", json={"a": "x", "b": 2})
+    await client.post("/add", json={"a": 1})
+
+    assert sink.counter("oauth_helper_responses_total", status="200") == 1
+    assert sink.counter("oauth_helper_responses_total", status="400") == 3
+    assert len(sink.samples("oauth_helper_handler_seconds")) == 4
+    assert len(sink.samples("oauth_helper_get_params_seconds")) == 1
+    for reason in ["json", "cast", "args"]:
+        assert sink.counter("oauth_helper_get_params_errors_total", reason=reason) == 1
+
+
+def test_prometheus_render():
+    sink = PrometheusSink(buckets=[0.1, 1])
+    sink.inc("requests_total", (("status", "200"),))
+    sink.inc("requests_total", (("status", "200"),), 2)
+    sink.inc("requests_total", (("path", 'a"b'),))
+    sink.observe("latency_seconds", 0.05)
+    sink.observe("latency_seconds", 0.5)
+    sink.observe("latency_seconds", 5)
+    assert sink.render() == "\n".join(
+        [
+            "# TYPE requests_total counter",
+            'requests_total{status="200"} 3',
+            'requests_total{path="a\\"b"} 1',
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{le="0.1"} 1',
+            'latency_seconds_bucket{le="1"} 2',
+            'latency_seconds_bucket{le="+Inf"} 3',
+            "latency_seconds_sum 5.55",
+            "latency_seconds_count 3",
+            "",
+        ]
+    )
+
+
+@pytest.mark.asyncio
+async def test_prometheus_handler():
+    sink = PrometheusSink()
+    sink.inc("requests_total")
+    app = web.Application()
+    app.router.add_get("/metrics", sink.handler)
+    async with TestClient(TestServer(app)) as client:
+        res = await client.get("/metrics")
+        assert res.headers["Content-Type"] == PrometheusSink.content_type
+        assert await res.text() == "# TYPE requests_total counter\nrequests_total 1\n"
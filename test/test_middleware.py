@@ -0,0 +1,224 @@
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from oauth_helper import (
+    Response,
+    attach_user,
+    HTTPError,
+    convert_response,
+    get_context,
+    oauth2_handler,
+    oauth_middleware,
+    require_logged_in,
+)
+from oauth_helper.oauth2 import InvalidTokenError
+
+
+class FakeOauth2:
+    exchanges = 0
+
+    def __init__(self, refresh_token):
+        self.refresh_token = refresh_token
+
+    def __repr__(self):
+        return f"FakeOauth2({self.refresh_token!r})"
+
+    @classmethod
+    async def from_refresh_token(cls, refresh_token, redirect_uri):
+        cls.exchanges += 1
+        if refresh_token == "revoked":
+            raise InvalidTokenError()
+        if refresh_token == "unavailable":
+            raise HTTPError(message="Discord is unavailable", status=503)
+        return cls(refresh_token + "-rotated")
+
+    @classmethod
+    async def from_code(cls, code, redirect_uri):
+        raise NotImplementedError
+
+
+async def public(request):
+    return Response(public=True)
+
+
+@require_logged_in
+async def private(request):
+    user = await request["user"]
+    return Response(user=str(user))
+
+
+async def optional(request):
+    user = await request["user"]
+    return Response(logged_in=user is not None)
+
+
+async def tolerant(request):
+    try:
+        user = await request["user"]
+    except HTTPError:
+        user = None
+    return Response(logged_in=user is not None)
+
+
+async def failing(request):
+    raise HTTPError(message="Nope", status=418)
+
+
+async def context(request):
+    user = await get_context(request).user
+    return Response(logged_in=user is not None)
+
+
+def stacked(lazy):
+    return [
+        convert_response(["/raw"]),
+        oauth2_handler(
+            {"refresh_uri": "http://localhost"},
+            bot=None,
+            wrapper=FakeOauth2,
+            lazy=lazy,
+        ),
+        attach_user,
+    ]
+
+
+def fused(lazy):
+    return [
+        oauth_middleware(
+            {"refresh_uri": "http://localhost"},
+            bot=None,
+            ignore=["/raw"],
+            wrapper=FakeOauth2,
+            lazy=lazy,
+        )
+    ]
+
+
+async def make_client(middlewares):
+    FakeOauth2.exchanges = 0
+    app = web.Application(middlewares=middlewares)
+    app.router.add_get("/public", public)
+    app.router.add_get("/private", private)
+    app.router.add_get("/optional", optional)
+    app.router.add_get("/failing", failing)
+    app.router.add_get("/tolerant", tolerant)
+    app.router.add_get("/raw", lambda request: web.Response(text="raw"))
+    return TestClient(TestServer(app))
+
+
+@pytest_asyncio.fixture(params=[stacked, fused])
+async def client(request):
+    async with await make_client(request.param(lazy=True)) as client:
+        yield client
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+async def test_lazy_auth_is_not_resolved_by_public_handlers(client):
+    res = await client.get("/public", headers={"Authorization": "token"})
+    assert await res.json() == {"public": True}
+    assert FakeOauth2.exchanges == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+async def test_lazy_auth_resolves_for_protected_handlers(client):
+    res = await client.get("/private")
+    assert res.status == 403
+    res = await client.get("/private", headers={"Authorization": "token"})
+    assert (await res.json())["authorization"] == "token-rotated"
+    res = await client.get("/private", headers={"Authorization": "revoked"})
+    assert await res.json() == {"message": "Invalid login token"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+async def test_lazy_user_resolves_on_await(client):
+    res = await client.get("/optional")
+    assert await res.json() == {"logged_in": False}
+    res = await client.get("/optional", headers={"Authorization": "token"})
+    assert await res.json() == {"logged_in": True, "authorization": "token-rotated"}
+    assert FakeOauth2.exchanges == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+async def test_lazy_failure_handled_by_handler(client):
+    res = await client.get("/tolerant", headers={"Authorization": "unavailable"})
+    assert res.status == 200
+    assert await res.json() == {"logged_in": False}
+    res = await client.get("/optional", headers={"Authorization": "unavailable"})
+    assert res.status == 503
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+@pytest.mark.parametrize("lazy", [False, True])
+async def test_fused_middleware_matches_stacked(lazy):
+    cases = [
+        ("/public", {}),
+        ("/public", {"Authorization": "token"}),
+        ("/public", {"Authorization": "revoked"}),
+        ("/private", {}),
+        ("/private", {"Authorization": "token"}),
+        ("/private", {"Authorization": "revoked"}),
+        ("/optional", {}),
+        ("/optional", {"Authorization": "token"}),
+        ("/failing", {"Authorization": "token"}),
+        ("/optional", {"Authorization": "unavailable"}),
+        ("/raw", {"Authorization": "token"}),
+    ]
+    results = []
+    for middlewares in [stacked(lazy), fused(lazy)]:
+        async with await make_client(middlewares) as client:
+            responses = []
+            for path, headers in cases:
+                res = await client.get(path, headers=headers)
+                responses.append((res.status, await res.text()))
+            results.append((responses, FakeOauth2.exchanges))
+    assert results[0] == results[1]
+
+
+@pytest.mark.asyncio
+async def test_fused_middleware_context():
+    middlewares = fused(lazy=True)
+    middlewares[0] = oauth_middleware(
+        {"refresh_uri": "http://localhost"},
+        bot=None,
+        wrapper=FakeOauth2,
+        lazy=True,
+        legacy_keys=False,
+    )
+    app = web.Application(middlewares=middlewares)
+    app.router.add_get("/context", context)
+    async with TestClient(TestServer(app)) as client:
+        res = await client.get("/context", headers={"Authorization": "token"})
+        assert await res.json() == {"logged_in": True, "authorization": "token-rotated"}
+
+
+@pytest.mark.asyncio
+async def test_fused_middleware_binds_route_handlers_once():
+    middleware = fused(lazy=False)[0]
+    app = web.Application()
+    app.router.add_get("/public", public)
+    app.router.add_get("/private", private)
+    first = await middleware(app, private)
+    assert await middleware(app, private) is first
+    assert await middleware(app, public) is not first
+    # Handlers which aren't the routes' own still work
+    assert await middleware(app, optional) is not await middleware(app, optional)
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+@pytest.mark.parametrize("factory", [oauth2_handler, oauth_middleware])
+async def test_built_wrapper_closed_with_app(factory):
+    middleware = factory({"client_id": "1", "client_secret": "secret"}, None)
+    app = web.Application(middlewares=[middleware])
+    middleware.setup(app)
+    app.router.add_get("/public", public)
+    async with TestClient(TestServer(app)):
+        session = middleware.wrapper.pool.session
+    assert session.closed
@@ -0,0 +1,457 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from discord.http import Route
+
+from oauth_helper import (
+    GuildIndex,
+    HTTPError,
+    MemorySink,
+    TokenRefresher,
+    oauth2_wrapper,
+    set_metrics_sink,
+)
+from oauth_helper.backends import MemoryBackend
+from oauth_helper.cache import NotInCacheError, TokenCache, fingerprint
+from oauth_helper.oauth2 import InvalidTokenError
+from oauth_helper.trace import RequestTrace, current_trace
+
+
+def discord_json(data):
+    # discord.py only decodes bodies sent without a charset
+    return web.Response(body=json.dumps(data), content_type="application/json")
+
+
+class FakeDiscord:
+    def __init__(self, guild_count=450):
+        self.guilds = [
+            {"id": str(i), "name": f"Guild {i}", "permissions": str(i % 3 << 4)}
+            for i in range(guild_count)
+        ]
+        self.calls = {}
+        # Makes token exchanges fail without saying the grant is invalid
+        self.token_status = None
+
+    def count(self, request):
+        self.calls[request.path] = self.calls.get(request.path, 0) + 1
+
+    async def me(self, request):
+        self.count(request)
+        await asyncio.sleep(0.01)
+        if request.headers["Authorization"] == "Bearer stale":
+            return web.Response(
+                status=401,
+                body=json.dumps({"message": "401: Unauthorized", "code": 0}),
+                content_type="application/json",
+            )
+        return discord_json(
+            {"id": "1", "username": "user", "discriminator": "0", "avatar": None}
+        )
+
+    async def token(self, request):
+        self.count(request)
+        await asyncio.sleep(0.05)
+        data = await request.post()
+        if self.token_status == 429:
+            return web.Response(status=429, headers={"Retry-After": "2"})
+        if self.token_status is not None:
+            return web.Response(
+                status=self.token_status,
+                body=json.dumps({"error": "invalid_client"}),
+                content_type="application/json",
+            )
+        if data.get("refresh_token", data.get("code")) != "refresh":
+            return web.Response(
+                status=400,
+                body=json.dumps({"error": "invalid_grant"}),
+                content_type="application/json",
+            )
+        return discord_json(
+            {
+                "access_token": "new access",
+                "refresh_token": "new refresh",
+                "expires_in": 604800,
+                "scope": "identify guilds",
+            }
+        )
+
+    async def guilds_page(self, request):
+        self.count(request)
+        after = int(request.query.get("after", -1))
+        limit = int(request.query["limit"])
+        page = [g for g in self.guilds if int(g["id"]) > after][:limit]
+        return discord_json(page)
+
+
+def discord_app(fake):
+    app = web.Application()
+    app.router.add_get("/users/@me", fake.me)
+    app.router.add_get("/users/@me/guilds", fake.guilds_page)
+    app.router.add_post("/oauth2/token", fake.token)
+    return app
+
+
+@pytest_asyncio.fixture
+async def discord(monkeypatch):
+    fake = FakeDiscord()
+    async with TestServer(discord_app(fake)) as server:
+        monkeypatch.setattr(Route, "BASE", str(server.make_url("")).rstrip("/"))
+        yield fake
+
+
+@pytest_asyncio.fixture
+async def wrapper():
+    wrapper = oauth2_wrapper({"client_id": "1", "client_secret": "secret"}, bot=None)
+    yield wrapper
+    await wrapper.close()
+
+
+@pytest_asyncio.fixture
+async def api_wrapper(discord):
+    # Token exchanges go to the fake too
+    wrapper = oauth2_wrapper(
+        {"client_id": "1", "client_secret": "secret", "api_base": Route.BASE},
+        bot=None,
+    )
+    yield wrapper
+    await wrapper.close()
+
+
+def logged_in(wrapper, scope="identify guilds"):
+    return wrapper("access", "refresh", "http://localhost", scope, None)
+
+
+@pytest.mark.asyncio
+async def test_get_guilds_paginates_and_caches(discord, wrapper):
+    results = await asyncio.gather(*(logged_in(wrapper).get_guilds() for _ in range(5)))
+    assert all(len(guilds) == 450 for guilds in results)
+    assert discord.calls["/users/@me/guilds"] == 3
+    assert len(await logged_in(wrapper).get_guilds()) == 450
+    assert discord.calls["/users/@me/guilds"] == 3
+    wrapper.invalidate_guilds(1)
+    await logged_in(wrapper).get_guilds()
+    assert discord.calls["/users/@me/guilds"] == 6
+
+
+@pytest.mark.asyncio
+async def test_get_guilds_needs_scope(discord, wrapper):
+    assert await logged_in(wrapper, "identify").get_guilds() == []
+
+
+@pytest.mark.asyncio
+async def test_get_guilds_without_identify(discord, wrapper):
+    results = await asyncio.gather(
+        *(logged_in(wrapper, "guilds").get_guilds() for _ in range(3))
+    )
+    assert all(len(guilds) == 450 for guilds in results)
+    assert len(await logged_in(wrapper, "guilds").get_guilds()) == 450
+    assert discord.calls["/users/@me/guilds"] == 3
+    assert "/users/@me" not in discord.calls
+
+
+@pytest.mark.asyncio
+async def test_get_user_info_is_coalesced(discord, wrapper):
+    users = await asyncio.gather(
+        *(logged_in(wrapper).get_user_info() for _ in range(5))
+    )
+    assert {user.id for user in users} == {1}
+    assert discord.calls["/users/@me"] == 1
+    user = await wrapper("access", None, "http://localhost", "", None).get_user_info()
+    assert user.name == "user"
+    assert discord.calls["/users/@me"] == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_refreshes_are_coalesced(discord, api_wrapper):
+    results = await asyncio.gather(
+        *(
+            api_wrapper.from_refresh_token("refresh", "http://localhost")
+            for _ in range(10)
+        )
+    )
+    assert {oauth.refresh_token for oauth in results} == {"new refresh"}
+    assert discord.calls["/oauth2/token"] == 1
+
+
+@pytest.mark.asyncio
+async def test_workers_sharing_backend_exchange_once(discord):
+    backend = MemoryBackend()
+    config = {"client_id": "1", "client_secret": "secret", "api_base": Route.BASE}
+    workers = [oauth2_wrapper(config, bot=None, backend=backend) for _ in range(2)]
+    try:
+        results = await asyncio.gather(
+            *(
+                worker.from_refresh_token("refresh", "http://localhost")
+                for worker in workers
+                for _ in range(5)
+            )
+        )
+    finally:
+        for worker in workers:
+            await worker.close()
+    assert {oauth.refresh_token for oauth in results} == {"new refresh"}
+    assert discord.calls["/oauth2/token"] == 1
+
+
+@pytest.mark.asyncio
+async def test_worker_exchanges_once_lease_released(discord):
+    backend = MemoryBackend()
+    wrapper = oauth2_wrapper(
+        {"client_id": "1", "client_secret": "secret", "api_base": Route.BASE},
+        bot=None,
+        backend=backend,
+    )
+    lease = "oauth_helper:lease:" + fingerprint("refresh").hex()
+    try:
+        # Another worker holds the lease, then fails without a successor
+        assert await backend.lease(lease, 30)
+        refresh = asyncio.ensure_future(
+            wrapper.from_refresh_token("refresh", "http://localhost")
+        )
+        await asyncio.sleep(0.1)
+        assert "/oauth2/token" not in discord.calls
+        await backend.delete(lease)
+        assert (await refresh).refresh_token == "new refresh"
+        assert await backend.get(lease) is None
+    finally:
+        await wrapper.close()
+    assert discord.calls["/oauth2/token"] == 1
+
+
+class SlowTokenCache(TokenCache):
+    async def add_access_token(self, *args):
+        await asyncio.sleep(0.1)
+        await super().add_access_token(*args)
+
+
+@pytest.mark.asyncio
+async def test_refresh_after_exchange_finds_successor(discord):
+    wrapper = oauth2_wrapper(
+        {"client_id": "1", "client_secret": "secret", "api_base": Route.BASE},
+        bot=None,
+        token_cache=SlowTokenCache(),
+    )
+    try:
+        first = asyncio.ensure_future(
+            wrapper.from_refresh_token("refresh", "http://localhost")
+        )
+        # The exchange is done, but the new token is still being stored
+        await asyncio.sleep(0.08)
+        second = await wrapper.from_refresh_token("refresh", "http://localhost")
+        assert second.refresh_token == (await first).refresh_token == "new refresh"
+    finally:
+        await wrapper.close()
+    assert discord.calls["/oauth2/token"] == 1
+
+
+@pytest.mark.asyncio
+async def test_unauthorized_retry_joins_refresh(discord, api_wrapper):
+    stale = api_wrapper("stale", "refresh", "http://localhost", "identify", None)
+    oauth, user = await asyncio.gather(
+        api_wrapper.from_refresh_token("refresh", "http://localhost"),
+        stale.get_user_info(),
+    )
+    assert discord.calls["/oauth2/token"] == 1
+    assert discord.calls["/users/@me"] == 2
+    assert user.id == 1
+    assert (stale.access_token, stale.refresh_token) == ("new access", "new refresh")
+    # The old refresh token now resolves to its successor
+    token = await api_wrapper.token_cache.get_token("refresh")
+    assert token["refresh_token"] == "new refresh"
+    assert token["access_token"] == "new access"
+
+
+@pytest.mark.asyncio
+async def test_invalid_refresh_token_is_remembered(discord, api_wrapper):
+    for _ in range(2):
+        with pytest.raises(InvalidTokenError):
+            await api_wrapper.from_refresh_token("bad", "http://localhost")
+    assert discord.calls["/oauth2/token"] == 1
+    api_wrapper.forget_invalid_token("bad")
+    with pytest.raises(InvalidTokenError):
+        await api_wrapper.from_refresh_token("bad", "http://localhost")
+    assert discord.calls["/oauth2/token"] == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status, expected", [(429, 503), (401, 502)])
+async def test_failed_refresh_is_not_remembered(discord, api_wrapper, status, expected):
+    discord.token_status = status
+    stale = api_wrapper("stale", "refresh", "http://localhost", "identify", None)
+    for call in (
+        api_wrapper.from_refresh_token("refresh", "http://localhost"),
+        stale.get_user_info(),
+    ):
+        with pytest.raises(HTTPError) as e:
+            await call
+        assert e.value.status == expected
+    if status == 429:
+        assert e.value.attrs["retry_after"] == 2
+    assert "refresh" not in api_wrapper.invalid_tokens
+    discord.token_status = None
+    oauth = await api_wrapper.from_refresh_token("refresh", "http://localhost")
+    assert oauth.refresh_token == "new refresh"
+
+
+async def expiring_token(wrapper, refresh_token):
+    refresher = TokenRefresher(wrapper, "http://localhost", min_hits=1)
+    await wrapper.token_cache.add_access_token(refresh_token, "access", 60, "identify")
+    await wrapper.token_cache.get_token(refresh_token)
+    return refresher
+
+
+@pytest.mark.asyncio
+async def test_refresh_ahead(discord, api_wrapper):
+    refresher = await expiring_token(api_wrapper, "refresh")
+    assert await refresher.refresh_once() == 1
+    token = await api_wrapper.token_cache.get_token("refresh")
+    assert token["refresh_token"] == "new refresh"
+    assert await refresher.refresh_once() == 0
+    assert discord.calls["/oauth2/token"] == 1
+
+
+@pytest.mark.asyncio
+async def test_refresh_ahead_invalid_token(discord, api_wrapper):
+    refresher = await expiring_token(api_wrapper, "bad")
+    assert await refresher.refresh_once() == 1
+    with pytest.raises(NotInCacheError):
+        await api_wrapper.token_cache.get_token("bad")
+
+
+@pytest.mark.asyncio
+async def test_refresh_ahead_transient_failure(discord, api_wrapper, caplog):
+    discord.token_status = 429
+    refresher = await expiring_token(api_wrapper, "refresh")
+    assert await refresher.refresh_once() == 1
+    assert "Failed to refresh a token" in caplog.text
+    # The token still works until it expires, and is tried again next time
+    token = await api_wrapper.token_cache.get_token("refresh")
+    assert token["access_token"] == "access"
+    assert "refresh" not in api_wrapper.invalid_tokens
+    discord.token_status = None
+    assert await refresher.refresh_once() == 1
+    token = await api_wrapper.token_cache.get_token("refresh")
+    assert token["refresh_token"] == "new refresh"
+
+
+class FakeBot:
+    def __init__(self, guild_ids):
+        self.guilds = [SimpleNamespace(id=i) for i in guild_ids]
+        self.listeners = {}
+        self.added = []
+
+    def add_listener(self, func):
+        self.listeners[func.__name__] = func
+        self.added.append(func.__name__)
+
+
+@pytest.mark.asyncio
+async def test_wrappers_share_guild_index():
+    bot = FakeBot(range(3))
+    config = {"client_id": "1", "client_secret": "secret"}
+    first = oauth2_wrapper(config, bot=bot)
+    second = oauth2_wrapper(config, bot=bot)
+    try:
+        assert first.guild_index is second.guild_index
+        assert bot.added.count("on_guild_join") == 1
+    finally:
+        await first.close()
+        await second.close()
+
+
+@pytest.mark.asyncio
+async def test_mutual_guilds(discord):
+    bot = FakeBot(range(0, 30, 2))
+    wrapper = oauth2_wrapper(
+        {"client_id": "1", "client_secret": "secret"},
+        bot=None,
+        guild_index=GuildIndex(bot),
+    )
+    try:
+        user = logged_in(wrapper)
+        mutual = await user.get_mutual_guilds()
+        assert [g["id"] for g in mutual] == [str(i) for i in range(0, 30, 2)]
+        # 0x20 is manage guild, 0x10 is manage channels
+        manageable = await user.get_manageable_guilds()
+        assert [g["id"] for g in manageable] == ["2", "8", "14", "20", "26"]
+
+        # The filtered list is reused until the bot's guilds change
+        assert await user.get_manageable_guilds() is not manageable
+        guild_list = wrapper.guild_cache.get_list(1, "guilds identify")
+        assert len(guild_list._views) == 2
+
+        await bot.listeners["on_guild_join"](SimpleNamespace(id=5))
+        await bot.listeners["on_guild_remove"](SimpleNamespace(id=2))
+        manageable = await user.get_manageable_guilds()
+        assert [g["id"] for g in manageable] == ["5", "8", "14", "20", "26"]
+        assert discord.calls["/users/@me/guilds"] == 3
+    finally:
+        await wrapper.close()
+
+
+@pytest.mark.asyncio
+async def test_metrics(discord, wrapper):
+    sink = MemorySink()
+    set_metrics_sink(sink)
+    try:
+        await logged_in(wrapper).get_guilds()
+        await logged_in(wrapper).get_guilds()
+    finally:
+        set_metrics_sink(None)
+    assert sink.counter("oauth_helper_user_cache_requests_total", result="miss") == 1
+    assert sink.counter("oauth_helper_user_cache_requests_total", result="hit") == 1
+    assert sink.counter("oauth_helper_guild_cache_requests_total", result="hit") == 1
+    samples = sink.samples(
+        "oauth_helper_discord_request_seconds",
+        method="GET",
+        route="/users/@me/guilds",
+    )
+    assert len(samples) == 3
+
+
+@pytest.mark.asyncio
+async def test_trace_stages(discord, wrapper):
+    trace = RequestTrace("GET", "/", 0)
+    token = current_trace.set(trace)
+    try:
+        await logged_in(wrapper).get_guilds()
+    finally:
+        current_trace.reset(token)
+    assert [stage for stage, _ in trace.stages] == [
+        "discord GET /users/{user_id}",
+        "user info",
+        "discord GET /users/@me/guilds",
+        "discord GET /users/@me/guilds",
+        "discord GET /users/@me/guilds",
+        "guilds",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_api_base():
+    fake = FakeDiscord()
+    async with TestServer(discord_app(fake)) as server:
+        wrapper = oauth2_wrapper(
+            {
+                "client_id": "1",
+                "client_secret": "secret",
+                "api_base": str(server.make_url("")).rstrip("/"),
+            },
+            bot=None,
+        )
+        try:
+            oauth = await wrapper.from_refresh_token("refresh", "http://localhost")
+            assert oauth.refresh_token == "new refresh"
+            assert len(await oauth.get_guilds()) == 450
+            assert (await wrapper.from_code("refresh", "")).access_token == "new access"
+            with pytest.raises(InvalidTokenError):
+                await wrapper.from_refresh_token("bad", "http://localhost")
+        finally:
+            await wrapper.close()
+    assert fake.calls["/oauth2/token"] == 3
+    assert fake.calls["/users/@me"] == 1
@@ -0,0 +1,119 @@
+import time
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from oauth_helper import (
+    Response,
+    SlowRequestRecorder,
+    StackSampler,
+    convert_response,
+    get_params,
+)
+
+
+async def fast(request):
+    return Response()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+async def slow(request):
+    params = await get_params(request, {"delay": float})
+    request.app["clock"].now += params.delay
+    return Response()
+
+
+def busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def busy(request):
+    busy_wait(0.1)
+    return Response()
+
+
+@pytest_asyncio.fixture
+async def recorder():
+    clock = Clock()
+    recorder = SlowRequestRecorder(threshold=0.05, size=2, timer=clock)
+    app = web.Application(middlewares=[recorder.middleware, convert_response([])])
+    app["clock"] = clock
+    app.router.add_get("/fast", fast)
+    app.router.add_get("/slow", slow)
+    app.router.add_get("/busy", busy)
+    app.router.add_get("/admin/slow", recorder.handler)
+    async with TestClient(TestServer(app)) as client:
+        recorder.client = client
+        yield recorder
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+async def test_slow_requests_are_recorded(recorder):
+    client = recorder.client
+    await client.get("/fast")
+    for delay in [0.1, 0.06, 0.08, 0.04]:
+        await client.get("/slow", params={"delay": str(delay)})
+
+    # The fastest slow request was pushed out
+    durations = [trace.duration for trace in recorder.slowest()]
+    assert durations == pytest.approx([0.1, 0.08])
+    trace = recorder.slowest()[0]
+    assert trace.path == "/slow" and trace.status == 200
+    assert [stage for stage, _ in trace.stages] == ["get_params", "encode"]
+
+    res = await client.get("/admin/slow", params={"limit": "1"})
+    data = await res.json()
+    assert data["threshold"] == 0.05
+    assert [r["duration"] for r in data["requests"]] == durations[:1]
+    res = await client.get("/admin/slow", params={"limit": "x"})
+    assert res.status == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+async def test_sampled_requests_are_profiled(recorder):
+    recorder.profile_rate = 1
+    recorder.profile_interval = 0.001
+    await recorder.client.get("/busy")
+    (trace,) = recorder.profiled()
+    assert "busy_wait" in trace.profile
+    assert recorder.slowest() == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+async def test_profiled_requests_kept_apart(recorder):
+    client = recorder.client
+    await client.get("/slow", params={"delay": "0.1"})
+    recorder.profile_rate = 1
+    for _ in range(3):
+        await client.get("/fast")
+    assert [trace.duration for trace in recorder.slowest()] == [pytest.approx(0.1)]
+    assert [trace.path for trace in recorder.profiled()] == ["/fast", "/fast"]
+    data = await (await client.get("/admin/slow")).json()
+    assert [r["path"] for r in data["requests"]] == ["/slow"]
+    assert len(data["profiled"]) == 2
+    recorder.clear()
+    assert recorder.slowest() == recorder.profiled() == []
+
+
+def test_stack_sampler():
+    sampler = StackSampler(interval=0.001)
+    sampler.start()
+    busy_wait(0.05)
+    profile = sampler.stop()
+    stack, count = profile.splitlines()[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert "busy_wait" in stack and "test_stack_sampler" in stack
@@ -0,0 +1,33 @@
+import asyncio
+
+import pytest
+
+from oauth_helper import TokenRefresher
+
+
+class FlakyTokenCache:
+    def __init__(self):
+        self.calls = 0
+        self.recovered = asyncio.Event()
+
+    async def expiring(self, within, min_hits, max_idle):
+        self.calls += 1
+        if self.calls == 1:
+            raise ConnectionError("backend unreachable")
+        self.recovered.set()
+        return []
+
+
+class FakeOauth2:
+    token_cache = FlakyTokenCache()
+
+
+@pytest.mark.asyncio
+async def test_loop_survives_errors(caplog):
+    refresher = TokenRefresher(FakeOauth2, "http://localhost", interval=0)
+    refresher.start()
+    try:
+        await asyncio.wait_for(FakeOauth2.token_cache.recovered.wait(), 1)
+    finally:
+        await refresher.stop()
+    assert "Failed to find tokens to refresh" in caplog.text
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from oauth_helper import HTTPError, Response
+from oauth_helper.codec import get_json_codec, set_json_codec, stdlib_codec
+
+
+@pytest.fixture
+def codec():
+    previous = get_json_codec()
+    yield
+    set_json_codec(previous)
+
+
+def test_to_response():
+    response = Response(status=201, foo=[1, 2], bar={1: "a"})
+    web_response = response.to_response()
+    assert web_response.status == 201
+    assert web_response.content_type == "application/json"
+    assert web_response.charset == "utf-8"
+    assert json.loads(web_response.body) == {"foo": [1, 2], "bar": {"1": "a"}}
+
+
+def test_encoded_body_is_reused(codec):
+    error = HTTPError(status=403, message="No")
+    assert error.encode() is error.encode()
+    error["authorization"] = "token"
+    assert json.loads(error.encode()) == {"message": "No", "authorization": "token"}
+    assert error.encode() == b'{"message": "No", "authorization": "token"}'
+
+
+def test_orjson_codec_is_opt_in(codec):
+    assert get_json_codec() is stdlib_codec
+    pytest.importorskip("orjson")
+    from oauth_helper.codec import orjson_codec
+
+    set_json_codec(orjson_codec)
+    response = Response(ids=[1, 2], ratio=float("nan"))
+    assert response.encode() == b'{"ids":[1,2],"ratio":null}'
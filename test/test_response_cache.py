@@ -0,0 +1,122 @@
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from oauth_helper import (
+    Response,
+    ResponseCache,
+    attach_user,
+    convert_response,
+    oauth2_handler,
+    oauth_middleware,
+)
+
+
+class FakeOauth2:
+    def __init__(self, refresh_token):
+        self.refresh_token = refresh_token
+
+    @classmethod
+    async def from_refresh_token(cls, refresh_token, redirect_uri):
+        # "rotate" gets a new refresh token, anything else is a user ID
+        return cls("2" if refresh_token == "rotate" else refresh_token)
+
+    @classmethod
+    async def from_code(cls, code, redirect_uri):
+        raise NotImplementedError
+
+    async def get_user_info(self):
+        return SimpleNamespace(id=int(self.refresh_token))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+CONFIG = {"refresh_uri": "http://localhost"}
+
+
+@pytest_asyncio.fixture(params=["stacked", "fused"])
+async def client(request):
+    if request.param == "stacked":
+        middlewares = [
+            convert_response([]),
+            oauth2_handler(CONFIG, None, wrapper=FakeOauth2, lazy=True),
+            attach_user,
+        ]
+    else:
+        middlewares = [oauth_middleware(CONFIG, None, wrapper=FakeOauth2)]
+    clock = Clock()
+    cache = ResponseCache(timer=clock)
+    calls = []
+
+    @cache.cached(ttl=10, tags=["settings"])
+    async def settings(request):
+        calls.append(request.path_qs)
+        return Response(calls=len(calls))
+
+    app = web.Application(middlewares=middlewares)
+    app.router.add_get("/settings", settings)
+    app.router.add_post("/settings", settings)
+    async with TestClient(TestServer(app)) as client:
+        client.cache, client.clock, client.calls = cache, clock, calls
+        yield client
+
+
+async def get(client, user="1", path="/settings", **headers):
+    res = await client.get(path, headers={"Authorization": user, **headers})
+    return res.status, res.headers.get("ETag"), await res.read()
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+async def test_cached_per_user_and_query(client):
+    status, etag, body = await get(client)
+    assert status == 200 and etag.startswith('"') and body == b'{"calls": 1}'
+    assert await get(client) == (200, etag, body)
+    assert (await get(client, user="3"))[2] == b'{"calls": 2}'
+    assert (await get(client, path="/settings?page=2"))[2] == b'{"calls": 3}'
+    assert await get(client) == (200, etag, body)
+    assert len(client.calls) == 3
+
+    # Not cached without a user or for other methods
+    assert (await client.get("/settings")).status == 403
+    res = await client.post("/settings", headers={"Authorization": "1"})
+    assert await res.json() == {"calls": 4}
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+async def test_if_none_match(client):
+    _, etag, _ = await get(client)
+    status, not_modified_etag, body = await get(client, **{"If-None-Match": etag})
+    assert (status, not_modified_etag, body) == (304, etag, b"")
+    assert (await get(client, **{"If-None-Match": f'"other", W/{etag}'}))[0] == 304
+    assert (await get(client, **{"If-None-Match": '"other"'}))[0] == 200
+    # The refresh token being rotated changes the body
+    status, etag, body = await get(client, user="rotate", **{"If-None-Match": etag})
+    assert status == 200 and etag is None and b'"authorization": "2"' in body
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:old-style middleware")
+async def test_expiry_and_invalidation(client):
+    await get(client)
+    await get(client, user="3")
+    client.cache.invalidate("settings", user_id=1)
+    assert (await get(client))[2] == b'{"calls": 3}'
+    assert (await get(client, user="3"))[2] == b'{"calls": 2}'
+    client.cache.invalidate("settings")
+    assert (await get(client))[2] == b'{"calls": 4}'
+    assert (await get(client, user="3"))[2] == b'{"calls": 5}'
+    client.cache.invalidate("other")
+    assert (await get(client))[2] == b'{"calls": 4}'
+    client.clock.now = 10
+    assert (await get(client))[2] == b'{"calls": 6}'
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from oauth_helper.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_result():
+    flight: SingleFlight[str, int] = SingleFlight()
+    calls = 0
+
+    async def exchange() -> int:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    results = await asyncio.gather(*(flight.run("token", exchange) for _ in range(8)))
+    assert results == [1] * 8
+    assert calls == 1
+    assert len(flight) == 0
+    assert await flight.run("token", exchange) == 2
+
+
+@pytest.mark.asyncio
+async def test_exceptions_are_shared():
+    flight: SingleFlight[str, int] = SingleFlight()
+
+    async def exchange() -> int:
+        await asyncio.sleep(0.01)
+        raise ValueError("revoked")
+
+    results = await asyncio.gather(
+        *(flight.run("token", exchange) for _ in range(3)), return_exceptions=True
+    )
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_others():
+    flight: SingleFlight[str, str] = SingleFlight()
+
+    async def exchange() -> str:
+        await asyncio.sleep(0.02)
+        return "done"
+
+    first = asyncio.ensure_future(flight.run("token", exchange))
+    second = asyncio.ensure_future(flight.run("token", exchange))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == "done"